@@ -0,0 +1,143 @@
+"""
+asyncio counterpart of gapipy.client
+
+Requires Python 3.7+ and the httpx module.
+
+    from gapipy.async_client import AsyncClient
+
+    async with AsyncClient(application_key='MY_SECRET_KEY') as api:
+        dossier = await api.tour_dossiers.get(24309)
+        async for departure in dossier.departures:
+            ...
+"""
+import asyncio
+import json
+from functools import partial
+
+from .client import Client, _get_protocol_prefix, logger
+from .exceptions import EmptyPartialUpdateError
+
+
+class AsyncClient(Client):
+    """
+    A Client whose queries, requests and resources return awaitables.
+
+    It accepts the same configuration as `Client`, shares its cache backends
+    and resource classes, and uses an `httpx.AsyncClient` as its requestor.
+    Request coalescing (`single_flight_options`) and the object cache
+    (`object_cache_options`) are not supported.
+    """
+
+    is_async = True
+
+    def __init__(self, **config):
+        super(AsyncClient, self).__init__(**config)
+        if self.single_flight_options['enable']:
+            raise ValueError('AsyncClient does not support single_flight_options')
+        if self.object_cache_options['enable']:
+            raise ValueError('AsyncClient does not support object_cache_options')
+        # the background tasks refreshing stale cache entries, by cache key
+        self._revalidating = {}
+
+    @property
+    def query_class(self):
+        from .async_query import AsyncQuery
+        return AsyncQuery
+
+    def _set_requestor(self, pool_options, max_retries):
+        """
+        Set the requestor to an `httpx.AsyncClient`, sized from the connection
+        pooling options.
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError('no httpx module found')
+
+        if not pool_options['enable']:
+            limits = httpx.Limits()
+        else:
+            limits = httpx.Limits(
+                max_connections=int(pool_options['number']) * int(pool_options['maxsize']),
+                max_keepalive_connections=int(pool_options['maxsize']),
+            )
+            logger.info(
+                'Created connection pool (number=%d, maxsize=%d)',
+                pool_options['number'],
+                pool_options['maxsize'],
+            )
+
+        transport = httpx.AsyncHTTPTransport(limits=limits, retries=int(max_retries))
+        prefix = _get_protocol_prefix(self.api_root)
+        if prefix:
+            mounts = {prefix: transport}
+        else:
+            mounts = {'http://': transport, 'https://': transport}
+
+        # requests does not time out unless asked to, neither do we
+        self._requestor = httpx.AsyncClient(mounts=mounts, timeout=None)
+
+    async def _run_cache(self, func, *args):
+        """
+        Return `func(*args)`, a call to the cache backend, run in the event
+        loop's default executor unless the backend is `in_process`, so that
+        a cache backend reached over the network or on disk (e.g. RedisCache
+        or SQLiteCache) does not block the event loop.
+        """
+        if self._cache.in_process:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+    async def aclose(self):
+        """Close the connections held by the underlying `httpx.AsyncClient`."""
+        await self._requestor.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def create(self, resource_name, data_dict, headers=None):
+        """
+        Create an instance of the specified resource with `data_dict`
+        """
+        try:
+            query = getattr(self, resource_name)
+        except AttributeError:
+            raise AttributeError("No resource named %s is defined." % resource_name)
+
+        return query.create(data_dict, headers=headers)
+
+    async def _fetch_resource(self, resource, httperrors_mapped_to_none=None):
+        """Async implementation of `Resource.fetch`."""
+        logger.info('Fetching %s/%s', resource._resource_name, resource.id)
+
+        resource_obj = await getattr(self, resource._resource_name).get(
+            resource.id,
+            variation_id=getattr(resource, 'variation_id', None),
+            httperrors_mapped_to_none=httperrors_mapped_to_none)
+        if resource_obj:
+            resource._fill_fields(resource_obj._raw_data)
+            resource.is_stub = False
+
+        return resource
+
+    async def _save_resource(self, resource, partial=False):
+        """Async implementation of `Resource.save`."""
+        from .async_request import AsyncAPIRequestor
+
+        requestor = AsyncAPIRequestor(self, resource)
+        if resource._is_update():
+            try:
+                data = resource._update_data(partial=partial)
+            except EmptyPartialUpdateError:
+                if self.raise_on_empty_update:
+                    raise
+                return resource
+            result = await requestor.update(resource.id, json.dumps(data), partial=partial)
+        else:
+            result = await requestor.create(resource.to_json())
+
+        resource._fill_fields(result)
+        return resource
@@ -0,0 +1,279 @@
+"""
+asyncio counterpart of gapipy.query, used by gapipy.async_client.AsyncClient
+
+Requires Python 3.7+.
+"""
+import asyncio
+import json
+from time import time
+
+from requests import HTTPError
+
+from .async_request import AsyncAPIRequestor
+from .constants import HTTPERRORS_MAPPED_TO_NONE
+from .query import PREFETCH_BATCH_SIZE, Query, _check_listable
+
+
+class AsyncQuery(Query):
+    """
+    A Query whose network-bound methods are coroutines.
+
+    `get`, `get_resource_data`, `count`, `first`, `create` and `options` must
+    be awaited, and `all` returns an async generator, i.e.
+
+        async for dossier in client.tour_dossiers.filter(name="Peru"):
+            ...
+
+    The cache backend, `query_key` and `filter` are shared with `Query`. The
+    cache backend is called in the event loop's default executor, unless it
+    is an in-process one, see `AsyncClient._run_cache`.
+    """
+
+    def __iter__(self):
+        raise TypeError(
+            "{} is not iterable, use `async for` instead".format(self.__class__.__name__)
+        )
+
+    def __aiter__(self):
+        return self.all()
+
+    async def get(self, resource_id, variation_id=None, cached=True, headers=None,
+                  httperrors_mapped_to_none=HTTPERRORS_MAPPED_TO_NONE, timeout=None):
+        """
+        Returns an instance of the query resource with the given `resource_id`
+        (and optional `variation_id`). See `Query.get`.
+        """
+        try:
+            data = await self.get_resource_data(
+                resource_id,
+                variation_id=variation_id,
+                cached=cached,
+                headers=headers,
+                timeout=timeout
+            )
+        except HTTPError as e:
+            if httperrors_mapped_to_none and e.response.status_code in httperrors_mapped_to_none:
+                return None
+            raise e
+        resource_object = self.resource(data, client=self._client)
+        return resource_object
+
+    async def get_resource_data(self, resource_id, variation_id=None, cached=True, headers=None, timeout=None):
+        """
+        Returns a dictionary of resource data, which is used to initialize
+        a Resource object in the `get` method.
+        """
+        key = self.query_key(resource_id, variation_id)
+        entry = await self._client._run_cache(self._cache_get, key) if cached else None
+        if entry is not None:
+            if not entry.is_stale():
+                return self._entry_data(key, entry)
+            # serve stale data while it is refreshed in the background, for
+            # the stale-while-revalidate grace period
+            if not entry.is_stale(time() - self._client.stale_while_revalidate):
+                self._revalidate(key, resource_id, variation_id, headers, timeout, entry)
+                return entry.data
+
+        # Cache miss (or expired entry); get fresh data from the backend, set
+        # in cache
+        out = await self._fetch_resource_data(key, resource_id, variation_id, headers, timeout, entry)
+        self._filters = {}
+        return out
+
+    async def _fetch_resource_data(self, key, resource_id, variation_id, headers, timeout, entry=None):
+        """
+        Request the resource data from the API (revalidating the expired cache
+        `entry`, if any) and set it in the cache.
+        """
+        requestor = AsyncAPIRequestor(self._client, self.resource)
+        try:
+            out, validators = await self._request_resource_data(
+                requestor, resource_id, variation_id, headers, timeout, entry)
+        except HTTPError as e:
+            await self._client._run_cache(self._cache_set_negative, {key: e})
+            raise e
+        if out is not None:
+            await self._client._run_cache(self._cache_set, key, out, validators)
+        return out
+
+    async def _request_resource_data(self, requestor, resource_id, variation_id, headers, timeout, entry=None):
+        """See `Query._request_resource_data`."""
+        if not self._client.revalidation_window:
+            out = await requestor.get(resource_id, variation_id=variation_id, headers=headers, timeout=timeout)
+            return out, None
+
+        etag = entry.etag if entry is not None else None
+        last_modified = entry.last_modified if entry is not None else None
+        out, validators = await requestor.get_conditional(
+            resource_id, variation_id=variation_id, headers=headers, timeout=timeout,
+            etag=etag, last_modified=last_modified)
+        return self._revalidated(entry, out, validators)
+
+    def _revalidate(self, key, resource_id, variation_id, headers, timeout, entry=None):
+        """
+        Refresh the cache entry for `key` in a background task, unless one is
+        already doing so.
+        """
+        revalidating = self._client._revalidating
+        if key in revalidating:
+            return
+
+        async def refresh():
+            try:
+                await self._fetch_resource_data(key, resource_id, variation_id, headers, timeout, entry)
+            except Exception as exc:  # pylint: disable=broad-except
+                self._client.logger.error('Background refresh of %s failed: %r', key, exc)
+            finally:
+                revalidating.pop(key, None)
+
+        # keep a reference to the task, the event loop only holds a weak one
+        revalidating[key] = asyncio.ensure_future(refresh())
+
+    async def get_many(self, resource_ids, variation_ids=None, cached=True, headers=None,
+                       httperrors_mapped_to_none=HTTPERRORS_MAPPED_TO_NONE, timeout=None,
+                       max_workers=8):
+        """
+        Returns a list of instances of the query resource, one for each of
+        `resource_ids`, in order. See `Query.get_many`; here `max_workers`
+        bounds the number of concurrent requests.
+        """
+        data = await self.get_many_resource_data(
+            resource_ids,
+            variation_ids=variation_ids,
+            cached=cached,
+            headers=headers,
+            httperrors_mapped_to_none=httperrors_mapped_to_none,
+            timeout=timeout,
+            max_workers=max_workers,
+        )
+        return [
+            self.resource(d, client=self._client) if d is not None else None
+            for d in data
+        ]
+
+    async def get_many_resource_data(self, resource_ids, variation_ids=None, cached=True, headers=None,
+                                     httperrors_mapped_to_none=HTTPERRORS_MAPPED_TO_NONE, timeout=None,
+                                     max_workers=8):
+        """
+        Returns the list of resource data dictionaries (or `None`s) which are
+        used to initialize Resource objects in the `get_many` method.
+        """
+        triples = self._get_many_keys(resource_ids, variation_ids)
+        keys = [key for key, _, _ in triples]
+        ids = {key: (resource_id, variation_id) for key, resource_id, variation_id in triples}
+
+        found, errors, expired = {}, {}, {}
+        if cached:
+            # read in the executor, while stale entries are revalidated by
+            # tasks of this event loop
+            entries = await self._client._run_cache(self._cache_get_many, keys)
+            found, errors, expired = self._split_cached(entries, ids, headers, timeout)
+
+        # request each missing key once
+        misses = {key: ids[key] for key in keys if key not in found and key not in errors}
+
+        requestor = AsyncAPIRequestor(self._client, self.resource)
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(key):
+            async with semaphore:
+                try:
+                    return await self._request_resource_data(
+                        requestor, ids[key][0], ids[key][1], headers, timeout, expired.get(key))
+                except HTTPError as e:
+                    return e, None
+
+        if misses:
+            fetched = dict(zip(misses, await asyncio.gather(*(fetch(key) for key in misses))))
+            await self._client._run_cache(self._store_fetched, fetched, found, errors)
+
+        for e in errors.values():
+            if not (httperrors_mapped_to_none and e.response.status_code in httperrors_mapped_to_none):
+                raise e
+
+        return [found.get(key) for key in keys]
+
+    async def _resolve_prefetch(self, objects):
+        for resource_cls, stubs in self._prefetch_groups(objects):
+            ids, variation_ids = zip(*stubs.keys())
+            query = AsyncQuery(self._client, resource_cls)
+            self._fill_stubs(stubs, await query.get_many_resource_data(ids, variation_ids))
+
+    @_check_listable
+    async def all(self, limit=None, cursor=None):
+        """Async generator of instances of the query resource. If limit is set
+        to a positive integer `n`, only return the first `n` results.
+
+        A `gapipy.request.PageCursor` may be passed as `cursor` to track (and
+        later resume) the position of the listing, see `Query.all`.
+        """
+        # check limit is valid integer value
+        if limit is not None:
+            if not isinstance(limit, int):
+                raise TypeError("limit must be an integer")
+            elif limit <= 0:
+                raise ValueError("limit must be a positive integer")
+
+        requestor = AsyncAPIRequestor(
+            self._client,
+            self.resource,
+            params=self._filters,
+            parent=self.parent
+        )
+        href = None
+        if isinstance(self._raw_data, dict):
+            href = self._raw_data.get("href")
+
+        seen = 0
+        batch = []
+        async for result in requestor.list(href, cursor=cursor):
+            obj = self.resource(result, client=self._client, stub=True)
+            seen += 1
+            if not self._prefetch:
+                yield obj
+            else:
+                batch.append(obj)
+                if len(batch) == PREFETCH_BATCH_SIZE or seen == limit:
+                    await self._resolve_prefetch(batch)
+                    for obj in batch:
+                        yield obj
+                    batch = []
+            if seen == limit:
+                return
+
+        if batch:
+            await self._resolve_prefetch(batch)
+            for obj in batch:
+                yield obj
+
+    @_check_listable
+    async def count(self):
+        """Returns the number of element in the query."""
+        requestor = AsyncAPIRequestor(
+            self._client,
+            self.resource,
+            params=self._filters,
+            parent=self.parent
+        )
+        response = await requestor.list_raw()
+        return response.get("count")
+
+    async def create(self, data_dict, headers=None):
+        """Create an instance of the query resource using the given data"""
+        requestor = AsyncAPIRequestor(self._client, self.resource)
+        response = await requestor.create(json.dumps(data_dict), headers=headers)
+        return self.resource(response, client=self._client)
+
+    async def first(self):
+        """
+        Returns the first object of a query, returns None if no match is found.
+        """
+        async for result in self.all(limit=1):
+            return result
+        return None
+
+    async def options(self):
+        """
+        return the OPTIONS response for the resource bound to this Query
+        """
+        return await AsyncAPIRequestor(self._client, self.resource).options()
@@ -0,0 +1,114 @@
+"""
+asyncio counterpart of gapipy.request, used by gapipy.async_client.AsyncClient
+
+Requires Python 3.7+ and the httpx module.
+"""
+from requests import HTTPError
+from requests.status_codes import codes
+
+from gapipy.constants import ACCEPTABLE_RESPONSE_STATUS_CODES
+from gapipy.exceptions import TimeoutError
+from gapipy.request import APIRequestor, PageCursor, _cache_validators, _next_href
+
+
+class AsyncAPIRequestor(APIRequestor):
+    """
+    An APIRequestor which makes its HTTP calls through an `httpx.AsyncClient`.
+
+    Every method which ends up in `_make_call` (get, options, create, update,
+    list_raw) returns an awaitable, while `list` is an async generator.
+    """
+
+    async def _make_call(self, method, url, headers, data, params, timeout):
+        """Make the actual request to the API, using the given URL, headers,
+        data and extra parameters.
+        """
+        response = await self._send(method, url, headers, data, params, timeout)
+        return self._handle_response(response)
+
+    async def _send(self, method, url, headers, data, params, timeout):
+        """Send the request to the API, and return its response."""
+        import httpx
+
+        self.client.logger.debug('Making a {0} request to {1}'.format(method, url))
+
+        # requests drops headers set to None (i.e. a missing application
+        # key), httpx refuses them
+        headers = {k: v for k, v in headers.items() if v is not None}
+        kwargs = {}
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        try:
+            response = await self.client.requestor.request(
+                method, url, headers=headers, content=data, params=params, **kwargs)
+        except httpx.TimeoutException as exc:
+            # if a timeout is defined, chain it to and raise our TimeoutError
+            if timeout:
+                raise TimeoutError from exc
+            # otherwise re-raise the original exception
+            raise
+        return response
+
+    def _handle_response(self, response):
+        """Return the JSON data of `response`, raising its HTTP error if any."""
+        if response.status_code in ACCEPTABLE_RESPONSE_STATUS_CODES:
+            return response.json()
+
+        # raise error if 4xx or 5xx response status, using the same exception
+        # type as the synchronous requestor so that `httperrors_mapped_to_none`
+        # and callers' error handling behave the same with either client.
+        if response.status_code < 400:
+            return None
+        kind = 'Client' if response.status_code < 500 else 'Server'
+        raise HTTPError(
+            '{0} {1} Error: {2} for url: {3}'.format(
+                response.status_code, kind, response.text, response.url),
+            response=response,
+        )
+
+    async def get_conditional(self, resource_id, variation_id=None, headers=None, timeout=None,
+                              etag=None, last_modified=None):
+        """See `APIRequestor.get_conditional`"""
+        url, headers, params = self._prepare_conditional_request(
+            resource_id, variation_id, headers, etag, last_modified)
+        response = await self._send('GET', url, headers, None, params, timeout)
+        if response.status_code == codes.NOT_MODIFIED:
+            return None, _cache_validators(response.headers)
+        return self._handle_response(response), _cache_validators(response.headers)
+
+    async def list_raw(self, uri=None):
+        """See `APIRequestor.list_raw`"""
+        run_cache = self.client._run_cache
+        # reads the generation token of the listings from the cache too
+        key = await run_cache(self._listing_key, uri)
+        if key is not None:
+            response = await run_cache(self.client._cache_get, key)
+            if response is not None:
+                return response
+
+        response = await self._list_raw(uri)
+        if key is not None and response is not None:
+            await run_cache(self.client._cache_set, key, response, self.client.listing_cache_timeout)
+        return response
+
+    async def list(self, uri=None, cursor=None):
+        """Async generator for listing resources, see `APIRequestor.list`"""
+        if cursor is None:
+            cursor = PageCursor()
+        if cursor.page:
+            uri, skip = cursor.href, cursor.offset
+        else:
+            cursor.advance(uri)
+            skip = 0
+
+        while True:
+            response = await self.list_raw(uri)
+            for result in response['results'][skip:]:
+                cursor.consume()
+                yield result
+
+            uri = _next_href(response)
+            if uri is None:
+                return
+            cursor.advance(uri)
+            skip = 0
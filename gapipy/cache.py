@@ -1,4 +1,21 @@
+import bisect
+import errno
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import stat
+import struct
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from importlib import import_module
 from time import time
+from uuid import uuid4
 
 try:
     # Python 2
@@ -7,6 +24,12 @@ except ImportError:
     # Python 3
     import pickle as pickle
 
+try:
+    import fcntl
+except ImportError:
+    # not on Windows
+    fcntl = None
+
 try:
     from django.conf import settings as django_settings
 
@@ -16,6 +39,8 @@ try:
 except ImportError:
     django_caches = django_settings = None
 
+logger = logging.getLogger(__name__)
+
 
 class BaseCache(object):
     """
@@ -26,90 +51,1564 @@ class BaseCache(object):
                             timeout is specified on :meth:`set`.
     """
 
+    _stats = None
+
+    # True for the backends which never wait on the network or the disk, which
+    # the AsyncClient calls from the event loop rather than an executor
+    in_process = False
+
     def __init__(self, default_timeout=300, **kwargs):
         self.default_timeout = default_timeout
 
+    @property
+    def stats(self):
+        """
+        The CacheStats the evictions are reported to, set by the client, and
+        passed on to the backends this one is built on.
+        """
+        return self._stats
+
+    @stats.setter
+    def stats(self, stats):
+        self._stats = stats
+        for backend in self._backends():
+            backend.stats = stats
+
+    def _backends(self):
+        """Return the backends this one stores its values in."""
+        return ()
+
+    def _evicted(self, keys):
+        """Report the `keys` evicted to make room for others."""
+        if self.stats is not None and keys:
+            self.stats.add('evictions', keys)
+
     def get(self, key):
         return None
 
-    def set(self, key, value):
+    def set(self, key, value, timeout=None):
         pass
 
+    def get_many(self, keys):
+        """
+        Return a dict of the values found for `keys`, keys which are not in
+        the cache are left out. Backends which can fetch several keys in one
+        go should override this.
+        """
+        values = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set_many(self, mapping, timeout=None):
+        """
+        Set every key and value of the `mapping` dict. Backends which can set
+        several keys in one go should override this.
+        """
+        for key, value in mapping.items():
+            self.set(key, value, timeout=timeout)
+
     def delete(self, key):
         pass
 
+    def delete_many(self, keys):
+        """
+        Delete every key of `keys`. Backends which can delete several keys in
+        one go should override this.
+        """
+        for key in keys:
+            self.delete(key)
+
     def clear(self):
         pass
 
+    def purge(self, prefix, progress=None):
+        """
+        Delete every key starting with `prefix`, and return how many were
+        deleted. `progress(deleted)` is called as batches of keys are deleted,
+        with the running total.
+
+        Backends which cannot find the keys with a prefix raise a
+        NotImplementedError.
+        """
+        raise NotImplementedError('{} does not support purge'.format(type(self).__name__))
+
     def count(self):
         raise NotImplementedError
 
     def is_cached(self, key):
         return False
 
+    def lock(self, key, timeout=None):
+        """
+        Return a lock on `key` shared by every process using this cache, with
+        `acquire(blocking_timeout)` and `release()` methods, held for at most
+        `timeout` seconds. Backends which cannot share a lock return None.
+        """
+        return None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls made for the same key, so that only one of them
+    runs at a time while the others wait for, and share, its outcome.
+    """
+
+    class _Call(object):
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        Return the result of `func()`, or of the call of it already in flight
+        for `key`. An exception raised by the call is raised to every caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        self._run(key, call, func)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def do_in_background(self, key, func):
+        """
+        Call `func()` in a background thread, unless a call is already in
+        flight for `key`. Returns True if a call was started. Exceptions raised
+        by a background call are logged, and shared with any caller of `do`
+        which joined it.
+        """
+        with self._lock:
+            if key in self._calls:
+                return False
+            call = self._calls[key] = self._Call()
+
+        def run():
+            self._run(key, call, func)
+            if call.error is not None:
+                logger.error('Background call for %s failed: %r', key, call.error)
+
+        thread = threading.Thread(target=run, name='gapipy-single-flight')
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def _run(self, key, call, func):
+        try:
+            call.result = func()
+        except Exception as exc:  # pylint: disable=broad-except
+            call.error = exc
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class CacheStats(object):
+    """
+    Counts the cache lookups which were hits, negative hits (see
+    `CacheEntry`) or misses and the time they took, the values set, the
+    keys the backend evicted and the gets served by the `ObjectCache`, by
+    resource name, i.e. the part of the cache keys before the first colon
+    (after it for cached listings).
+
+    Every update is also passed to `callback(resource_name, metric, value)`,
+    to export the metrics to e.g. StatsD or Prometheus. `lookup_time` is in
+    seconds.
+    """
+
+    METRICS = ('hits', 'negative_hits', 'misses', 'lookup_time', 'sets', 'evictions', 'object_hits')
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def lookup(self, keys, values, seconds):
+        """Record a lookup of `keys` which found `values`, a dict by key."""
+        counts = {metric: {} for metric in ('hits', 'negative_hits', 'misses', 'lookup_time')}
+        # share the time of a multi-key lookup between its keys
+        share = seconds / len(keys) if keys else 0.0
+        for key in keys:
+            name = _resource_name(key)
+            value = values.get(key)
+            if value is None:
+                metric = 'misses'
+            elif CacheEntry.load(value).is_negative:
+                metric = 'negative_hits'
+            else:
+                metric = 'hits'
+            counts[metric][name] = counts[metric].get(name, 0) + 1
+            counts['lookup_time'][name] = counts['lookup_time'].get(name, 0.0) + share
+        for metric, by_name in counts.items():
+            self._update(metric, by_name)
+
+    def add(self, metric, keys):
+        """Add one to the `metric` of the resource of each key of `keys`."""
+        by_name = {}
+        for key in keys:
+            name = _resource_name(key)
+            by_name[name] = by_name.get(name, 0) + 1
+        self._update(metric, by_name)
+
+    def _update(self, metric, by_name):
+        with self._lock:
+            for name, value in by_name.items():
+                if name not in self._stats:
+                    self._stats[name] = dict.fromkeys(self.METRICS, 0)
+                self._stats[name][metric] += value
+        if self.callback is None:
+            return
+        for name, value in by_name.items():
+            try:
+                self.callback(name, metric, value)
+            except Exception:  # pylint: disable=broad-except
+                # the metrics sink failing must not fail the request
+                logger.exception('Cache stats callback failed')
+
+    def snapshot(self, reset=False):
+        """Return a copy of the metrics by resource name, and reset them."""
+        with self._lock:
+            stats = {name: dict(metrics) for name, metrics in self._stats.items()}
+            if reset:
+                self._stats = {}
+        return stats
+
+
+def _resource_name(key):
+    """
+    Return the resource name of a cache key: its first part, or the second
+    one for the `listings:<name>:...` keys of cached listings.
+    """
+    parts = key.split(':', 2)
+    if parts[0] == 'listings' and len(parts) > 1:
+        return parts[1]
+    return parts[0]
+
+
+class CacheEntry(object):
+    """
+    Resource data as stored in the cache, along with its metadata.
+
+    `fresh_until` is the time after which the data is stale, while it may
+    still be served until the cache backend expires it.
+
+    A negative entry has no data, but the `status` of the HTTP error the API
+    responded with instead. `etag` and `last_modified` are the validators of
+    the response the data came with, used to revalidate it once stale.
+
+    An entry without metadata is stored as the bare data, as it always has
+    been, while an entry with metadata is stored as a dict tagged with
+    `MARKER`; `load` reads back either kind.
+    """
+
+    MARKER = '_gapipy_entry'
+
+    def __init__(self, data, fresh_until=None, status=None, etag=None, last_modified=None):
+        self.data = data
+        self.fresh_until = fresh_until
+        self.status = status
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @classmethod
+    def load(cls, value):
+        """Return the entry stored as `value`, or None if `value` is None."""
+        if value is None:
+            return None
+        if isinstance(value, dict) and cls.MARKER in value:
+            return cls(
+                value['data'],
+                fresh_until=value.get('fresh_until'),
+                status=value.get('status'),
+                etag=value.get('etag'),
+                last_modified=value.get('last_modified'),
+            )
+        return cls(value)
+
+    def dump(self):
+        """Return the value to store this entry as."""
+        metadata = {
+            name: getattr(self, name)
+            for name in ('fresh_until', 'status', 'etag', 'last_modified')
+            if getattr(self, name) is not None
+        }
+        if not metadata:
+            return self.data
+        return dict(metadata, data=self.data, **{self.MARKER: 1})
+
+    @property
+    def is_negative(self):
+        return self.status is not None
+
+    def is_stale(self, now=None):
+        if self.fresh_until is None:
+            return False
+        return (now or time()) >= self.fresh_until
+
+
+class PickleCodec(object):
+    tag = b'p'
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONCodec(object):
+    """
+    Stores values as JSON, readable from other languages. Tuples come back as
+    lists, and dict keys as strings, as they do from the API.
+    """
+
+    tag = b'j'
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+class MsgpackCodec(object):
+    """Stores values with msgpack, which is smaller and faster than JSON."""
+
+    tag = b'm'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise RuntimeError('no msgpack module found')
+        self._msgpack = msgpack
+
+    def dumps(self, value):
+        return self._msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return self._msgpack.unpackb(data, raw=False)
+
+
+class ZlibCompressor(object):
+    tag = b'z'
+
+    def compress(self, data):
+        return zlib.compress(data)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(object):
+    tag = b'l'
+
+    def __init__(self):
+        try:
+            import lz4.frame
+        except ImportError:
+            raise RuntimeError('no lz4 module found')
+        self._frame = lz4.frame
+
+    def compress(self, data):
+        return self._frame.compress(data)
+
+    def decompress(self, data):
+        return self._frame.decompress(data)
+
+
+class Serializer(object):
+    """
+    Turns cached values into bytes and back, encoded with `codec` ('pickle',
+    'json' or 'msgpack') and, once they are at least `compress_threshold`
+    bytes long, compressed with `compression` ('zlib' or 'lz4').
+
+    Encoded values start with a header tagging the format version, codec and
+    compression they were written with, so values written with other settings
+    are still read back, and the settings can change without flushing the
+    cache. Values without a header are read as pickle; for compatibility with
+    the values stored by earlier versions, uncompressed pickle is still
+    written without one.
+    """
+
+    HEADER = b'\x00G1'
+    UNCOMPRESSED = b'-'
+
+    CODECS = {
+        'pickle': PickleCodec,
+        'json': JSONCodec,
+        'msgpack': MsgpackCodec,
+    }
+    COMPRESSORS = {
+        'zlib': ZlibCompressor,
+        'lz4': LZ4Compressor,
+    }
+
+    def __init__(self, codec='pickle', compression=None, compress_threshold=1024):
+        if codec not in self.CODECS:
+            raise ValueError('Unknown cache serializer: {}'.format(codec))
+        if compression is not None and compression not in self.COMPRESSORS:
+            raise ValueError('Unknown cache compression: {}'.format(compression))
+        self.codec = self.CODECS[codec]()
+        self.compressor = self.COMPRESSORS[compression]() if compression else None
+        self.compress_threshold = compress_threshold
+        # the codecs and compressors values may be read with, by tag
+        self._codecs = {self.codec.tag: self.codec}
+        self._compressors = {self.compressor.tag: self.compressor} if self.compressor else {}
+
+    def dumps(self, value):
+        data = self.codec.dumps(value)
+        compression = self.UNCOMPRESSED
+        if self.compressor is not None and len(data) >= self.compress_threshold:
+            data = self.compressor.compress(data)
+            compression = self.compressor.tag
+        if self.codec.tag == PickleCodec.tag and compression == self.UNCOMPRESSED:
+            return data
+        return self.HEADER + self.codec.tag + compression + data
+
+    def loads(self, data):
+        if not data.startswith(self.HEADER):
+            return pickle.loads(data)
+        start = len(self.HEADER)
+        codec_tag, compression, data = data[start:start + 1], data[start + 1:start + 2], data[start + 2:]
+        if compression != self.UNCOMPRESSED:
+            data = self._by_tag(self._compressors, self.COMPRESSORS, compression).decompress(data)
+        return self._by_tag(self._codecs, self.CODECS, codec_tag).loads(data)
+
+    @staticmethod
+    def _by_tag(instances, classes, tag):
+        if tag not in instances:
+            for cls in classes.values():
+                if cls.tag == tag:
+                    instances[tag] = cls()
+                    break
+            else:
+                raise ValueError('Unknown cache value format: {!r}'.format(tag))
+        return instances[tag]
+
 
 class NullCache(BaseCache):
     """
     A cache that doesn't cache.
     """
 
+    in_process = True
+
+    def purge(self, prefix, progress=None):
+        return 0
+
 
 class SimpleCache(BaseCache):
     """
-    Simply memory cache for single process environments. This class
-    exists mainly for a development server and is not 100% thread safe.
+    In-memory cache for a single process, safe to share between threads.
+
+    Keys are spread over `stripes` independently locked segments, each evicting
+    its least recently used keys once it holds its share of `threshold` keys,
+    or of `max_bytes` bytes of serialized values, so every operation runs in
+    constant time. Expired keys are dropped when they are next read, or
+    evicted like any other.
 
     :param threshold: the maximum number of items the cache stores
-                      before it starts evicting keys.
+                      before it starts evicting keys, or None.
+    :param max_bytes: the maximum size of the serialized values the cache
+                      stores before it starts evicting keys, or None. A value
+                      larger than a stripe's share of it is not stored.
+    :param stripes: the number of independently locked segments.
+    :param serializer, compression, compress_threshold: see `Serializer`. With
+                      a `serializer` of None the values are stored as they
+                      are, without being copied: they must not be changed
+                      once set or read, and `max_bytes` cannot be used.
     """
 
-    def __init__(self, threshold=500, default_timeout=300, **kwargs):
+    in_process = True
+
+    def __init__(self, threshold=500, default_timeout=300, stripes=16, max_bytes=None,
+                 serializer='pickle', compression=None, compress_threshold=1024, **kwargs):
         super(SimpleCache, self).__init__(default_timeout, **kwargs)
-        self._cache = {}
         self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.serializer = None
+        size = _unsized
+        if serializer is not None:
+            self.serializer = Serializer(serializer, compression, compress_threshold)
+            size = len
+        elif max_bytes is not None:
+            raise ValueError('SimpleCache cannot measure max_bytes of values which are not serialized')
+        if threshold is not None:
+            stripes = max(1, min(stripes, threshold))
+        # share the limits exactly between the stripes
+        self._stripes = [
+            _LRUStripe(_share(threshold, stripes, i), _share(max_bytes, stripes, i), size)
+            for i in range(stripes)
+        ]
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def _by_stripe(self, keys):
+        """Group `keys` by stripe, so that each stripe is locked only once."""
+        groups = {}
+        for key in keys:
+            groups.setdefault(self._stripe(key), []).append(key)
+        return groups.items()
 
-    def _prune(self):
-        if len(self._cache) > self.threshold:
-            now = time()
-            # Prune expired keys, or every few keys.
-            for idx, (key, (expires, _)) in enumerate(self._cache.items()):
-                if expires <= now or idx % 3 == 0:
-                    self._cache.pop(key, None)
+    def _dumps(self, value):
+        return value if self.serializer is None else self.serializer.dumps(value)
+
+    def _loads(self, value):
+        return value if self.serializer is None else self.serializer.loads(value)
 
     def get(self, key):
-        expires, value = self._cache.get(key, (0, None))
-        if expires > time():
-            return pickle.loads(value)
+        value = self._stripe(key).get(key, time())
+        if value is not None:
+            return self._loads(value)
 
     def set(self, key, data_dict, timeout=None):
         if timeout is None:
             timeout = self.default_timeout
-        self._prune()
-        self._cache[key] = (time() + timeout, pickle.dumps(data_dict,
-                                                           pickle.HIGHEST_PROTOCOL))
+        value = self._dumps(data_dict)
+        self._evicted(self._stripe(key).set(key, time() + timeout, value))
+
+    def get_many(self, keys):
+        now = time()
+        values = {}
+        for stripe, stripe_keys in self._by_stripe(keys):
+            for key, value in stripe.get_many(stripe_keys, now):
+                values[key] = self._loads(value)
+        return values
+
+    def set_many(self, mapping, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time() + timeout
+        for stripe, stripe_keys in self._by_stripe(mapping):
+            self._evicted(stripe.set_many(
+                [(key, self._dumps(mapping[key])) for key in stripe_keys],
+                expires,
+            ))
 
     def delete(self, key):
-        return self._cache.pop(key, None)
+        return self._stripe(key).delete(key)
+
+    def delete_many(self, keys):
+        for stripe, stripe_keys in self._by_stripe(keys):
+            stripe.delete_many(stripe_keys)
 
     def clear(self):
-        self._cache.clear()
+        for stripe in self._stripes:
+            stripe.clear()
+
+    def purge(self, prefix, progress=None):
+        deleted = 0
+        for stripe in self._stripes:
+            deleted += stripe.purge(prefix)
+            if progress is not None:
+                progress(deleted)
+        return deleted
 
     def count(self):
-        return len(self._cache)
+        return sum(len(stripe) for stripe in self._stripes)
+
+    def info(self):
+        """
+        Return the number of entries and bytes stored, in total and for each
+        resource name, along with the limits of the cache.
+        """
+        resources = {}
+        for stripe in self._stripes:
+            for key, size in stripe.sizes():
+                stats = resources.setdefault(_resource_name(key), {'entries': 0, 'bytes': 0})
+                stats['entries'] += 1
+                stats['bytes'] += size
+        return {
+            'entries': sum(stats['entries'] for stats in resources.values()),
+            'bytes': sum(stats['bytes'] for stats in resources.values()),
+            'threshold': self.threshold,
+            'max_bytes': self.max_bytes,
+            'resources': resources,
+        }
 
     def is_cached(self, key):
-        return key in self._cache
+        return self._stripe(key).contains(key, time())
+
+
+def _stable_hash(data):
+    """Return a 64-bit hash of the bytes `data`, the same in every process."""
+    return struct.unpack('<Q', hashlib.md5(data).digest()[:8])[0]
+
+
+def _unsized(value):
+    """The size of the values which are not serialized, which is not known."""
+    return 0
+
+
+def _share(total, parts, index):
+    """Return the `index`th of `parts` near-equal shares of `total`."""
+    if total is None:
+        return None
+    return total // parts + (1 if index < total % parts else 0)
+
+
+class _LRUStripe(object):
+    """
+    A lock and an OrderedDict of `key: (expires, value)` in least to most
+    recently used order, holding at most `capacity` keys and `max_bytes` bytes
+    of values (either limit being disabled when None), as measured by `size`.
+    """
+
+    def __init__(self, capacity, max_bytes=None, size=len):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.size = size
+        self.bytes = 0
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, now):
+        with self._lock:
+            return self._get(key, now)
+
+    def get_many(self, keys, now):
+        """Return the `(key, value)` pairs found for `keys`."""
+        found = []
+        with self._lock:
+            for key in keys:
+                value = self._get(key, now)
+                if value is not None:
+                    found.append((key, value))
+        return found
+
+    def _get(self, key, now):
+        item = self._pop(key)
+        if item is None:
+            return None
+        if item[0] <= now:
+            return None
+        # re-insert as the most recently used
+        self._items[key] = item
+        self.bytes += self.size(item[1])
+        return item[1]
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= self.size(item[1])
+        return item
+
+    def set(self, key, expires, value):
+        return self.set_many([(key, value)], expires)
+
+    def set_many(self, items, expires):
+        """Store the `(key, value)` pairs, and return the keys evicted."""
+        evicted = []
+        with self._lock:
+            for key, value in items:
+                self._pop(key)
+                # a value which could never fit is not stored at all
+                if self.max_bytes is not None and self.size(value) > self.max_bytes:
+                    continue
+                self._items[key] = (expires, value)
+                self.bytes += self.size(value)
+            while ((self.capacity is not None and len(self._items) > self.capacity)
+                   or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+                key, (_, value) = self._items.popitem(last=False)
+                self.bytes -= self.size(value)
+                evicted.append(key)
+        return evicted
+
+    def delete(self, key):
+        with self._lock:
+            return self._pop(key)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def purge(self, prefix):
+        with self._lock:
+            keys = [key for key in self._items if key.startswith(prefix)]
+            for key in keys:
+                self._pop(key)
+        return len(keys)
+
+    def contains(self, key, now):
+        with self._lock:
+            item = self._items.get(key)
+            return item is not None and item[0] > now
+
+    def sizes(self):
+        """Return the `(key, size in bytes)` pairs of the stored values."""
+        with self._lock:
+            return [(key, self.size(value)) for key, (_, value) in self._items.items()]
+
+
+class ObjectCache(object):
+    """
+    In-memory cache of hydrated `Resource` instances for a single process,
+    so repeated gets of a resource skip deserializing its data and building
+    its fields (dates, prices, nested models, ...) again.
+
+    The instances are stored and handed out as copies (see
+    `BaseModel._copy`), so changing a resource which was read from the cache
+    never changes the cached one. Up to `threshold` instances are kept, the
+    least recently used being evicted first, and each for at most `timeout`
+    seconds: this bounds how long an instance outlives a change made to the
+    resource by another process.
+
+    An instance is built from data which may be replaced in the meantime,
+    e.g. by a background revalidation, so it is set with the token `reserve`
+    returned before its data was read, and not stored if another thread
+    deleted the key since.
+    """
+
+    def __init__(self, threshold=500, timeout=60):
+        self.threshold = threshold
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        # the reservations of each key, as [thread, still valid] lists
+        self._reserved = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """Return a copy of the instance cached for `key`, or None."""
+        with self._lock:
+            item = self._items.pop(key, None)
+            if item is None or item[0] <= time():
+                return None
+            # re-insert as the most recently used
+            self._items[key] = item
+        return item[1]._copy()
+
+    def reserve(self, key):
+        """Return the token to `set` the instance built for `key` with."""
+        token = [threading.current_thread(), True]
+        with self._lock:
+            self._reserved.setdefault(key, []).append(token)
+        return token
+
+    def set(self, key, resource, token, timeout=None):
+        """
+        Cache a copy of `resource` for `key`, unless it was deleted since
+        `token` was reserved, for `timeout` seconds if that is shorter than
+        the cache's own timeout. A `resource` of None, or a `timeout` of 0,
+        only releases `token`.
+        """
+        item = None
+        if resource is not None and timeout != 0:
+            timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+            item = (time() + timeout, resource._copy())
+        with self._lock:
+            tokens = self._reserved[key]
+            tokens.remove(token)
+            if not tokens:
+                del self._reserved[key]
+            if item is None or not token[1]:
+                return
+            self._items.pop(key, None)
+            self._items[key] = item
+            while len(self._items) > self.threshold:
+                self._items.popitem(last=False)
+
+    def delete_many(self, keys):
+        current = threading.current_thread()
+        with self._lock:
+            for key in keys:
+                self._items.pop(key, None)
+                # the thread which reserved a key sets its data itself
+                for token in self._reserved.get(key, ()):
+                    if token[0] is not current:
+                        token[1] = False
+
+    def purge(self, prefix):
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                del self._items[key]
+            for key, tokens in self._reserved.items():
+                if key.startswith(prefix):
+                    for token in tokens:
+                        token[1] = False
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            for tokens in self._reserved.values():
+                for token in tokens:
+                    token[1] = False
+
+
+def _check_private(st, path):
+    """
+    Raise a ValueError unless the file of `os.stat` result `st` is owned by
+    the current user, and no other user can write to it: cache files are
+    unpickled, so whoever can write to them can run code in this process.
+    """
+    if not hasattr(os, 'getuid'):
+        # not on Windows
+        return
+    if st.st_uid != os.getuid() or st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise ValueError(
+            'Refusing to use {}, which is not owned by the current user or is '
+            'writable by other users'.format(path))
+
+
+def _private_dir(base):
+    """
+    Return the directory of the current user's cache files in `base`,
+    created readable and writable by that user only if needed.
+    """
+    name = 'gapipy-{}'.format(os.getuid()) if hasattr(os, 'getuid') else 'gapipy'
+    path = os.path.join(base, name)
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise ValueError('Refusing to use {}, which is not a directory'.format(path))
+    _check_private(st, path)
+    return path
+
+
+def _open_private(path):
+    """
+    Open the file at `path` for reading and writing, created readable and
+    writable by the current user only if needed, see `_check_private`.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    try:
+        _check_private(os.fstat(fd), path)
+    except ValueError:
+        os.close(fd)
+        raise
+    return fd
+
+
+class SQLiteCache(BaseCache):
+    """
+    Stores the cache in a SQLite database file, which outlives the process
+    and is shared by every process and thread on the host which opens it.
+
+    The database is written in WAL mode, so readers in any number of
+    processes do not block, nor are blocked by, the one writer, and is read
+    through a memory map of up to `mmap_size` bytes. Once it holds more than
+    `threshold` keys, or `max_bytes` bytes of serialized values, the expired
+    keys are dropped and then those closest to expiring, until it fits.
+
+    :param path: the database file, created if needed. Defaults to a file in
+                 a directory of the current user's in the temporary
+                 directory. An existing file (or directory) which another
+                 user owns or can write to is refused with a ValueError.
+    :param threshold: the maximum number of items the cache stores
+                      before it starts evicting keys, or None.
+    :param max_bytes: the maximum size of the serialized values the cache
+                      stores before it starts evicting keys, or None. A value
+                      larger than it is not stored.
+    :param busy_timeout: the number of seconds to wait for another process
+                         to finish writing.
+    :param serializer, compression, compress_threshold: see `Serializer`.
+    """
+
+    # the number of keys bound to a single statement, below SQLite's limit
+    BATCH_SIZE = 500
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS entries ('
+        ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, size INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)',
+        # the number of entries and bytes stored, kept up to date by triggers
+        'CREATE TABLE IF NOT EXISTS usage ('
+        ' id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO usage VALUES (0, 0, 0)',
+        'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN'
+        ' UPDATE usage SET entries = entries + 1, bytes = bytes + NEW.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN'
+        ' UPDATE usage SET entries = entries - 1, bytes = bytes - OLD.size; END',
+    ]
+
+    def __init__(self, path=None, threshold=500, default_timeout=300, max_bytes=None,
+                 mmap_size=64 * 1024 * 1024, busy_timeout=10, serializer='pickle',
+                 compression=None, compress_threshold=1024, **kwargs):
+        super(SQLiteCache, self).__init__(default_timeout, **kwargs)
+        self.path = path or os.path.join(_private_dir(tempfile.gettempdir()), 'cache.sqlite3')
+        os.close(_open_private(self.path))
+        # the files SQLite keeps next to the database in WAL mode
+        for suffix in ('-wal', '-shm'):
+            if os.path.lexists(self.path + suffix):
+                _check_private(os.lstat(self.path + suffix), self.path + suffix)
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.serializer = Serializer(serializer, compression, compress_threshold)
+        self._local = threading.local()
+        with self._transaction() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+
+    def _connection(self):
+        """
+        Return the connection of the current thread, opened anew in a forked
+        process rather than shared with its parent.
+        """
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            # autocommit, transactions are begun explicitly
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            db.execute('PRAGMA journal_mode = WAL')
+            db.execute('PRAGMA synchronous = NORMAL')
+            db.execute('PRAGMA mmap_size = {:d}'.format(self.mmap_size))
+            # so that INSERT OR REPLACE fires the delete trigger
+            db.execute('PRAGMA recursive_triggers = ON')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _transaction(self):
+        """Run a write transaction, holding the database's write lock."""
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    @classmethod
+    def _batches(cls, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), cls.BATCH_SIZE):
+            batch = keys[start:start + cls.BATCH_SIZE]
+            yield batch, ', '.join('?' * len(batch))
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM entries WHERE key = ? AND expires > ?', (key, time())).fetchone()
+        if row is not None:
+            return self.serializer.loads(bytes(row[0]))
+
+    def get_many(self, keys):
+        db = self._connection()
+        now = time()
+        values = {}
+        for batch, params in self._batches(keys):
+            rows = db.execute(
+                'SELECT key, value FROM entries WHERE key IN ({}) AND expires > ?'.format(params),
+                batch + [now])
+            for key, value in rows:
+                values[key] = self.serializer.loads(bytes(value))
+        return values
+
+    def set(self, key, data_dict, timeout=None):
+        self.set_many({key: data_dict}, timeout=timeout)
+
+    def set_many(self, mapping, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time() + timeout
+        rows = []
+        for key, value in mapping.items():
+            value = self.serializer.dumps(value)
+            # a value which could never fit is not stored at all
+            if self.max_bytes is None or len(value) <= self.max_bytes:
+                rows.append((key, sqlite3.Binary(value), expires, len(value)))
+        if not rows:
+            return
+        with self._transaction() as db:
+            db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', rows)
+            evicted = self._evict(db)
+        self._evicted(evicted)
+
+    def _evict(self, db):
+        """Evict keys until the cache fits its limits, and return them."""
+        excess_entries, excess_bytes = self._excess(db)
+        if excess_entries <= 0 and excess_bytes <= 0:
+            return []
+        db.execute('DELETE FROM entries WHERE expires <= ?', (time(),))
+        excess_entries, excess_bytes = self._excess(db)
+        victims = []
+        rows = db.execute('SELECT key, size FROM entries ORDER BY expires')
+        for key, size in rows:
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            victims.append(key)
+            excess_entries -= 1
+            excess_bytes -= size
+        rows.close()
+        for batch, params in self._batches(victims):
+            db.execute('DELETE FROM entries WHERE key IN ({})'.format(params), batch)
+        return victims
+
+    def _excess(self, db):
+        """Return the number of entries and bytes stored over the limits."""
+        entries, size = db.execute('SELECT entries, bytes FROM usage').fetchone()
+        return (
+            entries - self.threshold if self.threshold is not None else 0,
+            size - self.max_bytes if self.max_bytes is not None else 0,
+        )
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        with self._transaction() as db:
+            for batch, params in self._batches(keys):
+                db.execute('DELETE FROM entries WHERE key IN ({})'.format(params), batch)
+
+    def clear(self):
+        with self._transaction() as db:
+            db.execute('DELETE FROM entries')
+
+    def purge(self, prefix, progress=None):
+        with self._transaction() as db:
+            deleted = db.execute(
+                'DELETE FROM entries WHERE substr(key, 1, ?) = ?', (len(prefix), prefix)).rowcount
+        if progress is not None:
+            progress(deleted)
+        return deleted
+
+    def count(self):
+        return self._connection().execute('SELECT entries FROM usage').fetchone()[0]
+
+    def info(self):
+        """See `SimpleCache.info`."""
+        resources = {}
+        for key, size in self._connection().execute('SELECT key, size FROM entries'):
+            stats = resources.setdefault(_resource_name(key), {'entries': 0, 'bytes': 0})
+            stats['entries'] += 1
+            stats['bytes'] += size
+        return {
+            'entries': sum(stats['entries'] for stats in resources.values()),
+            'bytes': sum(stats['bytes'] for stats in resources.values()),
+            'threshold': self.threshold,
+            'max_bytes': self.max_bytes,
+            'resources': resources,
+        }
+
+    def is_cached(self, key):
+        row = self._connection().execute(
+            'SELECT 1 FROM entries WHERE key = ? AND expires > ?', (key, time())).fetchone()
+        return row is not None
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    Stores the cache in a memory-mapped file (in /dev/shm when available), so
+    that every process on the host mapping it, such as the forked workers of
+    a pre-forking server, shares a single copy of each entry.
+
+    Entries are indexed by a hash table of `threshold` slots, and their
+    serialized values appended to a ring of `max_bytes` bytes, in which the
+    oldest values are overwritten (and their keys evicted) to make room for
+    new ones. A key whose slots are all taken replaces the one closest to
+    expiring. Reads take no lock: each slot carries a sequence number, odd
+    while it is being written, and a read is retried if it changed meanwhile.
+    Writes are serialized by a lock on the file.
+
+    Every process must map the file with the same `threshold` and
+    `max_bytes`. Requires a POSIX system.
+
+    :param path: the file to map, created if needed. Defaults to a file in
+                 a directory of the current user's in /dev/shm. An existing
+                 file which another user owns or can write to is refused
+                 with a ValueError.
+    :param serializer, compression, compress_threshold: see `Serializer`.
+    """
+
+    MAGIC = b'GAPISHM1'
+    # magic, slots, ring size, write position, reclaim position, live slots
+    HEADER = struct.Struct('<8sQQQQQ')
+    # sequence number, key hash, expiry time, value offset and length
+    SLOT = struct.Struct('<QQdQI4x')
+    # length, slot and key length, followed by the key and value
+    RECORD = struct.Struct('<IIH')
+    SEQUENCE = struct.Struct('<Q')
+    EMPTY, TOMBSTONE = 0, 1
+    # the number of slots a key may be stored in
+    PROBES = 16
+    # the number of times a read is retried while its slot is being written
+    READ_RETRIES = 8
+
+    def __init__(self, path=None, threshold=500, default_timeout=300, max_bytes=64 * 1024 * 1024,
+                 serializer='pickle', compression=None, compress_threshold=1024, **kwargs):
+        super(SharedMemoryCache, self).__init__(default_timeout, **kwargs)
+        if fcntl is None:
+            raise RuntimeError('SharedMemoryCache requires the fcntl module')
+        if not threshold or not max_bytes:
+            raise ValueError('SharedMemoryCache requires a threshold and max_bytes')
+        if path is None:
+            directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+            path = os.path.join(_private_dir(directory), 'cache')
+        self.path = path
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.serializer = Serializer(serializer, compression, compress_threshold)
+        self._slots_start = self.HEADER.size
+        self._ring_start = self._slots_start + threshold * self.SLOT.size
+        size = self._ring_start + max_bytes
+
+        self._fd = _open_private(path)
+        self._pid = None
+        self._thread_lock = None
+        with self._write_lock():
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                self._mm = mmap.mmap(self._fd, size)
+                self._write_header(0, max_bytes, 0)
+            elif os.fstat(self._fd).st_size == size:
+                self._mm = mmap.mmap(self._fd, size)
+            else:
+                self._mm = None
+            if self._mm is None or self.HEADER.unpack_from(self._mm, 0)[:3] != (self.MAGIC, threshold, max_bytes):
+                raise ValueError(
+                    '{} was created with another threshold or max_bytes, delete it first'.format(path))
+
+    @contextmanager
+    def _write_lock(self):
+        # the lock on the file only excludes other processes
+        if self._pid != os.getpid():
+            self._thread_lock = threading.Lock()
+            self._pid = os.getpid()
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+    def _read_header(self):
+        """Return the write position, reclaim position and live slots."""
+        return self.HEADER.unpack_from(self._mm, 0)[3:]
+
+    def _write_header(self, write_pos, reclaim_pos, live):
+        self.HEADER.pack_into(self._mm, 0, self.MAGIC, self.threshold, self.max_bytes, write_pos, reclaim_pos, live)
+
+    @staticmethod
+    def _hash(key):
+        value = _stable_hash(key)
+        return value if value > SharedMemoryCache.TOMBSTONE else value + 2
+
+    def _probe(self, key_hash):
+        for i in range(min(self.PROBES, self.threshold)):
+            yield (key_hash + i) % self.threshold
+
+    def _slot_pos(self, index):
+        return self._slots_start + index * self.SLOT.size
+
+    def _read_slot(self, index):
+        return self.SLOT.unpack_from(self._mm, self._slot_pos(index))
+
+    def _write_slot(self, index, key_hash, expires=0.0, offset=0, length=0):
+        pos = self._slot_pos(index)
+        sequence = self.SEQUENCE.unpack_from(self._mm, pos)[0]
+        # readers retry while the sequence number is odd, or once it changed
+        self.SEQUENCE.pack_into(self._mm, pos, sequence + 1)
+        self.SLOT.pack_into(self._mm, pos, sequence + 1, key_hash, expires, offset, length)
+        self.SEQUENCE.pack_into(self._mm, pos, sequence + 2)
+
+    def _record_key(self, offset, length):
+        record = self._mm[self._ring_start + offset:self._ring_start + offset + length]
+        key_length = self.RECORD.unpack_from(record, 0)[2]
+        return record, record[self.RECORD.size:self.RECORD.size + key_length]
+
+    def _read(self, key, now):
+        """Return the serialized value of `key`, without taking any lock."""
+        encoded = key.encode('utf-8')
+        key_hash = self._hash(encoded)
+        for index in self._probe(key_hash):
+            for _ in range(self.READ_RETRIES):
+                sequence, slot_hash, expires, offset, length = self._read_slot(index)
+                if sequence & 1:
+                    continue
+                if slot_hash == self.EMPTY:
+                    return None
+                if slot_hash != key_hash:
+                    break
+                try:
+                    record, record_key = self._record_key(offset, length)
+                except struct.error:
+                    # a torn read of a slot being written
+                    continue
+                if self.SEQUENCE.unpack_from(self._mm, self._slot_pos(index))[0] != sequence:
+                    continue
+                if record_key != encoded:
+                    break
+                if expires <= now:
+                    return None
+                return record[self.RECORD.size + len(encoded):]
+            else:
+                # the slot kept changing under us, treat it as a miss
+                return None
+        return None
+
+    def _find(self, encoded, key_hash):
+        """
+        Return the slot of the key, else a free slot for it, else None, along
+        with whether the key was found. The write lock must be held.
+        """
+        free = None
+        for index in self._probe(key_hash):
+            _, slot_hash, _, offset, length = self._read_slot(index)
+            if slot_hash == self.EMPTY:
+                return (index if free is None else free), False
+            if slot_hash == self.TOMBSTONE:
+                if free is None:
+                    free = index
+            elif slot_hash == key_hash and self._record_key(offset, length)[1] == encoded:
+                return index, True
+        return free, False
+
+    def _invalidate(self, index, live):
+        self._write_slot(index, self.TOMBSTONE)
+        return live - 1
+
+    def _reclaim(self, reclaim_pos, until, live, evicted):
+        """
+        Evict the keys of the values stored from `reclaim_pos` up to `until`,
+        which are about to be overwritten, adding them to `evicted`, and
+        return the new reclaim position and number of live slots.
+        """
+        while reclaim_pos < until:
+            if reclaim_pos + self.RECORD.size > self.max_bytes:
+                return self.max_bytes, live
+            length, index, _ = self.RECORD.unpack_from(self._mm, self._ring_start + reclaim_pos)
+            if length == 0:
+                # the end of the values written before the ring wrapped
+                return self.max_bytes, live
+            _, slot_hash, _, offset, _ = self._read_slot(index)
+            if slot_hash > self.TOMBSTONE and offset == reclaim_pos:
+                evicted.append(self._record_key(offset, length)[1].decode('utf-8'))
+                live = self._invalidate(index, live)
+            reclaim_pos += length
+        return reclaim_pos, live
+
+    def _store(self, key, value, expires, header, evicted):
+        write_pos, reclaim_pos, live = header
+        encoded = key.encode('utf-8')
+        key_hash = self._hash(encoded)
+        size = self.RECORD.size + len(encoded) + len(value)
+        if size > self.max_bytes:
+            # a value which could never fit is not stored at all
+            index, found = self._find(encoded, key_hash)
+            if found:
+                live = self._invalidate(index, live)
+            return write_pos, reclaim_pos, live
+
+        if write_pos + size > self.max_bytes:
+            reclaim_pos, live = self._reclaim(reclaim_pos, self.max_bytes, live, evicted)
+            if write_pos + self.RECORD.size <= self.max_bytes:
+                self.RECORD.pack_into(self._mm, self._ring_start + write_pos, 0, 0, 0)
+            write_pos = reclaim_pos = 0
+        reclaim_pos, live = self._reclaim(reclaim_pos, write_pos + size, live, evicted)
+
+        index, found = self._find(encoded, key_hash)
+        if index is None:
+            # replace the key closest to expiring
+            index = min(self._probe(key_hash), key=lambda i: self._read_slot(i)[2])
+            _, _, _, offset, length = self._read_slot(index)
+            evicted.append(self._record_key(offset, length)[1].decode('utf-8'))
+            live = self._invalidate(index, live)
+        if not found:
+            live += 1
+
+        start = self._ring_start + write_pos
+        self.RECORD.pack_into(self._mm, start, size, index, len(encoded))
+        self._mm[start + self.RECORD.size:start + size] = encoded + value
+        self._write_slot(index, key_hash, expires, write_pos, size)
+        return write_pos + size, reclaim_pos, live
+
+    def get(self, key):
+        value = self._read(key, time())
+        if value is not None:
+            return self.serializer.loads(value)
+
+    def get_many(self, keys):
+        now = time()
+        values = {}
+        for key in keys:
+            value = self._read(key, now)
+            if value is not None:
+                values[key] = self.serializer.loads(value)
+        return values
+
+    def set(self, key, data_dict, timeout=None):
+        self.set_many({key: data_dict}, timeout=timeout)
+
+    def set_many(self, mapping, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        expires = time() + timeout
+        values = [(key, self.serializer.dumps(value)) for key, value in mapping.items()]
+        evicted = []
+        with self._write_lock():
+            header = self._read_header()
+            for key, value in values:
+                header = self._store(key, value, expires, header, evicted)
+            self._write_header(*header)
+        self._evicted(evicted)
+
+    def delete(self, key):
+        self.delete_many([key])
+
+    def delete_many(self, keys):
+        with self._write_lock():
+            write_pos, reclaim_pos, live = self._read_header()
+            for key in keys:
+                encoded = key.encode('utf-8')
+                index, found = self._find(encoded, self._hash(encoded))
+                if found:
+                    live = self._invalidate(index, live)
+            self._write_header(write_pos, reclaim_pos, live)
+
+    def _live_slots(self):
+        """Yield the `(index, key, value length)` of the live slots."""
+        for index in range(self.threshold):
+            _, slot_hash, _, offset, length = self._read_slot(index)
+            if slot_hash > self.TOMBSTONE:
+                key = self._record_key(offset, length)[1]
+                yield index, key.decode('utf-8'), length - self.RECORD.size - len(key)
+
+    def clear(self):
+        with self._write_lock():
+            for index in range(self.threshold):
+                if self._read_slot(index)[1] != self.EMPTY:
+                    self._write_slot(index, self.EMPTY)
+            self._write_header(0, self.max_bytes, 0)
+
+    def purge(self, prefix, progress=None):
+        deleted = 0
+        with self._write_lock():
+            write_pos, reclaim_pos, live = self._read_header()
+            for index, key, _ in list(self._live_slots()):
+                if key.startswith(prefix):
+                    live = self._invalidate(index, live)
+                    deleted += 1
+            self._write_header(write_pos, reclaim_pos, live)
+        if progress is not None:
+            progress(deleted)
+        return deleted
+
+    def count(self):
+        return self._read_header()[2]
+
+    def info(self):
+        """See `SimpleCache.info`."""
+        resources = {}
+        with self._write_lock():
+            for _, key, size in self._live_slots():
+                stats = resources.setdefault(_resource_name(key), {'entries': 0, 'bytes': 0})
+                stats['entries'] += 1
+                stats['bytes'] += size
+        return {
+            'entries': sum(stats['entries'] for stats in resources.values()),
+            'bytes': sum(stats['bytes'] for stats in resources.values()),
+            'threshold': self.threshold,
+            'max_bytes': self.max_bytes,
+            'resources': resources,
+        }
+
+    def is_cached(self, key):
+        return self._read(key, time()) is not None
+
+
+class TieredCache(BaseCache):
+    """
+    A bounded in-process cache (L1) in front of a shared cache backend (L2).
+
+    Reads are served from L1 when possible, and fall back to L2; writes go
+    through to both. L1 entries live for at most `l1_timeout` seconds, so
+    changes made by other processes show up within that delay.
+
+    L1 stores serialized values, so every read returns its own copy. With
+    `l1_shared` it stores the values as they are instead, so an L1 hit costs
+    no deserialization, but the values are then shared by every read and must
+    not be changed in place.
+
+    When an `invalidation_channel` is given, deletes, writes and clears are
+    published on it through the L2 backend (which must implement `publish`
+    and `subscribe`, as RedisCache does), and every process subscribed to it
+    drops the key from its L1 right away.
+
+    :param backend: the path of the L2 cache backend class, built with the
+                    remaining keyword arguments.
+    :param l1_threshold: the maximum number of items L1 stores.
+    :param l1_max_bytes: the maximum size of the values L1 stores, see
+                         `SimpleCache`. It cannot be used with `l1_shared`.
+    :param l1_timeout: the maximum number of seconds an item stays in L1.
+    :param l1_shared: whether L1 stores the values as they are, rather than
+                      serialized.
+    :param invalidation_channel: the channel invalidations are published on.
+    """
+
+    # the message published on `invalidation_channel` to clear every L1
+    CLEAR = '*'
+
+    def __init__(self, backend='gapipy.cache.RedisCache', l1_threshold=500, l1_timeout=10,
+                 invalidation_channel=None, default_timeout=300, l1_max_bytes=None,
+                 l1_shared=False, **kwargs):
+        super(TieredCache, self).__init__(default_timeout, **kwargs)
+        module_name, class_name = backend.rsplit('.', 1)
+        backend_cls = getattr(import_module(module_name), class_name)
+        self.l1_timeout = l1_timeout
+        self.l1 = SimpleCache(
+            threshold=l1_threshold,
+            default_timeout=l1_timeout,
+            max_bytes=l1_max_bytes,
+            serializer=None if l1_shared else 'pickle',
+        )
+        self.l2 = backend_cls(default_timeout=default_timeout, **kwargs)
+
+        self.invalidation_channel = invalidation_channel
+        # identifies this process' messages, which it ignores
+        self._node_id = uuid4().hex
+        if invalidation_channel:
+            self._subscription = self.l2.subscribe(invalidation_channel, self._on_invalidation)
+
+    def _backends(self):
+        return (self.l1, self.l2)
+
+    def _l1_timeout(self, timeout):
+        if timeout is None:
+            return self.l1_timeout
+        return min(timeout, self.l1_timeout)
+
+    def _invalidate(self, key):
+        if self.invalidation_channel:
+            self.l2.publish(self.invalidation_channel, '{}:{}'.format(self._node_id, key))
+
+    def _on_invalidation(self, message):
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        node_id, key = message.split(':', 1)
+        if node_id == self._node_id:
+            return
+        if key == self.CLEAR:
+            self.l1.clear()
+        else:
+            self.l1.delete(key)
+
+    def get(self, key):
+        value = self.l1.get(key)
+        if value is None:
+            value = self.l2.get(key)
+            if value is not None:
+                self.l1.set(key, value)
+        return value
+
+    def get_many(self, keys):
+        values = self.l1.get_many(keys)
+        misses = [key for key in keys if key not in values]
+        if misses:
+            found = self.l2.get_many(misses)
+            if found:
+                self.l1.set_many(found)
+            values.update(found)
+        return values
+
+    def set(self, key, value, timeout=None):
+        self.l2.set(key, value, timeout=timeout)
+        self.l1.set(key, value, timeout=self._l1_timeout(timeout))
+        self._invalidate(key)
+
+    def set_many(self, mapping, timeout=None):
+        self.l2.set_many(mapping, timeout=timeout)
+        self.l1.set_many(mapping, timeout=self._l1_timeout(timeout))
+        for key in mapping:
+            self._invalidate(key)
+
+    def delete(self, key):
+        self.l1.delete(key)
+        result = self.l2.delete(key)
+        self._invalidate(key)
+        return result
+
+    def delete_many(self, keys):
+        self.l1.delete_many(keys)
+        self.l2.delete_many(keys)
+        for key in keys:
+            self._invalidate(key)
+
+    def clear(self):
+        self.l1.clear()
+        self.l2.clear()
+        self._invalidate(self.CLEAR)
+
+    def purge(self, prefix, progress=None):
+        self.l1.purge(prefix)
+        deleted = self.l2.purge(prefix, progress=progress)
+        # L1 entries are short-lived, other nodes drop all of theirs
+        self._invalidate(self.CLEAR)
+        return deleted
+
+    def count(self):
+        return self.l2.count()
+
+    def info(self):
+        """
+        Return the `info` of L1, whose entries and bytes are reported by
+        resource, along with the `info` of L2, if any, under `l2`.
+        """
+        info = self.l1.info()
+        if hasattr(self.l2, 'info'):
+            info['l2'] = self.l2.info()
+        return info
+
+    def is_cached(self, key):
+        return self.l1.is_cached(key) or self.l2.is_cached(key)
+
+    def lock(self, key, timeout=None):
+        return self.l2.lock(key, timeout=timeout)
 
 
 class RedisCache(BaseCache):
-    """Uses the Redis key-value store as a cache backend."""
+    """
+    Uses the Redis key-value store as a cache backend.
+
+    Values are encoded according to the `serializer`, `compression` and
+    `compress_threshold` options, see `Serializer`.
+    """
 
     _connection_pool_cache = {}
 
     def __init__(self, host='localhost', port=6379, password=None,
-                 db=0, default_timeout=300, key_prefix='', **kwargs):
+                 db=0, default_timeout=300, key_prefix='', scan_batch_size=500,
+                 serializer='pickle', compression=None, compress_threshold=1024, **kwargs):
         super(RedisCache, self).__init__(default_timeout, **kwargs)
         self.key_prefix = key_prefix
+        self.serializer = Serializer(serializer, compression, compress_threshold)
+        self.scan_batch_size = scan_batch_size
         self._client = self._get_client(host, port, password, db)
 
     @classmethod
@@ -145,41 +1644,304 @@ class RedisCache(BaseCache):
         """The reversal of `dump_object`. This might be called with `None`."""
         if value is None:
             return None
-        return pickle.loads(value)
+        return self.serializer.loads(value)
 
     def dump_object(self, value):
-        return pickle.dumps(value)
+        return self.serializer.dumps(value)
+
+    def _setex(self, client, key, timeout, data):
+        # redis 3.x.x requires the order of arguments in setex to be:
+        # (name, time, value)
+        if self.REDIS_VERSION >= '3.0.0':
+            return client.setex(self.key_prefix + key, timeout, data)
+        # redis < 3.0.0
+        return client.setex(self.key_prefix + key, data, timeout)
 
     def get(self, key):
         return self.load_object(self._client.get(self.key_prefix + key))
 
+    def get_many(self, keys):
+        """Fetch every key of `keys` in a single MGET."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._client.mget([self.key_prefix + key for key in keys])
+        return {
+            key: self.load_object(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
     def set(self, key, data_dict, timeout=None):
         if timeout is None:
             timeout = self.default_timeout
-        data = self.dump_object(data_dict)
-        # redis 3.x.x requires the order of arguments in setex to be:
-        # (name, time, value)
-        if self.REDIS_VERSION >= '3.0.0':
-            return self._client.setex(self.key_prefix + key, timeout, data)
-        # redis < 3.0.0
-        return self._client.setex(self.key_prefix + key, data, timeout)
+        return self._setex(self._client, key, timeout, self.dump_object(data_dict))
+
+    def set_many(self, mapping, timeout=None):
+        """Set every key of `mapping` with SETEX, in a single round trip."""
+        if not mapping:
+            return
+        if timeout is None:
+            timeout = self.default_timeout
+        # no need for MULTI/EXEC, only for the round trip to be shared
+        pipeline = self._client.pipeline(transaction=False)
+        for key, value in mapping.items():
+            self._setex(pipeline, key, timeout, self.dump_object(value))
+        pipeline.execute()
 
     def delete(self, key):
         return self._client.delete(self.key_prefix + key)
 
-    def clear(self):
-        cache_keys = self._client.keys('{}*'.format(self.key_prefix))
-        # Python 2 and 3
-        # inefficient on Python 2 to list a map
-        list(map(self._client.delete, cache_keys))
+    def delete_many(self, keys):
+        keys = [self.key_prefix + key for key in keys]
+        if keys:
+            return self._client.delete(*keys)
+
+    def clear(self, progress=None):
+        self.purge('', progress=progress)
+
+    def purge(self, prefix, progress=None):
+        """
+        Delete the keys starting with `prefix`, found with an incremental SCAN
+        rather than KEYS and unlinked `scan_batch_size` at a time, so that
+        Redis keeps serving other clients while a large cache is purged.
+        """
+        pattern = _glob_escape(self.key_prefix + prefix) + '*'
+        deleted = 0
+        batch = []
+        for key in self._client.scan_iter(match=pattern, count=self.scan_batch_size):
+            batch.append(key)
+            if len(batch) == self.scan_batch_size:
+                deleted += self._unlink(batch, progress, deleted)
+                batch = []
+        if batch:
+            deleted += self._unlink(batch, progress, deleted)
+        return deleted
+
+    def _unlink(self, keys, progress, deleted):
+        # UNLINK frees the memory in the background, redis < 3.0.0 lacks it
+        if self.REDIS_VERSION >= '3.0.0':
+            self._client.unlink(*keys)
+        else:
+            self._client.delete(*keys)
+        if progress is not None:
+            progress(deleted + len(keys))
+        return len(keys)
 
     def info(self):
         return self._client.info()
 
+    def publish(self, channel, message):
+        return self._client.publish(self.key_prefix + channel, message)
+
+    def subscribe(self, channel, callback):
+        """
+        Call `callback(message)` from a background thread for every message
+        published on `channel`. Returns the thread, which can be `stop`ped.
+        """
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.key_prefix + channel: lambda message: callback(message['data'])})
+        return pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def lock(self, key, timeout=None):
+        return _RedisLock(self._client.lock('{}{}:lock'.format(self.key_prefix, key), timeout=timeout))
+
     def is_cached(self, key):
         return self._client.exists(self.key_prefix + key)
 
 
+def _glob_escape(pattern):
+    """Escape the characters which are special in a Redis match pattern."""
+    for char in '\\*?[]':
+        pattern = pattern.replace(char, '\\' + char)
+    return pattern
+
+
+class ShardedRedisCache(BaseCache):
+    """
+    Spreads the cache over several Redis servers, each key being stored on
+    the server found for it on a consistent hash ring, on which every server
+    has `replicas` virtual nodes. Adding or removing a server only moves the
+    keys of its share of the ring.
+
+    `nodes` is a list of `'host:port[/db]'` strings or of dicts of `host`,
+    `port`, `password` and `db`. Any other option is passed on to the
+    `RedisCache` of every node. Multi-key operations send one command (or
+    pipeline) per server.
+
+    A server which cannot be reached is left out for `retry_interval`
+    seconds: its keys are cache misses and are not written, rather than being
+    moved to another server, from which stale copies would be read once it is
+    back.
+    """
+
+    def __init__(self, nodes=('localhost:6379',), replicas=100, retry_interval=30, default_timeout=300, **kwargs):
+        super(ShardedRedisCache, self).__init__(default_timeout)
+        if not nodes:
+            raise ValueError('ShardedRedisCache requires at least one node')
+        self.retry_interval = retry_interval
+        self.shards = []
+        for node in nodes:
+            options = dict(kwargs, **self._parse_node(node))
+            shard = RedisCache(default_timeout=default_timeout, **options)
+            shard.name = '{}:{}/{}'.format(options['host'], options['port'], options.get('db', 0))
+            self.shards.append(shard)
+        self._errors = _redis_errors()
+        self._down_until = {}
+
+        ring = sorted(
+            (_stable_hash('{}#{}'.format(shard.name, i).encode('utf-8')), index)
+            for index, shard in enumerate(self.shards)
+            for i in range(replicas)
+        )
+        self._ring_hashes = [point for point, _ in ring]
+        self._ring_shards = [self.shards[index] for _, index in ring]
+
+    def _backends(self):
+        return self.shards
+
+    @staticmethod
+    def _parse_node(node):
+        if isinstance(node, dict):
+            return dict({'host': 'localhost', 'port': 6379}, **node)
+        address, _, db = node.partition('/')
+        host, _, port = address.rpartition(':')
+        options = {'host': host or address, 'port': int(port) if host else 6379}
+        if db:
+            options['db'] = int(db)
+        return options
+
+    def shard(self, key):
+        """Return the `RedisCache` of the server storing `key`."""
+        index = bisect.bisect(self._ring_hashes, _stable_hash(key.encode('utf-8')))
+        return self._ring_shards[index % len(self._ring_shards)]
+
+    def _by_shard(self, keys):
+        groups = OrderedDict()
+        for key in keys:
+            groups.setdefault(self.shard(key), []).append(key)
+        return groups.items()
+
+    def _call(self, shard, default, func, *args, **kwargs):
+        """
+        Return `func(*args, **kwargs)`, a call to the server of `shard`, or
+        `default` if the server is, or turns out to be, down.
+        """
+        if self._down_until.get(shard.name, 0) > time():
+            return default
+        try:
+            return func(*args, **kwargs)
+        except self._errors as exc:
+            logger.warning('Redis shard %s is down, retrying in %ss: %r', shard.name, self.retry_interval, exc)
+            self._down_until[shard.name] = time() + self.retry_interval
+            return default
+
+    def get(self, key):
+        shard = self.shard(key)
+        return self._call(shard, None, shard.get, key)
+
+    def get_many(self, keys):
+        values = {}
+        for shard, shard_keys in self._by_shard(keys):
+            values.update(self._call(shard, {}, shard.get_many, shard_keys))
+        return values
+
+    def set(self, key, value, timeout=None):
+        shard = self.shard(key)
+        self._call(shard, None, shard.set, key, value, timeout=timeout)
+
+    def set_many(self, mapping, timeout=None):
+        for shard, shard_keys in self._by_shard(mapping):
+            self._call(shard, None, shard.set_many, {key: mapping[key] for key in shard_keys}, timeout=timeout)
+
+    def delete(self, key):
+        shard = self.shard(key)
+        self._call(shard, None, shard.delete, key)
+
+    def delete_many(self, keys):
+        for shard, shard_keys in self._by_shard(keys):
+            self._call(shard, None, shard.delete_many, shard_keys)
+
+    def clear(self, progress=None):
+        self.purge('', progress=progress)
+
+    def purge(self, prefix, progress=None):
+        deleted = 0
+        for shard in self.shards:
+            deleted += self._call(shard, 0, shard.purge, prefix, progress=self._progress(progress, deleted))
+        return deleted
+
+    @staticmethod
+    def _progress(progress, done):
+        """Report the running total across shards to `progress`."""
+        if progress is None:
+            return None
+        return lambda deleted: progress(done + deleted)
+
+    def info(self):
+        """Return the `info` of each server by name, None for those down."""
+        return {shard.name: self._call(shard, None, shard.info) for shard in self.shards}
+
+    def publish(self, channel, message):
+        shard = self.shard(channel)
+        return self._call(shard, 0, shard.publish, channel, message)
+
+    def subscribe(self, channel, callback):
+        return self.shard(channel).subscribe(channel, callback)
+
+    def lock(self, key, timeout=None):
+        shard = self.shard(key)
+        if self._down_until.get(shard.name, 0) > time():
+            return None
+        return _ShardLock(self, shard, shard.lock(key, timeout=timeout))
+
+    def is_cached(self, key):
+        shard = self.shard(key)
+        return bool(self._call(shard, False, shard.is_cached, key))
+
+
+def _redis_errors():
+    """Return the exceptions raised by redis when a server is unreachable."""
+    try:
+        from redis.exceptions import ConnectionError, TimeoutError
+    except ImportError:
+        return ()
+    return ConnectionError, TimeoutError
+
+
+class _ShardLock(object):
+    """A lock on a shard of a `ShardedRedisCache`, not acquired while it is down."""
+
+    def __init__(self, cache, shard, lock):
+        self._cache = cache
+        self._shard = shard
+        self._lock = lock
+
+    def acquire(self, blocking_timeout=None):
+        return self._cache._call(self._shard, False, self._lock.acquire, blocking_timeout=blocking_timeout)
+
+    def release(self):
+        self._cache._call(self._shard, None, self._lock.release)
+
+
+class _RedisLock(object):
+    """Wraps a redis lock in the interface of `BaseCache.lock`."""
+
+    def __init__(self, lock):
+        self._lock = lock
+
+    def acquire(self, blocking_timeout=None):
+        return self._lock.acquire(blocking_timeout=blocking_timeout)
+
+    def release(self):
+        from redis.exceptions import LockError
+        try:
+            self._lock.release()
+        except LockError:
+            # the lock expired while we held it, someone else may own it now
+            pass
+
+
 if django_settings:
     class DjangoCache(BaseCache):
         def __init__(self, *args, **kwargs):
@@ -198,13 +1960,39 @@ if django_settings:
         def delete(self, key):
             return self.client.delete(key)
 
+        def delete_many(self, keys):
+            self.client.delete_many(keys)
+
         def get(self, key):
             return self.client.get(key)
 
+        def get_many(self, keys):
+            return self.client.get_many(keys)
+
         def set(self, key, value, timeout=None):
             if timeout is None:
                 timeout = self.default_timeout
             self.client.set(key, value, timeout)
 
+        def set_many(self, mapping, timeout=None):
+            if timeout is None:
+                timeout = self.default_timeout
+            self.client.set_many(mapping, timeout)
+
         def is_cached(self, key):
             return key in self.client
+
+        def purge(self, prefix, progress=None):
+            """
+            Delete the keys starting with `prefix` with the `delete_pattern`
+            of the Django cache backend, which django-redis provides. Other
+            Django cache backends raise a NotImplementedError.
+            """
+            delete_pattern = getattr(self.client, 'delete_pattern', None)
+            if delete_pattern is None:
+                raise NotImplementedError(
+                    'DjangoCache can only purge a Django cache backend with delete_pattern, e.g. django-redis')
+            deleted = delete_pattern(_glob_escape(prefix) + '*') or 0
+            if progress is not None:
+                progress(deleted)
+            return deleted
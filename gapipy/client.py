@@ -2,6 +2,7 @@ import logging
 import os
 import re
 from importlib import import_module
+from time import time
 
 from .utils import get_available_resource_classes
 
@@ -18,6 +19,12 @@ default_config = {
     'application_key': os.environ.get('GAPI_APPLICATION_KEY'),
     'cache_backend': os.environ.get('GAPI_CACHE_BACKEND', 'gapipy.cache.NullCache'),
     'cache_options': {'threshold': 500, 'default_timeout': 3600},
+    # called with (resource_name, metric, value) for every update of the
+    # cache stats, as a callable or the dotted path to one.
+    'cache_stats_callback': None,
+    # the cache timeout of each resource, by resource name, as a number of
+    # seconds or a callable returning one (or None) for the resource data.
+    'cache_timeouts': {},
     'connection_pool_options': {
         'enable': os.environ.get('GAPI_CLIENT_CONNECTION_POOL_ENABLE', False),
         'block': os.environ.get('GAPI_CLIENT_CONNECTION_POOL_BLOCK', False),
@@ -25,8 +32,25 @@ default_config = {
         'maxsize': os.environ.get('GAPI_CLIENT_CONNECTION_POOL_MAXSIZE', 10),
     },
     'debug': os.environ.get('GAPI_CLIENT_DEBUG', False),
+    'listing_cache_timeout': os.environ.get('GAPI_CLIENT_LISTING_CACHE_TIMEOUT', 0),
     'max_retries': os.environ.get('GAPI_CLIENT_MAX_RETRIES', 0),
+    'negative_cache_timeout': os.environ.get('GAPI_CLIENT_NEGATIVE_CACHE_TIMEOUT', 0),
+    # keep up to `threshold` hydrated resource instances in memory, for up to
+    # `timeout` seconds, see gapipy.cache.ObjectCache. Disabled by default.
+    'object_cache_options': {
+        'enable': os.environ.get('GAPI_CLIENT_OBJECT_CACHE_ENABLE', False),
+        'threshold': os.environ.get('GAPI_CLIENT_OBJECT_CACHE_THRESHOLD', 500),
+        'timeout': os.environ.get('GAPI_CLIENT_OBJECT_CACHE_TIMEOUT', 60),
+    },
     'raise_on_empty_update': os.environ.get('GAPI_CLIENT_RAISE_ON_EMPTY_UPDATE', False),
+    'revalidation_window': os.environ.get('GAPI_CLIENT_REVALIDATION_WINDOW', 0),
+    'stale_while_revalidate': os.environ.get('GAPI_CLIENT_STALE_WHILE_REVALIDATE', 0),
+    'single_flight_options': {
+        'enable': os.environ.get('GAPI_CLIENT_SINGLE_FLIGHT_ENABLE', False),
+        'distributed': os.environ.get('GAPI_CLIENT_SINGLE_FLIGHT_DISTRIBUTED', False),
+        'lock_timeout': os.environ.get('GAPI_CLIENT_SINGLE_FLIGHT_LOCK_TIMEOUT', 10),
+        'wait_timeout': os.environ.get('GAPI_CLIENT_SINGLE_FLIGHT_WAIT_TIMEOUT', 10),
+    },
     'uuid': os.environ.get('GAPI_UUID', False),
     # we don't have a nice way to intialise a dictionary from the environment,
     # so we default it to an empty dict here.
@@ -50,6 +74,10 @@ def get_config(config, name):
 
 class Client(object):
 
+    # True for clients whose queries and requests return awaitables, see
+    # gapipy.async_client.AsyncClient
+    is_async = False
+
     def __init__(self, **config):
         # configuration attributes
         self.api_language = get_config(config, 'api_language')
@@ -57,9 +85,14 @@ class Client(object):
         self.api_root = get_config(config, 'api_root')
         self.application_key = get_config(config, 'application_key')
         self.cache_backend = get_config(config, 'cache_backend')
+        self.cache_timeouts = dict(get_config(config, 'cache_timeouts'))
         self.global_http_headers = get_config(config, 'global_http_headers')
+        self.listing_cache_timeout = int(get_config(config, 'listing_cache_timeout'))
         self.max_retries = get_config(config, 'max_retries')
+        self.negative_cache_timeout = int(get_config(config, 'negative_cache_timeout'))
         self.raise_on_empty_update = get_config(config, 'raise_on_empty_update')
+        self.revalidation_window = int(get_config(config, 'revalidation_window'))
+        self.stale_while_revalidate = int(get_config(config, 'stale_while_revalidate'))
         self.uuid = get_config(config, 'uuid')
 
         # begin with default connection pool options and override them with
@@ -67,6 +100,14 @@ class Client(object):
         self.connection_pool_options = default_config['connection_pool_options']
         self.connection_pool_options.update(get_config(config, 'connection_pool_options'))
 
+        # begin with default single flight options and override them with the
+        # configuration options the client has specified
+        self.single_flight_options = dict(default_config['single_flight_options'])
+        self.single_flight_options.update(get_config(config, 'single_flight_options'))
+        # imported here, as gapipy.cache configures django when it is installed
+        from .cache import SingleFlight
+        self._single_flight = SingleFlight()
+
         # init logger
         log_level = 'DEBUG' if get_config(config, 'debug') else 'ERROR'
         self.logger = logger
@@ -74,16 +115,45 @@ class Client(object):
 
         # init cache
         self._set_cache_instance(get_config(config, 'cache_options'))
+        self._set_cache_stats(get_config(config, 'cache_stats_callback'))
+
+        # begin with default object cache options and override them with the
+        # configuration options the client has specified
+        self.object_cache_options = dict(default_config['object_cache_options'])
+        self.object_cache_options.update(get_config(config, 'object_cache_options'))
+        self._set_object_cache(self.object_cache_options)
 
         # set the requestor
         self._set_requestor(self.connection_pool_options, self.max_retries)
 
+        query_class = self.query_class
+        for resource in get_available_resource_classes():
+            setattr(self, resource._resource_name, query_class(self, resource))
+
+    @property
+    def query_class(self):
+        """
+        Return the Query class bound to each resource attribute (and to the
+        resource-collection fields of the resources built by this client).
+        """
         # Prevent install issues where setup.py digs down the path and
         # eventually fails on a missing requests requirement by importing Query
         # only where it's needed.
         from .query import Query
-        for resource in get_available_resource_classes():
-            setattr(self, resource._resource_name, Query(self, resource))
+        return Query
+
+    def cache_timeout(self, resource_name, data):
+        """
+        Return the number of seconds to cache the `data` of a `resource_name`
+        resource for, according to the `cache_timeouts` policy, or None for the
+        cache backend's default timeout. A timeout of 0 disables caching.
+        """
+        timeout = self.cache_timeouts.get(resource_name)
+        if callable(timeout):
+            timeout = timeout(data)
+        if timeout is None:
+            return None
+        return int(timeout)
 
     def _set_cache_instance(self, cache_options):
         cache_backend = self.cache_backend
@@ -92,6 +162,109 @@ class Client(object):
         cache = getattr(module, class_name)(**cache_options)
         self._cache = cache
 
+    def _set_cache_stats(self, callback):
+        from .cache import CacheStats
+
+        if callback is not None and not callable(callback):
+            module_name, function_name = callback.rsplit('.', 1)
+            callback = getattr(import_module(module_name), function_name)
+        self._cache_stats = CacheStats(callback=callback)
+        # so the backend reports its evictions
+        self._cache.stats = self._cache_stats
+
+    def _set_object_cache(self, options):
+        from .cache import ObjectCache
+
+        self._object_cache = None
+        if options['enable']:
+            self._object_cache = ObjectCache(
+                threshold=int(options['threshold']),
+                timeout=int(options['timeout']),
+            )
+
+    def cache_stats(self, reset=False):
+        """
+        Return the cache metrics by resource name: the number of lookups which
+        were `hits`, `negative_hits` or `misses`, the total `lookup_time` in
+        seconds, the number of `sets` and `evictions`, and the number of gets
+        served by the object cache (`object_hits`). For the backends reporting
+        their usage (see `SimpleCache.info`) the number of `entries` and
+        `bytes` stored are included too.
+
+        The metrics are reset to zero if `reset` is True.
+        """
+        stats = self._cache_stats.snapshot(reset=reset)
+        info = self._cache.info() if hasattr(self._cache, 'info') else None
+        if isinstance(info, dict) and isinstance(info.get('resources'), dict):
+            for name in info['resources']:
+                stats.setdefault(name, dict.fromkeys(self._cache_stats.METRICS, 0))
+            for name, metrics in stats.items():
+                metrics.update(info['resources'].get(name, {'entries': 0, 'bytes': 0}))
+        return stats
+
+    def _cache_get(self, key):
+        """Return the value cached for `key`, or None."""
+        started = time()
+        value = self._cache.get(key)
+        self._cache_stats.lookup([key], {key: value}, time() - started)
+        return value
+
+    def _cache_get_many(self, keys):
+        """Return a dict of the values cached for `keys`."""
+        started = time()
+        values = self._cache.get_many(keys)
+        self._cache_stats.lookup(keys, values, time() - started)
+        return values
+
+    def _cache_set(self, key, value, timeout=None):
+        if timeout is None:
+            self._cache.set(key, value)
+        else:
+            self._cache.set(key, value, timeout=timeout)
+        self._cache_stats.add('sets', [key])
+        self._object_cache_delete([key])
+
+    def _cache_set_many(self, mapping, timeout=None):
+        self._cache.set_many(mapping, timeout=timeout)
+        self._cache_stats.add('sets', mapping)
+        self._object_cache_delete(mapping)
+
+    def _cache_delete(self, key):
+        self._object_cache_delete([key])
+        return self._cache.delete(key)
+
+    def _cache_delete_many(self, keys):
+        self._object_cache_delete(keys)
+        return self._cache.delete_many(keys)
+
+    def _cache_purge(self, prefix, progress=None):
+        if self._object_cache is not None:
+            self._object_cache.purge(prefix)
+        return self._cache.purge(prefix, progress=progress)
+
+    def _object_cache_get(self, key):
+        """Return a copy of the resource instance cached for `key`, or None."""
+        if self._object_cache is None:
+            return None
+        resource = self._object_cache.get(key)
+        if resource is not None:
+            self._cache_stats.add('object_hits', [key])
+        return resource
+
+    def _object_cache_reserve(self, key):
+        if self._object_cache is not None:
+            return self._object_cache.reserve(key)
+
+    def _object_cache_set(self, key, resource, token, timeout=None):
+        """Cache `resource` unless `key` was replaced since `token`, see `ObjectCache`."""
+        if self._object_cache is not None:
+            self._object_cache.set(key, resource, token, timeout=timeout)
+
+    def _object_cache_delete(self, keys):
+        # the instances built from the values replaced or deleted are dropped
+        if self._object_cache is not None:
+            self._object_cache.delete_many(keys)
+
     def _set_requestor(self, pool_options, max_retries):
         """
         Set the requestor based on connection pooling options.
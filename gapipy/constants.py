@@ -28,6 +28,10 @@ HTTPERRORS_MAPPED_TO_NONE = (
     codes.GONE,       # 410
 )
 
+# The HTTP Status codes of the errors Query.get remembers in the cache, when
+# the client's `negative_cache_timeout` is set.
+NEGATIVE_CACHE_STATUS_CODES = HTTPERRORS_MAPPED_TO_NONE
+
 # A list of OK Response codes
 ACCEPTABLE_RESPONSE_STATUS_CODES = (
     codes.OK,        # 200
@@ -16,3 +16,7 @@ class EmptyPartialUpdateError(ValueError, GapipyException):
 
 class TimeoutError(GapipyException):
     """A request was made that has timed out."""
+
+
+class InvalidSignatureError(ValueError, GapipyException):
+    """A webhook request's signature does not match its body."""
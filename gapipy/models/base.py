@@ -90,6 +90,21 @@ class BaseModel(object):
             elif field in first(self._resource_collection_fields):
                 self._set_resource_collection_field(field, value)
 
+    def _copy(self):
+        """
+        Return a copy of this object, as independent as a deep copy of it but
+        cheaper to make: the nested models, queries, lists and dicts are
+        copied, while the client, the immutable values (strings, dates,
+        Decimals, ...) and the raw data, which is replaced but never changed
+        in place, are shared.
+        """
+        clone = self.__class__.__new__(self.__class__)
+        for name, value in self.__dict__.items():
+            if name != '_raw_data':
+                value = _copy_value(value)
+            clone.__dict__[name] = value
+        return clone
+
     def _set_as_is_field(self, field, value):
         setattr(self, field, value)
 
@@ -175,7 +190,9 @@ class BaseModel(object):
         return None
 
     def _set_resource_collection_field(self, field, value):
-        query = Query(
+        # an AsyncClient binds an AsyncQuery to resource-collection fields
+        query_cls = getattr(self._client, "query_class", Query)
+        query = query_cls(
             self._client,
             self._model_cls(field),
             parent=self._parent(),
@@ -231,6 +248,16 @@ class BaseModel(object):
         return data
 
 
+def _copy_value(value):
+    if isinstance(value, (BaseModel, Query)):
+        return value._copy()  # pylint: disable=protected-access
+    elif isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    elif isinstance(value, dict):
+        return {key: _copy_value(item) for key, item in value.items()}
+    return value
+
+
 class RelatedResourceMixin(object):
     _related_resource_lookup = None
 
@@ -1,11 +1,19 @@
 from copy import deepcopy
-from functools import wraps
+from functools import partial, wraps
 from itertools import islice
+from time import time
 
-from requests import HTTPError
+from requests import HTTPError, Response
 
-from .constants import HTTPERRORS_MAPPED_TO_NONE
-from .request import APIRequestor
+from .cache import CacheEntry
+from .constants import HTTPERRORS_MAPPED_TO_NONE, NEGATIVE_CACHE_STATUS_CODES
+from .request import APIRequestor, _listing_generation
+
+# The name Query.prefetch accepts for the resources of the query themselves
+PREFETCH_SELF = "self"
+
+# The number of results whose stubs Query.prefetch resolves at a time
+PREFETCH_BATCH_SIZE = 50
 
 
 def _check_listable(func):
@@ -25,14 +33,25 @@ def _check_listable(func):
     return wrapper
 
 
+def _negative_cache_error(key, status):
+    """Return the HTTPError a negative cache entry for `key` stands for."""
+    response = Response()
+    response.status_code = status
+    return HTTPError(
+        '{0} Client Error: cached for key: {1}'.format(status, key),
+        response=response,
+    )
+
+
 class Query(object):
 
-    def __init__(self, client, resource, filters=None, parent=None, raw_data=None):
+    def __init__(self, client, resource, filters=None, parent=None, raw_data=None, prefetch=None):
         self.parent = parent
         self.resource = resource
         self._client = client
         self._filters = filters or {}
         self._raw_data = raw_data or {}
+        self._prefetch = tuple(prefetch or ())
 
     def __iter__(self):
         """Provided as a convenience so that Query objects can be iterated
@@ -52,12 +71,27 @@ class Query(object):
         """
         create a clone of this Query, with deep copies of _filter & _raw_data
         """
-        return Query(
+        return self.__class__(
             self._client,
             self.resource,
             filters=deepcopy(self._filters),
             parent=self.parent,
             raw_data=deepcopy(self._raw_data),
+            prefetch=self._prefetch,
+        )
+
+    def _copy(self):
+        """
+        Create a copy of this Query which shares its _raw_data, for
+        `BaseModel._copy`.
+        """
+        return self.__class__(
+            self._client,
+            self.resource,
+            filters=dict(self._filters),
+            parent=self.parent,
+            raw_data=self._raw_data,
+            prefetch=self._prefetch,
         )
 
     def get(self, resource_id, variation_id=None, cached=True, headers=None,
@@ -81,7 +115,31 @@ class Query(object):
 
         If the timeout is provided, force the request to timeout after
         provided number of seconds.
+
+        When the client's `single_flight_options` are enabled, concurrent
+        cache misses for the same resource share a single request (and its
+        result), see `gapipy.cache.SingleFlight`.
+
+        When the client's `negative_cache_timeout` is set, the 403, 404 and 410
+        errors the API responds with are cached for that many seconds, and
+        raised (or mapped to `None`) again by later calls until they expire.
+
+        When the client's `revalidation_window` is set, expired resources are
+        kept that much longer along with their ETag and Last-Modified
+        validators, and refreshed with a conditional request.
+
+        When the client's `object_cache_options` are enabled, the resource
+        instances are also kept in memory, and copies of them returned by
+        later calls, see `gapipy.cache.ObjectCache`.
         """
+        key = self.query_key(resource_id, variation_id)
+        if cached:
+            resource_object = self._client._object_cache_get(key)
+            if resource_object is not None:
+                return resource_object
+        token = self._client._object_cache_reserve(key)
+        resource_object = None
+        object_timeout = None
         try:
             data = self.get_resource_data(
                 resource_id,
@@ -90,11 +148,16 @@ class Query(object):
                 headers=headers,
                 timeout=timeout
             )
+            resource_object = self.resource(data, client=self._client)
+            # the object cache follows the `cache_timeouts` policy too
+            if token is not None:
+                object_timeout = self._client.cache_timeout(self.resource._resource_name, data)
         except HTTPError as e:
             if httperrors_mapped_to_none and e.response.status_code in httperrors_mapped_to_none:
                 return None
             raise e
-        resource_object = self.resource(data, client=self._client)
+        finally:
+            self._client._object_cache_set(key, resource_object, token, timeout=object_timeout)
         return resource_object
 
     def get_resource_data(self, resource_id, variation_id=None, cached=True, headers=None, timeout=None):
@@ -103,25 +166,351 @@ class Query(object):
         a Resource object in the `get` method.
         """
         key = self.query_key(resource_id, variation_id)
-        resource_data = None
-        if cached:
-            resource_data = self._client._cache.get(key)
-            if resource_data is not None:
-                return resource_data
+        entry = self._cache_get(key) if cached else None
+        if entry is not None:
+            if not entry.is_stale():
+                return self._entry_data(key, entry)
+            # serve stale data while it is refreshed in the background, for
+            # the stale-while-revalidate grace period
+            if not entry.is_stale(time() - self._client.stale_while_revalidate):
+                self._revalidate(key, resource_id, variation_id, headers, timeout, entry)
+                return entry.data
+
+        # Cache miss (or expired entry); get fresh data from the backend, set
+        # in cache
+        fetch = partial(
+            self._fetch_resource_data, key, resource_id, variation_id, headers, timeout, entry)
+
+        options = self._client.single_flight_options
+        if options['enable']:
+            # coalesce concurrent misses for this key, across processes too
+            # when the cache backend can share a lock
+            if options['distributed']:
+                fetch = partial(self._fetch_locked, key, fetch, cached)
+            out = self._client._single_flight.do(key, fetch)
+        else:
+            out = fetch()
+        self._filters = {}
+        return out
 
-        # Cache miss; get fresh data from the backend, set in cache
+    def _fetch_resource_data(self, key, resource_id, variation_id, headers, timeout, entry=None):
+        """
+        Request the resource data from the API (revalidating the expired cache
+        `entry`, if any) and set it in the cache.
+        """
         requestor = APIRequestor(self._client, self.resource)
-        out = requestor.get(resource_id, variation_id=variation_id, headers=headers, timeout=timeout)
+        try:
+            out, validators = self._request_resource_data(
+                requestor, resource_id, variation_id, headers, timeout, entry)
+        except HTTPError as e:
+            self._cache_set_negative({key: e})
+            raise e
         if out is not None:
-            self._client._cache.set(key, out)
-        self._filters = {}
+            self._cache_set(key, out, validators)
         return out
 
+    def _revalidate(self, key, resource_id, variation_id, headers, timeout, entry=None):
+        """
+        Refresh the cache entry for `key` in a background thread, unless one is
+        already doing so.
+        """
+        self._client._single_flight.do_in_background(key, partial(
+            self._fetch_resource_data, key, resource_id, variation_id, headers, timeout, entry))
+
+    def _request_resource_data(self, requestor, resource_id, variation_id, headers, timeout, entry=None):
+        """
+        Request the resource data from the API, and return it along with the
+        cache validators of the response (None unless the client has a
+        `revalidation_window`).
+
+        An expired cache `entry` with validators is revalidated with a
+        conditional request; when the API responds that the resource was not
+        modified, the entry's data is returned rather than transferred again.
+        """
+        if not self._client.revalidation_window:
+            out = requestor.get(resource_id, variation_id=variation_id, headers=headers, timeout=timeout)
+            return out, None
+
+        etag = entry.etag if entry is not None else None
+        last_modified = entry.last_modified if entry is not None else None
+        out, validators = requestor.get_conditional(
+            resource_id, variation_id=variation_id, headers=headers, timeout=timeout,
+            etag=etag, last_modified=last_modified)
+        return self._revalidated(entry, out, validators)
+
+    @staticmethod
+    def _revalidated(entry, out, validators):
+        """
+        Return the data and validators of a conditional request for `entry`,
+        which responded with `out` (None when the resource was not modified).
+        """
+        if out is not None or entry is None or not (entry.etag or entry.last_modified):
+            return out, validators
+        # a 304 response need not repeat the validators
+        return entry.data, {
+            'etag': validators['etag'] or entry.etag,
+            'last_modified': validators['last_modified'] or entry.last_modified,
+            'max_age': validators['max_age'],
+        }
+
+    @staticmethod
+    def _entry_data(key, entry):
+        """
+        Return the data of a cache `entry`, or raise the HTTPError a negative
+        entry stands for.
+        """
+        if entry.is_negative:
+            raise _negative_cache_error(key, entry.status)
+        return entry.data
+
+    def _cache_get(self, key):
+        """Return the CacheEntry stored for `key`, or None."""
+        return CacheEntry.load(self._client._cache_get(key))
+
+    def _cache_get_many(self, keys):
+        """Return a dict of the CacheEntry objects stored for `keys`."""
+        values = self._client._cache_get_many(keys)
+        return {key: CacheEntry.load(value) for key, value in values.items()}
+
+    def _cache_entry(self, data, validators=None):
+        """
+        Return the value to store `data` in the cache with and its timeout,
+        None meaning the cache backend's default timeout, and 0 not to cache
+        it. The timeout follows the client's `cache_timeouts` policy, or else
+        the max-age of the response, from its cache `validators`.
+
+        When the client allows `stale_while_revalidate` seconds, the data is
+        kept that much longer than its timeout, and marked as stale after it.
+        Data with an ETag or Last-Modified validator is kept for (at least)
+        the client's `revalidation_window` after it, to be revalidated.
+        """
+        validators = validators or {}
+        timeout = self._client.cache_timeout(self.resource._resource_name, data)
+        if timeout == 0:
+            return None, 0
+        if timeout is None:
+            timeout = validators.get('max_age')
+
+        keep = self._client.stale_while_revalidate
+        if validators.get('etag') or validators.get('last_modified'):
+            keep = max(keep, self._client.revalidation_window)
+        if not keep:
+            return CacheEntry(data).dump(), timeout
+
+        if timeout is None:
+            timeout = self._client._cache.default_timeout
+        entry = CacheEntry(
+            data,
+            fresh_until=time() + timeout,
+            etag=validators.get('etag'),
+            last_modified=validators.get('last_modified'),
+        )
+        return entry.dump(), timeout + keep
+
+    def _cache_set(self, key, data, validators=None):
+        value, timeout = self._cache_entry(data, validators)
+        if timeout == 0:
+            return
+        self._client._cache_set(key, value, timeout=timeout)
+
+    def _cache_set_many(self, mapping, validators=None):
+        # one multi-set for each timeout
+        validators = validators or {}
+        by_timeout = {}
+        for key, data in mapping.items():
+            value, timeout = self._cache_entry(data, validators.get(key))
+            if timeout != 0:
+                by_timeout.setdefault(timeout, {})[key] = value
+        for timeout, values in by_timeout.items():
+            self._client._cache_set_many(values, timeout=timeout)
+
+    def _cache_set_negative(self, errors):
+        """
+        Cache the `errors` (a dict of HTTPErrors by key) the client caches
+        negative entries for, for its `negative_cache_timeout`.
+        """
+        timeout = self._client.negative_cache_timeout
+        if not timeout:
+            return
+        values = {
+            key: CacheEntry(None, status=e.response.status_code).dump()
+            for key, e in errors.items()
+            if e.response is not None and e.response.status_code in NEGATIVE_CACHE_STATUS_CODES
+        }
+        if values:
+            self._client._cache_set_many(values, timeout=timeout)
+
+    def _fetch_locked(self, key, fetch, cached):
+        """
+        Call `fetch` while holding the cache backend's lock on `key`, unless
+        another process filled the cache while we were waiting for the lock.
+        If the lock can't be acquired within the `wait_timeout` we fetch anyway.
+        """
+        options = self._client.single_flight_options
+        lock = self._client._cache.lock(key, timeout=float(options['lock_timeout']))
+        if lock is None:
+            return fetch()
+
+        acquired = lock.acquire(blocking_timeout=float(options['wait_timeout']))
+        try:
+            if cached:
+                entry = self._cache_get(key)
+                if entry is not None and not entry.is_stale():
+                    return self._entry_data(key, entry)
+            return fetch()
+        finally:
+            if acquired:
+                lock.release()
+
+    def get_many(self, resource_ids, variation_ids=None, cached=True, headers=None,
+                 httperrors_mapped_to_none=HTTPERRORS_MAPPED_TO_NONE, timeout=None,
+                 max_workers=8):
+        """
+        Returns a list of instances of the query resource, one for each of
+        `resource_ids` (and the matching item of `variation_ids`), in order.
+
+        The cache is read with a single multi-get. The misses are requested
+        concurrently by a pool of up to `max_workers` threads and written back
+        to the cache with a single multi-set. As with `get`, `None` is returned
+        in place of a resource which failed with one of the
+        `httperrors_mapped_to_none` HTTP errors, while any other error is
+        raised.
+        """
+        data = self.get_many_resource_data(
+            resource_ids,
+            variation_ids=variation_ids,
+            cached=cached,
+            headers=headers,
+            httperrors_mapped_to_none=httperrors_mapped_to_none,
+            timeout=timeout,
+            max_workers=max_workers,
+        )
+        return [
+            self.resource(d, client=self._client) if d is not None else None
+            for d in data
+        ]
+
+    def _get_many_keys(self, resource_ids, variation_ids):
+        """
+        Return the `(key, resource_id, variation_id)` triples of a `get_many`
+        call, in order.
+        """
+        resource_ids = list(resource_ids)
+        if variation_ids is None:
+            variation_ids = [None] * len(resource_ids)
+        else:
+            variation_ids = list(variation_ids)
+            if len(variation_ids) != len(resource_ids):
+                raise ValueError("variation_ids must be as long as resource_ids")
+        return [
+            (self.query_key(r, v), r, v) for r, v in zip(resource_ids, variation_ids)
+        ]
+
+    def get_many_resource_data(self, resource_ids, variation_ids=None, cached=True, headers=None,
+                               httperrors_mapped_to_none=HTTPERRORS_MAPPED_TO_NONE, timeout=None,
+                               max_workers=8):
+        """
+        Returns the list of resource data dictionaries (or `None`s) which are
+        used to initialize Resource objects in the `get_many` method.
+        """
+        # Python 3 (or the `futures` backport on Python 2)
+        from concurrent.futures import ThreadPoolExecutor
+
+        triples = self._get_many_keys(resource_ids, variation_ids)
+        keys = [key for key, _, _ in triples]
+        ids = {key: (resource_id, variation_id) for key, resource_id, variation_id in triples}
+
+        found, errors, expired = self._get_many_cached(keys, ids, headers, timeout) if cached else ({}, {}, {})
+
+        # request each missing key once
+        misses = {key: ids[key] for key in keys if key not in found and key not in errors}
+
+        requestor = APIRequestor(self._client, self.resource)
+
+        def fetch(key):
+            try:
+                return self._request_resource_data(
+                    requestor, ids[key][0], ids[key][1], headers, timeout, expired.get(key))
+            except HTTPError as e:
+                return e, None
+
+        if misses:
+            workers = min(max_workers, len(misses))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                fetched = dict(zip(misses, executor.map(fetch, misses)))
+            self._store_fetched(fetched, found, errors)
+
+        for e in errors.values():
+            if not (httperrors_mapped_to_none and e.response.status_code in httperrors_mapped_to_none):
+                raise e
+
+        return [found.get(key) for key in keys]
+
+    def _get_many_cached(self, keys, ids, headers, timeout):
+        """
+        Read `keys` from the cache for `get_many_resource_data`, and return the
+        data found, the errors of negative entries, and the expired entries to
+        revalidate, as dicts by key.
+        """
+        return self._split_cached(self._cache_get_many(keys), ids, headers, timeout)
+
+    def _split_cached(self, entries, ids, headers, timeout):
+        """
+        Split the cache `entries` read by `_get_many_cached` into the data
+        found, the errors and the expired entries.
+        """
+        found, errors, expired = {}, {}, {}
+        grace = self._client.stale_while_revalidate
+        for key, entry in entries.items():
+            if entry.is_negative:
+                errors[key] = _negative_cache_error(key, entry.status)
+            elif entry.is_stale(time() - grace):
+                expired[key] = entry
+            else:
+                # serve stale data while it is refreshed in the background
+                if entry.is_stale():
+                    self._revalidate(key, ids[key][0], ids[key][1], headers, timeout, entry)
+                found[key] = entry.data
+        return found, errors, expired
+
+    def _store_fetched(self, fetched, found, errors):
+        """
+        Cache the `(data, validators)` pairs (or `(HTTPError, None)` ones)
+        fetched by `get_many_resource_data`, and add them to its `found` data
+        or `errors`.
+        """
+        failed = {k: out for k, (out, _) in fetched.items() if isinstance(out, HTTPError)}
+        self._cache_set_negative(failed)
+        errors.update(failed)
+        data = {k: out for k, (out, _) in fetched.items() if out is not None and k not in failed}
+        if data:
+            self._cache_set_many(data, {k: fetched[k][1] for k in data})
+        found.update(data)
+
     def purge_cached(self, resource_id, variation_id=None):
         key = self.query_key(resource_id, variation_id)
-        return self._client._cache.delete(key)
+        return self._client._cache_delete(key)
+
+    def purge_all_cached(self, progress=None):
+        """
+        Delete every cached instance of the query resource, and return how many
+        were deleted. `progress(deleted)` is called as they are deleted.
+        """
+        return self._client._cache_purge(self.resource._resource_name + ':', progress=progress)
+
+    def purge_cached_listings(self):
+        """
+        Purge the cached listing pages (and counts) of the query resource, for
+        every parent and filters, see the client's `listing_cache_timeout`.
+        """
+        name = APIRequestor(self._client, self.resource)._get_uri()
+        _listing_generation(self._client, name, renew=True)
 
     def is_cached(self, resource_id, variation_id=None):
+        """
+        Returns True if `get` would not request the resource from the API,
+        i.e. if it, or a negative entry for it, is in the cache.
+        """
         key = self.query_key(resource_id, variation_id)
         return self._client._cache.is_cached(key)
 
@@ -146,9 +535,22 @@ class Query(object):
         return ":".join(parts)
 
     @_check_listable
-    def all(self, limit=None):
+    def all(self, limit=None, cursor=None, prefetch_pages=0, parallel=0):
         """Generator of instances of the query resource. If limit is set to a
         positive integer `n`, only return the first `n` results.
+
+        A `gapipy.request.PageCursor` may be passed as `cursor`; it is updated
+        as results are yielded (current page href, page number, results seen)
+        and passing it to a later call resumes the listing where it stopped.
+
+        If `prefetch_pages` is a positive integer `k`, the next pages of the
+        listing are requested in a background thread, up to `k` pages ahead of
+        the results being yielded.
+
+        If `parallel` is a positive integer `n`, every page of the listing is
+        planned from the `count` of the first page and requested concurrently
+        by a pool of `n` threads; results are still yielded in order. This
+        cannot be combined with `prefetch_pages`.
         """
         # check limit is valid integer value
         if limit is not None:
@@ -157,6 +559,16 @@ class Query(object):
             elif limit <= 0:
                 raise ValueError("limit must be a positive integer")
 
+        if not isinstance(prefetch_pages, int):
+            raise TypeError("prefetch_pages must be an integer")
+        elif prefetch_pages < 0:
+            raise ValueError("prefetch_pages must not be negative")
+
+        if not isinstance(parallel, int):
+            raise TypeError("parallel must be an integer")
+        elif parallel < 0:
+            raise ValueError("parallel must not be negative")
+
         requestor = APIRequestor(
             self._client,
             self.resource,
@@ -169,9 +581,29 @@ class Query(object):
         if isinstance(self._raw_data, dict):
             href = self._raw_data.get("href")
 
-        # generator to fetch list resources
-        for result in islice(requestor.list(href), limit):
-            yield self.resource(result, client=self._client, stub=True)
+        # generator to fetch list resources, closed explicitly so a read-ahead
+        # thread stops as soon as we're done
+        results = requestor.list(
+            href, cursor=cursor, prefetch_pages=prefetch_pages, parallel=parallel)
+        objects = (
+            self.resource(result, client=self._client, stub=True)
+            for result in islice(results, limit)
+        )
+        try:
+            if not self._prefetch:
+                for obj in objects:
+                    yield obj
+                return
+
+            while True:
+                batch = list(islice(objects, PREFETCH_BATCH_SIZE))
+                if not batch:
+                    return
+                self._resolve_prefetch(batch)
+                for obj in batch:
+                    yield obj
+        finally:
+            results.close()
 
     def filter(self, **kwargs):
         """Add filter arguments to the query.
@@ -184,6 +616,82 @@ class Query(object):
         clone._filters.update(kwargs)
         return clone
 
+    def prefetch(self, *fields):
+        """Resolve stubs in batches while iterating over the query.
+
+        `fields` are names of resource fields or model collection fields of
+        the query resource (e.g. `tour_dossier` or `structured_itineraries`
+        for departures), or `self` for the listed resources themselves. As
+        results are iterated, the stubs reachable through those fields are
+        collected a batch at a time, deduplicated, fetched through
+        `get_many_resource_data` and filled in place, instead of being fetched
+        one by one as they are accessed.
+
+        Listings only return a summary of each resource, so related fields
+        which are not part of it are only found when `self` is prefetched.
+
+        i.e. `client.departures.prefetch('self', 'tour_dossier')`
+        """
+        related = self.resource._resource_fields + self.resource._model_collection_fields
+        names = [name for name, _ in related]
+        for field in fields:
+            if field != PREFETCH_SELF and field not in names:
+                raise ValueError(
+                    "{} has no resource or model collection field {!r}".format(
+                        self.resource.__name__, field)
+                )
+
+        clone = self._clone()
+        clone._prefetch += tuple(f for f in fields if f not in clone._prefetch)
+        return clone
+
+    def _prefetch_groups(self, objects):
+        """
+        Yield the stubs to resolve for a batch of `objects`, grouped by
+        resource class, as `(resource_cls, {(id, variation_id): [stubs]})`.
+        """
+        from .resources.base import Resource
+
+        for field in self._prefetch:
+            if field == PREFETCH_SELF:
+                candidates = objects
+            else:
+                candidates = []
+                for obj in objects:
+                    # read from __dict__, so a stub is not fetched on access
+                    value = obj.__dict__.get(field)
+                    if isinstance(value, list):
+                        candidates.extend(value)
+                    elif value is not None:
+                        candidates.append(value)
+
+            groups = {}
+            for stub in candidates:
+                if not (isinstance(stub, Resource) and stub.is_stub and stub.__dict__.get('id')):
+                    continue
+                ids = (stub.__dict__['id'], stub.__dict__.get('variation_id'))
+                groups.setdefault(type(stub), {}).setdefault(ids, []).append(stub)
+
+            for resource_cls, stubs in groups.items():
+                yield resource_cls, stubs
+
+    @staticmethod
+    def _fill_stubs(stubs, data):
+        """Fill a group of stubs from `_prefetch_groups` with `data`, in order."""
+        for same_stubs, resource_data in zip(stubs.values(), data):
+            # stubs which could not be fetched are left as they are
+            if resource_data is None:
+                continue
+            for stub in same_stubs:
+                stub._fill_fields(resource_data)
+                stub.is_stub = False
+
+    def _resolve_prefetch(self, objects):
+        for resource_cls, stubs in self._prefetch_groups(objects):
+            ids, variation_ids = zip(*stubs.keys())
+            query = Query(self._client, resource_cls)
+            self._fill_stubs(stubs, query.get_many_resource_data(ids, variation_ids))
+
     @_check_listable
     def count(self):
         """Returns the number of element in the query."""
@@ -1,8 +1,16 @@
-from uuid import uuid1
-
-from future.moves.urllib.parse import urlparse
+import hashlib
+import json
+import threading
+from collections import deque
+from itertools import islice
+from math import ceil
+from uuid import uuid1, uuid4
+
+from future.moves.queue import Full, Queue
+from future.moves.urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 from future.utils import PY2, raise_from, raise_with_traceback
 import requests.exceptions
+from requests.status_codes import codes
 
 from gapipy.constants import ACCEPTABLE_RESPONSE_STATUS_CODES
 from gapipy.constants import ALLOWED_METHODS
@@ -12,6 +20,158 @@ from gapipy.exceptions import TimeoutError
 from . import __title__, __version__
 
 
+def _next_href(response):
+    """Return the href of the `next` link of a listing response, if any."""
+    for link in response.get('links', []):
+        if link['rel'] == 'next':
+            return link['href']
+    return None
+
+
+def _conditional_headers(headers, etag=None, last_modified=None):
+    """
+    Return `headers` along with those making a request conditional on the
+    `etag` and `last_modified` validators of an earlier response.
+    """
+    headers = dict(headers or {})
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def _cache_validators(headers):
+    """
+    Return the `etag`, `last_modified` and `max_age` (from Cache-Control) of
+    the response with the given `headers`, each of them None when missing.
+    """
+    max_age = None
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() == 'max-age' and value.strip().isdigit():
+            max_age = int(value)
+    return {
+        'etag': headers.get('ETag'),
+        'last_modified': headers.get('Last-Modified'),
+        'max_age': max_age,
+    }
+
+
+def _listing_generation(client, name, renew=False):
+    """
+    Return the generation token of the cached listings of the `name` resource.
+
+    Listing pages are cached under the current token, so that a new token (see
+    `renew`) purges all of them at once. Losing the token, e.g. to eviction,
+    only does the same.
+    """
+    key = 'listings:{0}'.format(name)
+    token = None if renew else client._cache_get(key)
+    if token is None:
+        token = uuid4().hex[:12]
+        timeout = max(client.listing_cache_timeout, client._cache.default_timeout)
+        client._cache_set(key, token, timeout=timeout)
+    return token
+
+
+def _page_number(href):
+    """Return the `page` query parameter of `href` as an int, if any."""
+    page = dict(parse_qsl(urlparse(href).query)).get('page')
+    return int(page) if page and page.isdigit() else None
+
+
+def _page_href(href, number):
+    """Return `href` with its `page` query parameter set to `number`."""
+    parts = urlparse(href)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != 'page']
+    query.append(('page', str(number)))
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def _read_ahead(iterable, size):
+    """
+    Generator over `iterable`, which is consumed by a background thread that
+    keeps up to `size` of its items buffered ahead of the caller.
+
+    Exceptions raised by `iterable` are re-raised to the caller, and the
+    background thread stops as soon as this generator is closed.
+    """
+    buffer = Queue(maxsize=size)
+    stop = threading.Event()
+    item_, error_, done_ = range(3)
+
+    def put(entry):
+        # Never block forever on a full buffer, so the worker notices when the
+        # caller has stopped consuming
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item_, item)):
+                    return
+        except Exception as exc:  # pylint: disable=broad-except
+            put((error_, exc))
+        else:
+            put((done_, None))
+
+    worker = threading.Thread(target=produce, name='gapipy-read-ahead')
+    worker.daemon = True
+    worker.start()
+    try:
+        while True:
+            kind, value = buffer.get()
+            if kind == done_:
+                return
+            if kind == error_:
+                raise value
+            yield value
+    finally:
+        stop.set()
+
+
+class PageCursor(object):
+    """
+    The position of a listing as `APIRequestor.list` walks through its pages.
+
+    `href` is the uri of the page being read (None for the first page of a
+    listing built from the resource), `page` its 1-based number, `offset` the
+    number of results consumed from it and `items_seen` the number of results
+    consumed from the whole listing.
+
+    Passing a cursor which has already been advanced to `list` (or
+    `Query.all`) resumes the listing right after the last consumed result.
+    """
+
+    def __init__(self, href=None, page=0, offset=0, items_seen=0):
+        self.href = href
+        self.page = page
+        self.offset = offset
+        self.items_seen = items_seen
+
+    def __repr__(self):
+        return '<PageCursor: page={} offset={} items_seen={} href={}>'.format(
+            self.page, self.offset, self.items_seen, self.href)
+
+    def advance(self, href):
+        """Move the cursor to the start of the page at `href`."""
+        self.href = href
+        self.page += 1
+        self.offset = 0
+
+    def consume(self):
+        """Record that one more result of the current page was consumed."""
+        self.offset += 1
+        self.items_seen += 1
+
+
 class APIRequestor(object):
 
     def __init__(self, client, resource, params=None, parent=None):
@@ -22,16 +182,21 @@ class APIRequestor(object):
 
     def _request(self, uri, method, data=None, params=None, additional_headers=None, timeout=None):
         """Make an HTTP request to a target API method with proper headers."""
+        url, headers, params = self._prepare_request(uri, method, params, additional_headers)
+        response = self._make_call(method, url, headers, data, params, timeout)
+        return response
 
+    def _prepare_request(self, uri, method, params, additional_headers):
+        """Return the URL, headers and parameters of a request to `uri`."""
         assert method in ALLOWED_METHODS, "Only {} are allowed.".format(', '.join(ALLOWED_METHODS))
         url = self._get_url(uri)
         headers = self._get_headers(method, additional_headers)
         if self.client.uuid:
-            if not params:
-                params = {}
+            # leave the caller's parameters, such as a query's filters, as
+            # they are
+            params = dict(params or {})
             params['uuid'] = str(uuid1())
-        response = self._make_call(method, url, headers, data, params, timeout)
-        return response
+        return url, headers, params
 
     def _get_url(self, uri):
         """Return the full URL to make a request to for the given `uri`"""
@@ -88,24 +253,31 @@ class APIRequestor(object):
         """Make the actual request to the API, using the given URL, headers,
         data and extra parameters.
         """
+        response = self._send(method, url, headers, data, params, timeout)
+        return self._handle_response(response)
+
+    def _send(self, method, url, headers, data, params, timeout):
+        """Send the request to the API, and return its response."""
         requests_call = getattr(self.client.requestor, method.lower())
 
         self.client.logger.debug('Making a {0} request to {1}'.format(method, url))
 
         try:
-            response = requests_call(url, headers=headers, data=data, params=params, timeout=timeout)
+            return requests_call(url, headers=headers, data=data, params=params, timeout=timeout)
         except requests.exceptions.Timeout as exc:
             # if a timeout is defined, chain it to and raise our TimeoutError
             if timeout:
                 raise_from(TimeoutError, exc)
             # otherwise re-raise the original exception
             raise_with_traceback(exc)
-        else:
-            if response.status_code in ACCEPTABLE_RESPONSE_STATUS_CODES:
-                return response.json()
-            # raise error if non 4xx or 5xx response status
-            response.reason = response.text
-            return response.raise_for_status()
+
+    def _handle_response(self, response):
+        """Return the JSON data of `response`, raising its HTTP error if any."""
+        if response.status_code in ACCEPTABLE_RESPONSE_STATUS_CODES:
+            return response.json()
+        # raise error if non 4xx or 5xx response status
+        response.reason = response.text
+        return response.raise_for_status()
 
     def _get_uri(self):
         """
@@ -148,6 +320,29 @@ class APIRequestor(object):
         uri = '/'.join(components)
         return self._request(uri, 'GET', additional_headers=headers, timeout=timeout)
 
+    def get_conditional(self, resource_id, variation_id=None, headers=None, timeout=None,
+                        etag=None, last_modified=None):
+        """
+        Get a single resource like `get`, unless it was not modified since the
+        response the `etag` and `last_modified` validators came with.
+
+        Returns the resource data (None if it was not modified) along with the
+        cache validators of the response, see `_cache_validators`.
+        """
+        url, headers, params = self._prepare_conditional_request(
+            resource_id, variation_id, headers, etag, last_modified)
+        response = self._send('GET', url, headers, None, params, timeout)
+        if response.status_code == codes.NOT_MODIFIED:
+            return None, _cache_validators(response.headers)
+        return self._handle_response(response), _cache_validators(response.headers)
+
+    def _prepare_conditional_request(self, resource_id, variation_id, headers, etag, last_modified):
+        components = ['', self._get_uri(), str(resource_id)]
+        if variation_id:
+            components.append(str(variation_id))
+        return self._prepare_request(
+            '/'.join(components), 'GET', None, _conditional_headers(headers, etag, last_modified))
+
     def update(self, resource_id, data, partial=True, uri=None):
         """
         Update a single resource with the given data.
@@ -176,7 +371,44 @@ class APIRequestor(object):
         `self.resource._resource_name` and `self.parent`. Note that only the
         first page of results will be returned. To get an iterator over all
         resources, use `list`.
+
+        When the client has a `listing_cache_timeout`, the response is cached
+        for that many seconds.
+        """
+        key = self._listing_key(uri)
+        if key is not None:
+            response = self.client._cache_get(key)
+            if response is not None:
+                return response
+
+        response = self._list_raw(uri)
+        if key is not None and response is not None:
+            self.client._cache_set(key, response, timeout=self.client.listing_cache_timeout)
+        return response
+
+    def _listing_key(self, uri):
+        """
+        Return the cache key of the listing page at `uri` (the first one when
+        None), or None when the client does not cache listings.
+
+        The key is made of the resource name, the generation of its cached
+        listings, and a digest of the parent, filters (but for the request
+        `uuid`) and `uri`.
         """
+        if not self.client.listing_cache_timeout:
+            return None
+        name = self._get_uri()
+        params = dict(self.params or {})
+        params.pop('uuid', None)
+        parts = [
+            list(self.parent) if self.parent else None,
+            sorted(params.items()),
+            uri,
+        ]
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        return 'listings:{0}:{1}:{2}'.format(name, _listing_generation(self.client, name), digest)
+
+    def _list_raw(self, uri):
         # A uri is provided, the primary use case is that `list` has been
         # called and as GAPI's next hrefs preserve the parameter filters, we
         # don't want to duplicate them.
@@ -207,15 +439,113 @@ class APIRequestor(object):
 
         return self._request(uri, 'GET', params=self.params)
 
-    def list(self, uri=None):
-        """Generator for listing resources"""
+    def pages(self, uri=None):
+        """
+        Generator of the `(uri, response)` pairs of each page of a listing,
+        starting at `uri` (see `list_raw`) and following the `next` links.
+        """
+        while True:
+            response = self.list_raw(uri)
+            yield uri, response
+
+            uri = _next_href(response)
+            if uri is None:
+                return
+
+    def parallel_pages(self, uri=None, workers=4):
+        """
+        Generator of the `(uri, response)` pairs of each page of a listing,
+        like `pages`, where the pages after the first are requested
+        concurrently by a pool of `workers` threads.
+
+        The remaining pages are planned from the `count` and `max_per_page` of
+        the first response and the `page` parameter of its `next` link, and
+        are yielded in order. If the listing changes while it is being read,
+        results may be repeated or missed at page boundaries. Listings which
+        cannot be planned are read by following their `next` links.
+        """
+        # Python 3 (or the `futures` backport on Python 2)
+        from concurrent.futures import ThreadPoolExecutor
 
         response = self.list_raw(uri)
-        for result in response['results']:
-            yield result
+        yield uri, response
+
+        next_href = _next_href(response)
+        if next_href is None:
+            return
+
+        first_page = _page_number(next_href)
+        page_size = response.get('max_per_page') or len(response['results'])
+        count = response.get('count')
+        if first_page is None or not page_size or count is None:
+            for page in self.pages(next_href):
+                yield page
+            return
+
+        last_page = int(ceil(count / float(page_size)))
+        hrefs = (_page_href(next_href, n) for n in range(first_page, last_page + 1))
+
+        # Keep a bounded window of requests in flight, so that an abandoned
+        # listing does not go on to request every remaining page
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque(
+            (href, executor.submit(self.list_raw, href)) for href in islice(hrefs, 2 * workers)
+        )
+        try:
+            while pending:
+                href, future = pending.popleft()
+                response = future.result()
+                for following in islice(hrefs, 1):
+                    pending.append((following, executor.submit(self.list_raw, following)))
+                yield href, response
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def list(self, uri=None, cursor=None, prefetch_pages=0, parallel=0):
+        """Generator for listing resources
+
+        Pages are requested one after the other by following the `next` link
+        of each response, so the stack depth and the cost per result stay
+        constant however many pages are read.
+
+        If a `cursor` (see `PageCursor`) is given it is kept up to date as
+        results are consumed. A cursor which has already been advanced
+        resumes the listing from its position, and `uri` is ignored.
+
+        If `prefetch_pages` is a positive integer `k`, the pages are requested
+        by a background thread which keeps up to `k` pages buffered ahead of
+        the results being consumed.
+
+        If `parallel` is a positive integer `n`, the pages are requested
+        concurrently by `n` threads, see `parallel_pages`.
+        """
+        if prefetch_pages and parallel:
+            raise ValueError("prefetch_pages and parallel cannot be combined")
 
-        for link in response.get('links', []):
-            if link['rel'] != 'next':
-                continue
-            for result in self.list(link['href']):
-                yield result
+        if cursor is None:
+            cursor = PageCursor()
+        if cursor.page:
+            uri, skip = cursor.href, cursor.offset
+        else:
+            cursor.advance(uri)
+            skip = 0
+
+        if parallel:
+            pages = self.parallel_pages(uri, workers=parallel)
+        else:
+            pages = self.pages(uri)
+        if prefetch_pages:
+            pages = _read_ahead(pages, prefetch_pages)
+
+        try:
+            for number, (href, response) in enumerate(pages):
+                if number:
+                    cursor.advance(href)
+                    skip = 0
+                for result in response['results'][skip:]:
+                    cursor.consume()
+                    yield result
+        finally:
+            pages.close()
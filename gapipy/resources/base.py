@@ -34,7 +34,13 @@ class Resource(BaseModel):
         httperrors_mapped_to_none is a list of HTTP errors we will silently absorb (i.e.
         not float up). This brings back behavior prior to 2.25.0.
         ref: https://github.com/gadventures/gapipy/pull/119
+
+        When this resource is bound to an AsyncClient an awaitable is returned
+        instead, which resolves to this resource once it has been fetched.
         """
+        if getattr(self._client, 'is_async', False):
+            return self._client._fetch_resource(self, httperrors_mapped_to_none)
+
         logger.info('Fetching %s/%s', self._resource_name, self.id)
 
         # Fetch the resource using the client bound on it, which handles cache get/set.
@@ -63,6 +69,12 @@ class Resource(BaseModel):
             )
 
         if name in self._allowed_fields() and self.is_stub:
+            # An AsyncClient cannot fetch the stub from within attribute
+            # access, it has to be awaited explicitly.
+            if getattr(self._client, 'is_async', False):
+                raise AttributeError(
+                    "%r is a stub, await its fetch() before accessing %r" % (type(self).__name__, name)
+                )
             self.fetch()
             return self.__getattribute__(name)
 
@@ -91,10 +103,8 @@ class Resource(BaseModel):
     def to_json(self):
         return json.dumps(self.to_dict())
 
-    def _update(self, partial=False):
-        request = APIRequestor(self._client, self)
-
-        # payload to send
+    def _update_data(self, partial=False):
+        """Return the payload to send when updating this resource."""
         data = self.to_dict()
 
         # when making a partial (PATCH) request, ensure we only include values
@@ -107,9 +117,18 @@ class Resource(BaseModel):
             data = {k: v for k, v in data.items() if self._raw_data.get(k) != v}
             if not data:
                 raise EmptyPartialUpdateError
+        return data
 
+    def _update(self, partial=False):
+        request = APIRequestor(self._client, self)
+        data = self._update_data(partial=partial)
         return request.update(self.id, json.dumps(data), partial=partial)
 
+    def _is_update(self):
+        # due to the explicit check for `id` in __getattr__, we need to check
+        # the __dict__ directly for the `id` attribute... 🐔 & 🥚 situation
+        return 'id' in self.__dict__ and self.__dict__['id']
+
     def _create(self):
         request = APIRequestor(self._client, self)
         return request.create(self.to_json())
@@ -124,14 +143,15 @@ class Resource(BaseModel):
         Added (2.35.0): we check if a partial update threw an exception and
                         re-raise it if the client has been configured to do so
                         via raise_on_empty_update config option.
+
+        When this resource is bound to an AsyncClient an awaitable is returned
+        instead, which resolves to this resource once it has been saved.
         """
+        if getattr(self._client, 'is_async', False):
+            return self._client._save_resource(self, partial)
 
         # update if we have an `id` value
-        #
-        # due to the explicit check for `id` in __getattr__, we need to check
-        # the __dict__ directly for the `id` attribute... 🐔 & 🥚 situation
-        is_update = 'id' in self.__dict__ and self.__dict__['id']
-        if is_update:
+        if self._is_update():
             try:
                 result = self._update(partial=partial)
             except EmptyPartialUpdateError:
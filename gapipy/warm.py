@@ -0,0 +1,256 @@
+"""
+Cache warming
+
+Walk the listings of some resources and load every listed resource (and,
+optionally, the resources it references) into the client's cache, e.g. after
+a deploy or a cache failover:
+
+    from gapipy import Client
+    from gapipy.warm import warm
+
+    api = Client(cache_backend='gapipy.cache.RedisCache')
+    warm(api, ['tour_dossiers', 'countries', 'itineraries'],
+         related={'itineraries': ['start_location', 'end_location']})
+
+or from the command line, with the client configured from the environment:
+
+    python -m gapipy.warm tour_dossiers countries itineraries \\
+        --related itineraries:start_location,end_location --state warm.json
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+from collections import OrderedDict
+from itertools import islice
+from time import time
+
+from .query import Query
+from .request import PageCursor
+from .utils import get_resource_class_from_class_name
+
+
+class WarmProgress(object):
+    """
+    The throughput of a `warm` run: how many listed (`loaded`) and referenced
+    (`related`) resources were loaded, by resource name in `counts`, and how
+    fast.
+    """
+
+    def __init__(self):
+        self.started = time()
+        self.loaded = 0
+        self.related = 0
+        self.counts = {}
+
+    @property
+    def elapsed(self):
+        return time() - self.started
+
+    @property
+    def rate(self):
+        """The number of resources loaded per second."""
+        elapsed = self.elapsed
+        return (self.loaded + self.related) / elapsed if elapsed else 0.0
+
+    def add(self, resource_name, count, related=False):
+        if related:
+            self.related += count
+        else:
+            self.loaded += count
+        self.counts[resource_name] = self.counts.get(resource_name, 0) + count
+
+    def __str__(self):
+        return '{} resources ({} related) in {:.1f}s, {:.1f}/s'.format(
+            self.loaded, self.related, self.elapsed, self.rate)
+
+
+def _cursor_state(cursor, done=False):
+    return {
+        'href': cursor.href,
+        'page': cursor.page,
+        'offset': cursor.offset,
+        'items_seen': cursor.items_seen,
+        'done': done,
+    }
+
+
+def _related_ids(resource_cls, resources_data, fields):
+    """
+    Yield the `(resource class, [(id, variation_id)])` of the resources the
+    `fields` of the `resources_data` (raw data of `resource_cls` resources)
+    reference, once each.
+    """
+    from .resources.base import Resource
+
+    declared = dict(resource_cls._resource_fields + resource_cls._model_collection_fields)
+    groups = OrderedDict()
+    for field in fields:
+        related_cls = declared.get(field)
+        if related_cls is not None and not isinstance(related_cls, type):
+            related_cls = get_resource_class_from_class_name(related_cls)
+        if related_cls is None or not issubclass(related_cls, Resource):
+            continue
+        for data in resources_data:
+            value = data.get(field)
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and item.get('id'):
+                    ids = groups.setdefault(related_cls, OrderedDict())
+                    ids[(item['id'], item.get('variation_id'))] = None
+    for related_cls, ids in groups.items():
+        yield related_cls, list(ids)
+
+
+def warm(client, resources, filters=None, related=None, batch_size=50, max_workers=8, force=False,
+         state=None, progress=None):
+    """
+    Load every resource listed by the `resources` (resource names) into the
+    cache of `client`, `batch_size` at a time, each batch requested by up to
+    `max_workers` threads. Resources which are already cached are left as they
+    are unless `force` is True.
+
+    `filters` maps resource names to the listing filters to apply, e.g.
+    `{'departures': {'start_date': '2024-06-01'}}`, and `related` maps them to
+    the resource fields whose resources are also loaded, e.g.
+    `{'itineraries': ['start_location', 'end_location']}`.
+
+    `state` is a dict updated, after each batch, with the position of each
+    listing; passing it to a later call resumes from there, skipping the
+    listings which were completed. `progress(report)` is called after each
+    batch with a `WarmProgress`, which is also returned.
+    """
+    if client.is_async:
+        raise ValueError("warm is not supported with an asynchronous client")
+    filters = filters or {}
+    related = related or {}
+    if state is None:
+        state = {}
+    report = WarmProgress()
+
+    for name in resources:
+        position = state.setdefault(name, {})
+        if position.get('done'):
+            continue
+        position.pop('done', None)
+        cursor = PageCursor(**position)
+
+        query = client.query(name).filter(**filters.get(name, {}))
+        # validates the related fields
+        related_fields = client.query(name).prefetch(*related.get(name, ()))._prefetch
+        listing = query.all(cursor=cursor)
+        while True:
+            stubs = list(islice(listing, batch_size))
+            if not stubs:
+                break
+            # the stubs' raw data, so a stub is not fetched on access
+            resources_data = query.get_many_resource_data(
+                [stub._raw_data['id'] for stub in stubs],
+                variation_ids=[stub._raw_data.get('variation_id') for stub in stubs],
+                cached=not force,
+                max_workers=max_workers,
+            )
+            report.add(name, len(stubs))
+
+            loaded = [data for data in resources_data if data is not None]
+            for resource_cls, ids in _related_ids(query.resource, loaded, related_fields):
+                resource_ids, variation_ids = zip(*ids)
+                Query(client, resource_cls).get_many_resource_data(
+                    resource_ids, variation_ids, cached=not force, max_workers=max_workers)
+                report.add(resource_cls._resource_name, len(ids), related=True)
+
+            state[name] = _cursor_state(cursor)
+            if progress is not None:
+                progress(report)
+
+        state[name] = _cursor_state(cursor, done=True)
+        if progress is not None:
+            progress(report)
+
+    return report
+
+
+def _save_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.rename(tmp_path, path)
+
+
+def _pairs(parser, values):
+    """Parse `RESOURCE:KEY=VALUE` and `RESOURCE:FIELD,FIELD` arguments."""
+    for value in values or ():
+        name, sep, rest = value.partition(':')
+        if not sep:
+            parser.error('expected RESOURCE:..., got {!r}'.format(value))
+        yield name, rest
+
+
+def _option(option):
+    """
+    Parse a `KEY=VALUE` option, the value as JSON (e.g. `60`, `null` or
+    `true`) or else as a string.
+    """
+    key, _, value = option.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def main(argv=None):
+    from .client import Client
+
+    parser = argparse.ArgumentParser(
+        prog='python -m gapipy.warm',
+        description='Load G API resources into the cache configured from the environment.',
+    )
+    parser.add_argument('resources', nargs='+', metavar='RESOURCE', help='a resource name, e.g. tour_dossiers')
+    parser.add_argument('--filter', action='append', metavar='RESOURCE:KEY=VALUE',
+                        help='filter the listing of a resource')
+    parser.add_argument('--related', action='append', metavar='RESOURCE:FIELD[,FIELD]',
+                        help='also load the resources referenced by these fields')
+    parser.add_argument('--cache-backend', help='the cache backend, defaults to $GAPI_CACHE_BACKEND')
+    parser.add_argument('--cache-option', action='append', metavar='KEY=VALUE',
+                        help='an option of the cache backend')
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--force', action='store_true', help='reload the resources which are cached')
+    parser.add_argument('--state', metavar='PATH', help='the file to resume from and save progress to')
+    args = parser.parse_args(argv)
+
+    filters = {}
+    for name, condition in _pairs(parser, args.filter):
+        key, _, value = condition.partition('=')
+        filters.setdefault(name, {})[key] = value
+    related = {}
+    for name, fields in _pairs(parser, args.related):
+        related.setdefault(name, []).extend(f for f in fields.split(',') if f)
+
+    config = {}
+    if args.cache_backend:
+        config['cache_backend'] = args.cache_backend
+    if args.cache_option:
+        config['cache_options'] = dict(_option(option) for option in args.cache_option)
+    client = Client(**config)
+
+    state = {}
+    if args.state and os.path.exists(args.state):
+        with open(args.state) as f:
+            state = json.load(f)
+
+    def progress(report):
+        if args.state:
+            _save_state(args.state, state)
+        print(report, file=sys.stderr)
+
+    report = warm(client, args.resources, filters=filters, related=related, batch_size=args.batch_size,
+                  max_workers=args.max_workers, force=args.force, state=state, progress=progress)
+    for name in sorted(report.counts):
+        print('{}: {}'.format(name, report.counts[name]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+"""
+Cache invalidation driven by G API webhooks
+
+    from gapipy.webhooks import WebhookProcessor
+
+    processor = WebhookProcessor(api)
+
+    # in the view receiving the webhooks
+    processor.process(request.body, request.headers.get('X-Gapi-Signature'))
+
+See https://developers.gadventures.com/docs/webhooks.html
+"""
+import calendar
+import hmac
+import json
+import logging
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from time import time
+
+from .cache import SimpleCache
+from .constants import DATE_TIME_UTC_FORMAT
+from .exceptions import InvalidSignatureError
+from .utils import compute_request_signature
+
+logger = logging.getLogger(__name__)
+
+
+WebhookEvent = namedtuple('WebhookEvent', ['event_type', 'resource', 'id', 'variation_id', 'created'])
+
+
+def parse_events(body):
+    """
+    Return the WebhookEvents of a webhook request `body`, a JSON list of
+    events such as
+
+        {
+            "event_type": "departures.updated",
+            "resource": "departures",
+            "data": {"id": "123456", "href": "https://rest.gadventures.com/departures/123456"},
+            "created": "2021-06-01T12:00:00Z"
+        }
+
+    Events without a resource or an id are left out.
+    """
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = [payload]
+
+    events = []
+    for item in payload:
+        data = item.get('data') or {}
+        resource = item.get('resource') or (item.get('event_type') or '').split('.')[0]
+        if not resource or data.get('id') is None:
+            continue
+        events.append(WebhookEvent(
+            event_type=item.get('event_type'),
+            resource=resource,
+            id=str(data['id']),
+            variation_id=data.get('variation_id'),
+            created=item.get('created'),
+        ))
+    return events
+
+
+def _timestamp(created):
+    """Return the `created` date-time of an event as a timestamp, or None."""
+    try:
+        return calendar.timegm(datetime.strptime(created, DATE_TIME_UTC_FORMAT).utctimetuple())
+    except (TypeError, ValueError):
+        return None
+
+
+class WebhookProcessor(object):
+    """
+    Verifies, parses and acts on G API webhook requests, keeping the cache of
+    a `client` up to date.
+
+    The cache entries of the resources named by the events are purged (or,
+    when `refresh` is True, fetched again) `batch_size` at a time, from a pool
+    of `max_workers` threads. The cached listings of their resources (see the
+    client's `listing_cache_timeout`), which include those nested under a
+    parent resource, are purged too, as are those of the resources listed for
+    it in `dependencies`, e.g. `{'departures': ['tour_dossiers']}`.
+
+    Bursts of events are deduplicated: an event is skipped when its resource
+    was already handled after the event was created (allowing for
+    `clock_skew` seconds), for up to `dedupe_window` seconds.
+
+    :param application_key: the key webhook signatures are computed with,
+                            defaults to the client's.
+    """
+
+    def __init__(self, client, application_key=None, refresh=False, batch_size=50, max_workers=4,
+                 dependencies=None, dedupe_window=300, clock_skew=5):
+        if refresh and client.is_async:
+            raise ValueError("refresh is not supported with an asynchronous client")
+        self.client = client
+        self.application_key = application_key or client.application_key
+        self.refresh = refresh
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.dependencies = dependencies or {}
+        self.clock_skew = clock_skew
+        # when each resource was last handled
+        self._handled = SimpleCache(threshold=10000, default_timeout=dedupe_window)
+
+    def verify(self, body, signature):
+        """
+        Raise an InvalidSignatureError unless `signature` (the request's
+        `X-Gapi-Signature` header) matches the webhook request `body`.
+        """
+        expected = compute_request_signature(self.application_key, body)
+        if not signature or not hmac.compare_digest(expected, str(signature)):
+            raise InvalidSignatureError("Invalid webhook signature")
+
+    def process(self, body, signature):
+        """
+        Verify and handle a webhook request, and return the events acted on.
+        """
+        self.verify(body, signature)
+        return self.handle(parse_events(body))
+
+    def handle(self, events):
+        """Act on the WebhookEvents which are not duplicates, and return them."""
+        # Python 3 (or the `futures` backport on Python 2)
+        from concurrent.futures import ThreadPoolExecutor
+
+        started = time()
+        keys = self._dedupe(events)
+        events = list(keys.values())
+        by_resource = OrderedDict()
+        for event in events:
+            by_resource.setdefault(event.resource, []).append(event)
+
+        batches = []
+        listings = set()
+        for resource, resource_events in by_resource.items():
+            try:
+                query = self.client.query(resource)
+            except AttributeError:
+                logger.warning('Ignoring webhook events for unknown resource %s', resource)
+                continue
+            listings.add(resource)
+            listings.update(self.dependencies.get(resource, ()))
+            for start in range(0, len(resource_events), self.batch_size):
+                batches.append((query, resource_events[start:start + self.batch_size]))
+
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                # consume the results, to raise any error
+                list(executor.map(lambda batch: self._handle_batch(*batch), batches))
+
+        for resource in listings:
+            try:
+                self.client.query(resource).purge_cached_listings()
+            except AttributeError:
+                logger.warning('Ignoring dependent listings of unknown resource %s', resource)
+
+        # only once they were acted on, so a failed delivery can be retried
+        self._handled.set_many({key: started for key in keys})
+        return events
+
+    def _dedupe(self, events):
+        """
+        Return the events which were not handled since they were created, by
+        the key they are deduplicated on.
+        """
+        keys = OrderedDict()
+        for event in events:
+            key = '{0}:{1}:{2}'.format(event.resource, event.id, event.variation_id or '')
+            handled = self._handled.get(key)
+            created = _timestamp(event.created)
+            if handled is not None and created is not None and created + self.clock_skew < handled:
+                continue
+            keys.setdefault(key, event)
+        return keys
+
+    def _handle_batch(self, query, events):
+        keys = [query.query_key(event.id, event.variation_id) for event in events]
+        self.client._cache_delete_many(keys)
+        if self.refresh:
+            query.get_many(
+                [event.id for event in events],
+                variation_ids=[event.variation_id for event in events],
+                cached=False,
+            )
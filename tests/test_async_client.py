@@ -0,0 +1,217 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from requests import HTTPError, Response
+
+from gapipy.resources import Tour, TourDossier
+from gapipy.resources.base import Resource
+
+from .fixtures import (
+    FIRST_PAGE_LIST_DATA, PPP_TOUR_DATA, SECOND_PAGE_LIST_DATA, TOUR_DOSSIER_LIST_DATA,
+)
+
+try:
+    from unittest import mock  # Python 3
+except ImportError:
+    import mock  # Python 2
+
+
+def _httpx_installed():
+    """Returns True if and only if the httpx module is available"""
+    try:
+        import httpx  # NOQA
+        return True
+    except ImportError:
+        return False
+
+
+class MockResource(Resource):
+    _as_is_fields = ['id', 'first_name', 'last_name']
+    _resource_name = 'mocks'
+
+
+@unittest.skipUnless(_httpx_installed(), 'httpx is not installed')
+class AsyncClientTestCase(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        from gapipy.async_client import AsyncClient
+        from gapipy.async_query import AsyncQuery
+
+        self.client = AsyncClient(cache_backend='gapipy.cache.SimpleCache')
+        self.client._cache.clear()
+        self.query_class = AsyncQuery
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    def test_resource_queries_are_async(self):
+        self.assertIsInstance(self.client.tour_dossiers, self.query_class)
+        self.assertIsInstance(self.client.tour_dossiers.filter(name='Peru'), self.query_class)
+
+    def test_single_flight_is_not_supported(self):
+        from gapipy.async_client import AsyncClient
+
+        with self.assertRaises(ValueError):
+            AsyncClient(single_flight_options={'enable': True})
+
+    def test_object_cache_is_not_supported(self):
+        from gapipy.async_client import AsyncClient
+
+        with self.assertRaises(ValueError):
+            AsyncClient(object_cache_options={'enable': True})
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call', return_value=PPP_TOUR_DATA)
+    async def test_get_is_cached(self, mock_make_call):
+        tour = await self.client.tours.get(21346)
+        self.assertIsInstance(tour, Tour)
+        self.assertEqual(tour.product_line, 'PPP')
+
+        await self.client.tours.get(21346)
+        self.assertEqual(mock_make_call.await_count, 1)
+        self.assertTrue(self.client.tours.is_cached(21346))
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_get_maps_http_errors_to_none(self, mock_make_call):
+        response = Response()
+        response.status_code = 404
+        mock_make_call.side_effect = HTTPError(response=response)
+
+        self.assertIsNone(await self.client.tours.get(1234))
+        with self.assertRaises(HTTPError):
+            await self.client.tours.get(1234, httperrors_mapped_to_none=None)
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_negative_caching(self, mock_make_call):
+        response = Response()
+        response.status_code = 410
+        mock_make_call.side_effect = HTTPError(response=response)
+        self.client.negative_cache_timeout = 30
+
+        self.assertIsNone(await self.client.tours.get(1234))
+        self.assertEqual(await self.client.tours.get_many([1234]), [None])
+        with self.assertRaises(HTTPError):
+            await self.client.tours.get(1234, httperrors_mapped_to_none=None)
+        self.assertEqual(mock_make_call.await_count, 1)
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_get_many(self, mock_make_call):
+        response = Response()
+        response.status_code = 404
+
+        async def make_call(method, url, *args):
+            resource_id = url.rsplit('/', 1)[1]
+            if resource_id == '404':
+                raise HTTPError(response=response)
+            return dict(PPP_TOUR_DATA, id=resource_id)
+        mock_make_call.side_effect = make_call
+
+        tours = await self.client.tours.get_many([1, 404, 2, 1])
+        self.assertEqual([t.id if t else None for t in tours], ['1', None, '2', '1'])
+        self.assertEqual(mock_make_call.await_count, 3)
+        self.assertTrue(self.client.tours.is_cached(2))
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_all_follows_next_links(self, mock_make_call):
+        mock_make_call.side_effect = [FIRST_PAGE_LIST_DATA, SECOND_PAGE_LIST_DATA]
+
+        dossiers = [d async for d in self.client.tour_dossiers]
+        self.assertEqual(len(dossiers), 6)
+        self.assertTrue(all(isinstance(d, TourDossier) and d.is_stub for d in dossiers))
+        self.assertEqual(
+            mock_make_call.call_args[0][1], 'http://localhost:5000/resources/?page=2')
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call', return_value=TOUR_DOSSIER_LIST_DATA)
+    async def test_all_with_limit_first_and_count(self, mock_make_call):
+        query = self.client.tour_dossiers
+        dossiers = [d async for d in query.all(limit=2)]
+        self.assertEqual([d.id for d in dossiers], ['1234', '5678'])
+
+        first = await query.first()
+        self.assertEqual(first.id, '1234')
+        self.assertEqual(await query.count(), 3)
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call', return_value=TOUR_DOSSIER_LIST_DATA)
+    async def test_listing_cache(self, mock_make_call):
+        self.client.listing_cache_timeout = 60
+        query = self.client.tour_dossiers
+        self.assertEqual(await query.count(), 3)
+        self.assertEqual((await query.first()).id, '1234')
+        self.assertEqual(mock_make_call.await_count, 1)
+
+        query.purge_cached_listings()
+        await query.count()
+        self.assertEqual(mock_make_call.await_count, 2)
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_blocking_cache_backends_run_in_an_executor(self, mock_make_call):
+        from gapipy.async_client import AsyncClient
+
+        mock_make_call.side_effect = [PPP_TOUR_DATA, TOUR_DOSSIER_LIST_DATA]
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        client = AsyncClient(
+            cache_backend='gapipy.cache.SQLiteCache',
+            cache_options={'path': os.path.join(tmp_dir, 'cache.sqlite3')},
+            listing_cache_timeout=60,
+        )
+        self.addAsyncCleanup(client.aclose)
+        threads = []
+
+        def record(func):
+            def wrapper(*args, **kwargs):
+                threads.append(threading.current_thread())
+                return func(*args, **kwargs)
+            return wrapper
+
+        for name in ('get', 'get_many', 'set', 'set_many'):
+            setattr(client._cache, name, record(getattr(client._cache, name)))
+
+        await client.tours.get(21346)
+        await client.tours.get(21346)
+        await client.tours.get_many([21346])
+        await client.tour_dossiers.count()
+        self.assertGreaterEqual(len(threads), 7)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertEqual(mock_make_call.await_count, 2)
+
+        # in-process backends are called from the event loop
+        self.assertTrue(self.client._cache.in_process)
+
+    def test_sync_iteration_is_refused(self):
+        with self.assertRaises(TypeError):
+            list(self.client.tour_dossiers)
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call', return_value=PPP_TOUR_DATA)
+    async def test_stub_fetch(self, mock_make_call):
+        stub = Tour({'id': '21346'}, client=self.client, stub=True)
+
+        # attribute access cannot fetch the stub, it must be awaited
+        with self.assertRaises(AttributeError):
+            stub.product_line
+
+        tour = await stub.fetch()
+        self.assertIs(tour, stub)
+        self.assertFalse(stub.is_stub)
+        self.assertEqual(stub.product_line, 'PPP')
+
+    @mock.patch('gapipy.async_request.AsyncAPIRequestor._make_call')
+    async def test_save(self, mock_make_call):
+        data = {'id': None, 'first_name': 'Jon', 'last_name': 'Ive'}
+        mock_make_call.return_value = dict(data, id=1)
+
+        resource = MockResource(data, client=self.client)
+        await resource.save()
+        self.assertEqual(resource.id, 1)
+        method, url = mock_make_call.call_args[0][:2]
+        self.assertEqual((method, url), ('POST', 'https://rest.gadventures.com/mocks'))
+
+        resource.first_name = 'Jonathan'
+        mock_make_call.return_value = resource.to_dict()
+        await resource.save(partial=True)
+        method, url, _, body = mock_make_call.call_args[0][:4]
+        self.assertEqual((method, url), ('PATCH', 'https://rest.gadventures.com/mocks/1'))
+        self.assertEqual(json.loads(body), {'first_name': 'Jonathan'})
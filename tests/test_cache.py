@@ -1,3 +1,8 @@
+import os
+import pickle
+import shutil
+import tempfile
+import threading
 import time
 from unittest import TestCase, skip, skipUnless
 
@@ -61,6 +66,20 @@ class DjangoCacheTestCase(TestCase):
         self.client.get('test-key')
         self.mock_cache.get.assert_called_once_with('test-key')
 
+    def test_purge(self):
+        """Should delegate 'purge' to the django cache client's delete_pattern"""
+        self.mock_cache.delete_pattern.return_value = 2
+        progress = mock.Mock()
+        self.assertEqual(self.client.purge('tours:', progress=progress), 2)
+        self.mock_cache.delete_pattern.assert_called_once_with('tours:*')
+        progress.assert_called_once_with(2)
+
+    def test_purge_not_supported(self):
+        """Should raise NotImplementedError without delete_pattern"""
+        del self.mock_cache.delete_pattern
+        with self.assertRaises(NotImplementedError):
+            self.client.purge('tours:')
+
     def test_is_cached(self):
         """Should delegate 'is_cached' to django cache client __contains__"""
         self.client.is_cached('test-key')
@@ -76,6 +95,21 @@ class DjangoCacheTestCase(TestCase):
         self.client.set('test-key', 'test-value', timeout=None)
         self.mock_cache.set.assert_called_once_with('test-key', 'test-value', self.client.default_timeout)
 
+    def test_get_many(self):
+        """Should delegate 'get_many' operation to django cache client."""
+        self.client.get_many(['a', 'b'])
+        self.mock_cache.get_many.assert_called_once_with(['a', 'b'])
+
+    def test_set_many(self):
+        """Should delegate 'set_many' operation to django cache client with default cache timeout."""
+        self.client.set_many({'a': 1})
+        self.mock_cache.set_many.assert_called_once_with({'a': 1}, self.client.default_timeout)
+
+    def test_delete_many(self):
+        """Should delegate 'delete_many' operation to django cache client."""
+        self.client.delete_many(['a', 'b'])
+        self.mock_cache.delete_many.assert_called_once_with(['a', 'b'])
+
 
 
 class SimpleCacheTestCase(TestCase):
@@ -86,6 +120,16 @@ class SimpleCacheTestCase(TestCase):
         data = c.get('foo')
         self.assertEqual(data, {'xyz': 'bar'})
 
+    def test_values_stored_as_they_are(self):
+        c = cache.SimpleCache(serializer=None, threshold=1)
+        value = {'xyz': 'bar'}
+        c.set('foo', value)
+        self.assertIs(c.get('foo'), value)
+        c.set_many({'bar': value})
+        self.assertEqual((c.get_many(['foo', 'bar']), c.info()['bytes']), ({'bar': value}, 0))
+        with self.assertRaises(ValueError):
+            cache.SimpleCache(serializer=None, max_bytes=1000)
+
     def test_get_set_resource_id(self):
         c = cache.SimpleCache()
         c.set('foo:100', {'id': 100, 'xyz': 'bar'})
@@ -99,6 +143,665 @@ class SimpleCacheTestCase(TestCase):
         c.delete('xyz')
         self.assertEqual(c.get('xyz'), None)
 
+    def test_get_many_set_many(self):
+        c = cache.SimpleCache()
+        c.set_many({'a': {'id': 1}, 'b': {'id': 2}})
+        self.assertEqual(c.get_many(['a', 'b', 'c']), {'a': {'id': 1}, 'b': {'id': 2}})
+
+    def test_delete_many(self):
+        c = cache.SimpleCache()
+        c.set_many({'a': {'id': 1}, 'b': {'id': 2}, 'c': {'id': 3}})
+        c.delete_many(['a', 'b', 'd'])
+        self.assertEqual(c.get_many(['a', 'b', 'c']), {'c': {'id': 3}})
+        self.assertEqual(c.count(), 1)
+
+    def test_purge(self):
+        c = cache.SimpleCache()
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'bookings:1': {'id': 3}})
+        self.assertEqual(c.purge('tours:'), 2)
+        self.assertEqual(list(c.get_many(['tours:1', 'tours:2', 'bookings:1'])), ['bookings:1'])
+
+    def test_set_many_evicts_least_recently_used(self):
+        c = cache.SimpleCache(threshold=2, stripes=1)
+        c.set('a', {'id': 1})
+        c.set_many({'b': {'id': 2}, 'c': {'id': 3}})
+        self.assertEqual(sorted(c.get_many(['a', 'b', 'c'])), ['b', 'c'])
+
+    def test_evicts_least_recently_used(self):
+        c = cache.SimpleCache(threshold=3, stripes=1)
+        for key in ('a', 'b', 'c'):
+            c.set(key, {'key': key})
+        # reading 'a' makes 'b' the least recently used key
+        c.get('a')
+        c.set('d', {'key': 'd'})
+
+        self.assertEqual(c.count(), 3)
+        self.assertIsNone(c.get('b'))
+        for key in ('a', 'c', 'd'):
+            self.assertEqual(c.get(key), {'key': key})
+
+    def test_evicts_against_byte_budget(self):
+        c = cache.SimpleCache(threshold=None, max_bytes=250, stripes=1, serializer='json')
+        c.set('a', {'x': 'a' * 90})  # 103 bytes, with the header
+        c.set('b', {'x': 'b' * 90})
+        c.get('a')
+        c.set('c', {'x': 'c' * 90})
+        self.assertEqual(sorted(c.get_many(['a', 'b', 'c'])), ['a', 'c'])
+        self.assertEqual(c.info()['bytes'], 206)
+
+    def test_value_over_byte_budget_is_not_stored(self):
+        c = cache.SimpleCache(max_bytes=100, stripes=1, serializer='json')
+        c.set('a', {'x': 'a'})
+        c.set('a', {'x': 'a' * 100})
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.info()['bytes'], 0)
+
+    def test_info(self):
+        c = cache.SimpleCache(max_bytes=10000, serializer='json')
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'countries:CA:en': {'id': 'CA'}})
+        c.delete('tours:2')
+        self.assertEqual(c.info(), {
+            'entries': 2,
+            'bytes': 29,
+            'threshold': 500,
+            'max_bytes': 10000,
+            'resources': {
+                'tours': {'entries': 1, 'bytes': 13},
+                'countries': {'entries': 1, 'bytes': 16},
+            },
+        })
+        c.clear()
+        self.assertEqual(c.info()['bytes'], 0)
+
+    def test_threshold_is_shared_between_stripes(self):
+        c = cache.SimpleCache(threshold=10, stripes=4)
+        for i in range(100):
+            c.set('key:{}'.format(i), {'id': i})
+        self.assertLessEqual(c.count(), 10)
+
+    def test_expired_keys_are_dropped_on_read(self):
+        c = cache.SimpleCache()
+        c.set('expired', {'id': 1}, timeout=-1)
+        self.assertFalse(c.is_cached('expired'))
+        self.assertEqual(c.count(), 1)
+        self.assertIsNone(c.get('expired'))
+        self.assertEqual(c.count(), 0)
+
+    def test_concurrent_access(self):
+        c = cache.SimpleCache(threshold=50, stripes=4)
+
+        def work(n):
+            for i in range(500):
+                key = 'key:{}'.format((n * i) % 80)
+                c.set(key, {'id': i})
+                c.get(key)
+                if i % 7 == 0:
+                    c.delete(key)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(c.count(), 50)
+
+
+class SQLiteCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_path_is_private(self):
+        with mock.patch('tempfile.gettempdir', return_value=self.tmp_dir):
+            c = cache.SQLiteCache()
+        directory = os.path.dirname(c.path)
+        self.assertEqual(os.path.dirname(directory), self.tmp_dir)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+        self.assertEqual(os.stat(c.path).st_mode & 0o077, 0)
+
+    def test_files_writable_by_others_are_refused(self):
+        open(self.path, 'w').close()
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(ValueError):
+            cache.SQLiteCache(self.path)
+
+    @skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, 'requires root')
+    def test_files_owned_by_others_are_refused(self):
+        open(self.path, 'w').close()
+        os.chown(self.path, 12345, 12345)
+        with self.assertRaises(ValueError):
+            cache.SQLiteCache(self.path)
+
+    def test_get_set(self):
+        c = cache.SQLiteCache(self.path)
+        c.set('foo', {'xyz': 'bar'})
+        self.assertEqual(c.get('foo'), {'xyz': 'bar'})
+        c.set('foo', {'xyz': 'baz'})
+        self.assertEqual(c.get('foo'), {'xyz': 'baz'})
+        self.assertEqual(c.count(), 1)
+        self.assertTrue(c.is_cached('foo'))
+        self.assertIsNone(c.get('bar'))
+
+    def test_persists_across_instances(self):
+        cache.SQLiteCache(self.path).set('tours:1', {'id': 1})
+        self.assertEqual(cache.SQLiteCache(self.path).get('tours:1'), {'id': 1})
+
+    def test_get_many_set_many_delete_many(self):
+        c = cache.SQLiteCache(self.path, threshold=None)
+        c.set_many({'key:{}'.format(i): {'id': i} for i in range(1200)})
+        keys = ['key:{}'.format(i) for i in range(0, 1300, 2)]
+        self.assertEqual(len(c.get_many(keys)), 600)
+        c.delete_many(keys)
+        self.assertEqual(c.count(), 600)
+        c.delete('key:1')
+        self.assertIsNone(c.get('key:1'))
+
+    def test_expired_keys_are_not_read(self):
+        c = cache.SQLiteCache(self.path)
+        c.set('expired', {'id': 1}, timeout=-1)
+        self.assertIsNone(c.get('expired'))
+        self.assertEqual(c.get_many(['expired']), {})
+        self.assertFalse(c.is_cached('expired'))
+
+    def test_purge_and_clear(self):
+        c = cache.SQLiteCache(self.path)
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'tour_dossiers:1': {'id': 3}})
+        progress = mock.Mock()
+        self.assertEqual(c.purge('tours:', progress=progress), 2)
+        progress.assert_called_once_with(2)
+        self.assertEqual(list(c.get_many(['tours:1', 'tours:2', 'tour_dossiers:1'])), ['tour_dossiers:1'])
+        c.clear()
+        self.assertEqual(c.count(), 0)
+
+    def test_evicts_expired_then_soonest_expiring(self):
+        c = cache.SQLiteCache(self.path, threshold=3)
+        c.set('expired', {'id': 0}, timeout=-1)
+        c.set('a', {'id': 1}, timeout=100)
+        c.set('b', {'id': 2}, timeout=10)
+        c.set_many({'c': {'id': 3}, 'd': {'id': 4}}, timeout=50)
+        self.assertEqual(sorted(c.get_many(['expired', 'a', 'b', 'c', 'd'])), ['a', 'c', 'd'])
+
+    def test_evicts_against_byte_budget(self):
+        c = cache.SQLiteCache(self.path, threshold=None, max_bytes=250, serializer='json')
+        c.set('a', {'x': 'a' * 90}, timeout=30)  # 103 bytes, with the header
+        c.set('b', {'x': 'b' * 90}, timeout=10)
+        c.set('c', {'x': 'c' * 90}, timeout=20)
+        c.set('d', {'x': 'd' * 300})
+        self.assertEqual(sorted(c.get_many(['a', 'b', 'c', 'd'])), ['a', 'c'])
+        self.assertEqual(c.info()['bytes'], 206)
+
+    def test_info(self):
+        c = cache.SQLiteCache(self.path, max_bytes=10000, serializer='json')
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'countries:CA:en': {'id': 'CA'}})
+        c.delete('tours:2')
+        self.assertEqual(c.info(), {
+            'entries': 2,
+            'bytes': 29,
+            'threshold': 500,
+            'max_bytes': 10000,
+            'resources': {
+                'tours': {'entries': 1, 'bytes': 13},
+                'countries': {'entries': 1, 'bytes': 16},
+            },
+        })
+
+    @skipUnless(hasattr(os, 'fork'), 'requires os.fork')
+    def test_shared_with_forked_processes(self):
+        c = cache.SQLiteCache(self.path)
+        c.set('parent', {'id': 1})
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = c.get('parent') == {'id': 1}
+                c.set('child', {'id': 2})
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(c.get('child'), {'id': 2})
+
+    def test_concurrent_access(self):
+        c = cache.SQLiteCache(self.path, threshold=50)
+
+        def work(n):
+            for i in range(100):
+                key = 'key:{}'.format((n * i) % 80)
+                c.set(key, {'id': i})
+                c.get(key)
+                if i % 7 == 0:
+                    c.delete(key)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLessEqual(c.count(), 50)
+
+
+@skipUnless(hasattr(os, 'fork'), 'requires a POSIX system')
+class SharedMemoryCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_default_path_is_private(self):
+        with mock.patch('os.path.isdir', return_value=False), \
+                mock.patch('tempfile.gettempdir', return_value=self.tmp_dir):
+            c = cache.SharedMemoryCache()
+        directory = os.path.dirname(c.path)
+        self.assertEqual(os.path.dirname(directory), self.tmp_dir)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+    def test_files_writable_by_others_are_refused(self):
+        open(self.path, 'w').close()
+        os.chmod(self.path, 0o666)
+        with self.assertRaises(ValueError):
+            cache.SharedMemoryCache(self.path)
+
+    @skipUnless(hasattr(os, 'geteuid') and os.geteuid() == 0, 'requires root')
+    def test_files_owned_by_others_are_refused(self):
+        open(self.path, 'w').close()
+        os.chown(self.path, 12345, 12345)
+        with self.assertRaises(ValueError):
+            cache.SharedMemoryCache(self.path)
+
+    def test_get_set(self):
+        c = cache.SharedMemoryCache(self.path)
+        c.set('foo', {'xyz': 'bar'})
+        self.assertEqual(c.get('foo'), {'xyz': 'bar'})
+        c.set('foo', {'xyz': 'baz'})
+        self.assertEqual(c.get('foo'), {'xyz': 'baz'})
+        self.assertEqual(c.count(), 1)
+        self.assertTrue(c.is_cached('foo'))
+        self.assertIsNone(c.get('bar'))
+
+    def test_get_many_set_many_delete_many(self):
+        c = cache.SharedMemoryCache(self.path)
+        c.set_many({'a': {'id': 1}, 'b': {'id': 2}, 'c': {'id': 3}})
+        self.assertEqual(c.get_many(['a', 'b', 'd']), {'a': {'id': 1}, 'b': {'id': 2}})
+        c.delete_many(['a', 'b', 'd'])
+        self.assertEqual(c.get_many(['a', 'b', 'c']), {'c': {'id': 3}})
+        c.delete('c')
+        self.assertEqual(c.count(), 0)
+
+    def test_expired_keys_are_not_read(self):
+        c = cache.SharedMemoryCache(self.path)
+        c.set('expired', {'id': 1}, timeout=-1)
+        self.assertIsNone(c.get('expired'))
+        self.assertFalse(c.is_cached('expired'))
+
+    def test_purge_and_clear(self):
+        c = cache.SharedMemoryCache(self.path)
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'tour_dossiers:1': {'id': 3}})
+        self.assertEqual(c.purge('tours:'), 2)
+        self.assertEqual(list(c.get_many(['tours:1', 'tours:2', 'tour_dossiers:1'])), ['tour_dossiers:1'])
+        c.clear()
+        self.assertEqual(c.count(), 0)
+        self.assertIsNone(c.get('tour_dossiers:1'))
+        c.set('tours:1', {'id': 1})
+        self.assertEqual(c.get('tours:1'), {'id': 1})
+
+    def test_oldest_values_are_overwritten(self):
+        c = cache.SharedMemoryCache(self.path, threshold=100, max_bytes=1000, serializer='json')
+        for i in range(100):
+            c.set('key:{}'.format(i), {'x': 'x' * 50})
+        found = c.get_many(['key:{}'.format(i) for i in range(100)])
+        # 79 bytes each, with the record header and key, so 12 fit
+        self.assertEqual(sorted(found, key=lambda key: int(key[4:])), ['key:{}'.format(i) for i in range(88, 100)])
+        self.assertEqual(c.count(), 12)
+        self.assertEqual(c.info()['bytes'], 12 * 63)
+
+    def test_full_slots_replace_the_key_closest_to_expiring(self):
+        c = cache.SharedMemoryCache(self.path, threshold=2)
+        c.set('a', {'id': 1}, timeout=100)
+        c.set('b', {'id': 2}, timeout=10)
+        c.set('c', {'id': 3}, timeout=50)
+        self.assertEqual(sorted(c.get_many(['a', 'b', 'c'])), ['a', 'c'])
+        self.assertEqual(c.count(), 2)
+
+    def test_value_over_byte_budget_is_not_stored(self):
+        c = cache.SharedMemoryCache(self.path, max_bytes=100)
+        c.set('a', {'x': 'a'})
+        c.set('a', {'x': 'a' * 100})
+        self.assertIsNone(c.get('a'))
+        self.assertEqual(c.count(), 0)
+
+    def test_info(self):
+        c = cache.SharedMemoryCache(self.path, max_bytes=10000, serializer='json')
+        c.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'countries:CA:en': {'id': 'CA'}})
+        c.delete('tours:2')
+        self.assertEqual(c.info(), {
+            'entries': 2,
+            'bytes': 29,
+            'threshold': 500,
+            'max_bytes': 10000,
+            'resources': {
+                'tours': {'entries': 1, 'bytes': 13},
+                'countries': {'entries': 1, 'bytes': 16},
+            },
+        })
+
+    def test_requires_the_same_geometry(self):
+        cache.SharedMemoryCache(self.path, threshold=10, max_bytes=1000)
+        cache.SharedMemoryCache(self.path, threshold=10, max_bytes=1000)
+        with self.assertRaises(ValueError):
+            cache.SharedMemoryCache(self.path, threshold=20, max_bytes=1000)
+
+    def test_shared_with_forked_processes(self):
+        c = cache.SharedMemoryCache(self.path)
+        c.set('parent', {'id': 1})
+        pid = os.fork()
+        if pid == 0:
+            try:
+                ok = c.get('parent') == {'id': 1}
+                c.set('child', {'id': 2})
+                # a process mapping the file on its own shares it too
+                cache.SharedMemoryCache(self.path).set('other', {'id': 3})
+            finally:
+                os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.assertEqual(c.get_many(['child', 'other']), {'child': {'id': 2}, 'other': {'id': 3}})
+
+    def test_concurrent_access(self):
+        c = cache.SharedMemoryCache(self.path, threshold=50, max_bytes=2000)
+        errors = []
+
+        def work(n):
+            for i in range(300):
+                key = 'key:{}'.format((n * i) % 80)
+                c.set(key, {'id': i, 'key': key})
+                value = c.get(key)
+                if value is not None and value['key'] != key:
+                    errors.append(value)
+                if i % 7 == 0:
+                    c.delete(key)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertLessEqual(c.count(), 50)
+        self.assertEqual(c.count(), c.info()['entries'])
+
+
+class PubSubCache(cache.SimpleCache):
+    """A SimpleCache which delivers published messages synchronously."""
+
+    subscribers = {}
+
+    def publish(self, channel, message):
+        for callback in self.subscribers.get(channel, []):
+            callback(message.encode('utf-8'))
+
+    def subscribe(self, channel, callback):
+        self.subscribers.setdefault(channel, []).append(callback)
+
+
+class TieredCacheTestCase(TestCase):
+
+    def make_cache(self, **kwargs):
+        return cache.TieredCache(backend='gapipy.cache.SimpleCache', **kwargs)
+
+    def test_reads_fall_back_to_l2_and_fill_l1(self):
+        c = self.make_cache()
+        c.l2.set('a', {'id': 1})
+        self.assertIsNone(c.l1.get('a'))
+
+        self.assertEqual(c.get('a'), {'id': 1})
+        self.assertEqual(c.l1.get('a'), {'id': 1})
+        self.assertEqual(c.get_many(['a', 'b']), {'a': {'id': 1}})
+
+    def test_writes_go_through_both_tiers(self):
+        c = self.make_cache(l1_timeout=5)
+        c.set('a', {'id': 1}, timeout=60)
+        c.set_many({'b': {'id': 2}})
+        for tier in (c.l1, c.l2):
+            self.assertEqual(tier.get_many(['a', 'b']), {'a': {'id': 1}, 'b': {'id': 2}})
+
+        c.delete('a')
+        self.assertFalse(c.is_cached('a'))
+        c.clear()
+        self.assertEqual(c.l2.count(), 0)
+
+    def test_l1_values_are_copies(self):
+        c = self.make_cache()
+        c.set('a', {'id': 1, 'flags': []})
+        c.get('a')['flags'].append('MUTATED')
+        c.get_many(['a'])['a']['flags'].append('MUTATED')
+        self.assertEqual(c.l1.get('a'), {'id': 1, 'flags': []})
+
+        # and values filled from L2 on a miss
+        c.l2.set('b', {'id': 2, 'flags': []})
+        c.get('b')['flags'].append('MUTATED')
+        self.assertEqual(c.get('b'), {'id': 2, 'flags': []})
+
+        c = self.make_cache(l1_max_bytes=1000)
+        c.set('a', {'id': 1})
+        self.assertEqual(c.l1.info()['resources']['a']['entries'], 1)
+        self.assertGreater(c.l1.info()['bytes'], 0)
+
+    def test_l1_shared(self):
+        c = self.make_cache(l1_shared=True)
+        c.set('a', {'id': 1})
+        with mock.patch('gapipy.cache.Serializer.loads') as loads:
+            self.assertIs(c.get('a'), c.get('a'))
+            self.assertEqual(c.get_many(['a']), {'a': {'id': 1}})
+        self.assertFalse(loads.called)
+
+        with self.assertRaises(ValueError):
+            self.make_cache(l1_shared=True, l1_max_bytes=1000)
+
+    def test_l1_timeout_is_capped(self):
+        c = self.make_cache(l1_timeout=5)
+        self.assertEqual(c._l1_timeout(None), 5)
+        self.assertEqual(c._l1_timeout(60), 5)
+        self.assertEqual(c._l1_timeout(1), 1)
+
+    def test_invalidation_across_nodes(self):
+        PubSubCache.subscribers = {}
+        nodes = [
+            cache.TieredCache(backend='tests.test_cache.PubSubCache', invalidation_channel='gapi')
+            for _ in range(2)
+        ]
+        for node in nodes:
+            node.l1.set('a', {'id': 1})
+
+        nodes[0].delete('a')
+        self.assertIsNone(nodes[1].l1.get('a'))
+
+        nodes[1].l1.set('b', {'id': 2})
+        nodes[0].clear()
+        self.assertEqual(nodes[1].l1.count(), 0)
+
+        # a node keeps its own writes in L1
+        nodes[0].set('c', {'id': 3})
+        self.assertEqual(nodes[0].l1.get('c'), {'id': 3})
+
+
+def _installed(module):
+    """Returns True if and only if `module` is available"""
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+class SerializerTestCase(TestCase):
+    data = {'id': '1', 'name': 'Peru' * 500, 'departures': [1, 2, 3]}
+
+    def test_round_trips(self):
+        codecs = ['pickle', 'json'] + (['msgpack'] if _installed('msgpack') else [])
+        compressions = [None, 'zlib'] + (['lz4'] if _installed('lz4') else [])
+        for codec in codecs:
+            for compression in compressions:
+                serializer = cache.Serializer(codec, compression)
+                self.assertEqual(serializer.loads(serializer.dumps(self.data)), self.data)
+
+    def test_compress_threshold(self):
+        serializer = cache.Serializer('json', 'zlib', compress_threshold=100)
+        small, large = serializer.dumps({'id': '1'}), serializer.dumps(self.data)
+        self.assertEqual(small, b'\x00G1j-{"id":"1"}')
+        self.assertTrue(large.startswith(b'\x00G1jz'))
+        self.assertLess(len(large), len(cache.Serializer('json').dumps(self.data)))
+
+    def test_uncompressed_pickle_is_stored_without_header(self):
+        # as it was by earlier versions, which can still read it
+        self.assertEqual(pickle.loads(cache.Serializer().dumps(self.data)), self.data)
+        self.assertEqual(cache.Serializer('json').loads(pickle.dumps(self.data)), self.data)
+
+    def test_reads_values_written_with_other_settings(self):
+        stored = cache.Serializer('json', 'zlib', compress_threshold=0).dumps(self.data)
+        self.assertEqual(cache.Serializer().loads(stored), self.data)
+
+    def test_unknown_settings(self):
+        with self.assertRaises(ValueError):
+            cache.Serializer('yaml')
+        with self.assertRaises(ValueError):
+            cache.Serializer(compression='bz2')
+        with self.assertRaises(ValueError):
+            cache.Serializer().loads(b'\x00G1x-')
+
+    def test_simple_cache_options(self):
+        c = cache.SimpleCache(serializer='json', compression='zlib', compress_threshold=0)
+        c.set('a', self.data)
+        self.assertEqual(c.get('a'), self.data)
+
+
+class CacheEntryTestCase(TestCase):
+
+    def test_entry_without_metadata_is_stored_as_data(self):
+        entry = cache.CacheEntry({'id': 1})
+        self.assertEqual(entry.dump(), {'id': 1})
+        self.assertEqual(cache.CacheEntry.load({'id': 1}).data, {'id': 1})
+        self.assertIsNone(cache.CacheEntry.load(None))
+
+    def test_negative_entry(self):
+        entry = cache.CacheEntry.load(cache.CacheEntry(None, status=404).dump())
+        self.assertTrue(entry.is_negative)
+        self.assertEqual((entry.data, entry.status), (None, 404))
+        self.assertFalse(cache.CacheEntry({'id': 1}).is_negative)
+
+    def test_stale_entry(self):
+        entry = cache.CacheEntry.load(cache.CacheEntry({'id': 1}, fresh_until=100).dump())
+        self.assertEqual(entry.data, {'id': 1})
+        self.assertFalse(entry.is_stale(now=99))
+        self.assertTrue(entry.is_stale(now=100))
+
+
+class ObjectCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = cache.ObjectCache(threshold=2, timeout=30)
+
+    def _set(self, key, resource):
+        self.cache.set(key, resource, self.cache.reserve(key))
+
+    def test_copies_are_handed_out(self):
+        resource = mock.Mock()
+        self._set('tours:1', resource)
+        # a copy of the resource is stored, and a copy of it is handed out
+        stored = resource._copy.return_value
+        self.assertIs(self.cache.get('tours:1'), stored._copy.return_value)
+        self.assertIs(self.cache.get('tours:1'), stored._copy.return_value)
+        self.assertEqual(len(stored._copy.mock_calls), 2)
+
+    def test_threshold_and_timeout(self):
+        self._set('tours:1', mock.Mock())
+        self._set('tours:2', mock.Mock())
+        self.cache.get('tours:1')
+        self._set('tours:3', mock.Mock())
+        self.assertIsNotNone(self.cache.get('tours:1'))
+        self.assertIsNone(self.cache.get('tours:2'))
+
+        with mock.patch('gapipy.cache.time', return_value=time.time() + 31):
+            self.assertIsNone(self.cache.get('tours:1'))
+
+    def test_delete_and_purge(self):
+        self._set('tours:1', mock.Mock())
+        self._set('tours:2', mock.Mock())
+        self.cache.delete_many(['tours:1'])
+        self.assertIsNone(self.cache.get('tours:1'))
+        self.cache.purge('tours:')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_reservations(self):
+        # deleting the key from another thread, e.g. once a stale resource
+        # was revalidated, voids the reservation
+        token = self.cache.reserve('tours:1')
+        thread = threading.Thread(target=self.cache.delete_many, args=(['tours:1'],))
+        thread.start()
+        thread.join()
+        self.cache.set('tours:1', mock.Mock(), token)
+        self.assertIsNone(self.cache.get('tours:1'))
+
+        # but not from the thread which set the data itself
+        token = self.cache.reserve('tours:1')
+        self.cache.delete_many(['tours:1'])
+        self.cache.set('tours:1', mock.Mock(), token)
+        self.assertIsNotNone(self.cache.get('tours:1'))
+
+        # releasing a reservation stores nothing
+        self.cache.set('tours:2', None, self.cache.reserve('tours:2'))
+        self.assertEqual((len(self.cache), self.cache._reserved), (1, {}))
+
+
+class SingleFlightTestCase(TestCase):
+
+    def _run_concurrently(self, single_flight, func, callers=5):
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(single_flight.do('key', func))
+            except Exception as exc:
+                outcomes.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_calls_are_coalesced(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'id': 1}
+
+        outcomes = self._run_concurrently(cache.SingleFlight(), func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [{'id': 1}] * 5)
+
+    def test_errors_are_shared(self):
+        def func():
+            time.sleep(0.1)
+            raise ValueError('boom')
+
+        outcomes = self._run_concurrently(cache.SingleFlight(), func)
+        self.assertEqual(len(outcomes), 5)
+        self.assertTrue(all(isinstance(o, ValueError) for o in outcomes))
+
+    def test_sequential_calls_are_not_coalesced(self):
+        single_flight = cache.SingleFlight()
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+        self.assertEqual(single_flight.do('key', lambda: 2), 2)
+
 
 def _redis_installed():
     """Returns True if and only if the redis module is available"""
@@ -137,3 +840,169 @@ class RedisCacheTestCase(TestCase):
         self.assertEqual(c.get('delete_me'), {0: 0})
         c.delete('delete_me')
         self.assertEqual(c.get('delete_me'), None)
+
+
+class RedisCacheCommandsTestCase(TestCase):
+    """Checks the commands sent to redis, against a mocked client."""
+
+    def setUp(self):
+        patcher = mock.patch.object(cache.RedisCache, '_get_client')
+        self.mock_client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.cache = cache.RedisCache(key_prefix='p:')
+        self.cache.REDIS_VERSION = '3.5.3'
+
+    def test_get_many_uses_mget(self):
+        self.mock_client.mget.return_value = [self.cache.dump_object({'id': 1}), None]
+        self.assertEqual(self.cache.get_many(['a', 'b']), {'a': {'id': 1}})
+        self.mock_client.mget.assert_called_once_with(['p:a', 'p:b'])
+
+    def test_set_many_pipelines_setex(self):
+        pipeline = self.mock_client.pipeline.return_value
+        self.cache.set_many({'a': {'id': 1}, 'b': {'id': 2}}, timeout=60)
+        self.mock_client.pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(
+            sorted(call[0][:2] for call in pipeline.setex.call_args_list),
+            [('p:a', 60), ('p:b', 60)],
+        )
+        pipeline.execute.assert_called_once_with()
+        self.mock_client.setex.assert_not_called()
+
+    def test_delete_many(self):
+        self.cache.delete_many(['a', 'b'])
+        self.mock_client.delete.assert_called_once_with('p:a', 'p:b')
+
+    def test_empty_batches_skip_redis(self):
+        self.assertEqual(self.cache.get_many([]), {})
+        self.cache.set_many({})
+        self.cache.delete_many([])
+        self.assertEqual(self.mock_client.method_calls, [])
+
+    def test_purge_scans_and_unlinks_in_batches(self):
+        self.cache.scan_batch_size = 2
+        self.mock_client.scan_iter.return_value = iter(['p:tours:1', 'p:tours:2', 'p:tours:3'])
+        progress = mock.Mock()
+
+        self.assertEqual(self.cache.purge('tours:', progress=progress), 3)
+        self.mock_client.scan_iter.assert_called_once_with(match='p:tours:*', count=2)
+        self.assertEqual(
+            self.mock_client.unlink.call_args_list,
+            [mock.call('p:tours:1', 'p:tours:2'), mock.call('p:tours:3')],
+        )
+        self.assertEqual(progress.call_args_list, [mock.call(2), mock.call(3)])
+        self.mock_client.keys.assert_not_called()
+
+    def test_clear_escapes_the_key_prefix(self):
+        self.cache.key_prefix = 'p[1]*:'
+        self.mock_client.scan_iter.return_value = iter([])
+        self.cache.clear()
+        self.mock_client.scan_iter.assert_called_once_with(match='p\\[1\\]\\*:*', count=500)
+        self.mock_client.unlink.assert_not_called()
+
+
+class ShardDown(Exception):
+    pass
+
+
+class ShardedRedisCacheTestCase(TestCase):
+    """Checks the commands sent to each redis server, against mocked clients."""
+
+    def setUp(self):
+        self.clients = {}
+
+        def get_client(host, port, password, db):
+            return self.clients.setdefault((host, port, db), mock.Mock(name=host))
+
+        patcher = mock.patch.object(cache.RedisCache, '_get_client', side_effect=get_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        errors_patcher = mock.patch('gapipy.cache._redis_errors', return_value=(ShardDown,))
+        errors_patcher.start()
+        self.addCleanup(errors_patcher.stop)
+
+        self.cache = cache.ShardedRedisCache(nodes=['redis-1:6379', 'redis-2:6380/1', {'host': 'redis-3'}])
+        for shard in self.cache.shards:
+            shard.REDIS_VERSION = '3.5.3'
+        self.keys = ['tour_dossiers:{}'.format(i) for i in range(30)]
+
+    def test_nodes(self):
+        self.assertEqual(
+            [shard.name for shard in self.cache.shards],
+            ['redis-1:6379/0', 'redis-2:6380/1', 'redis-3:6379/0'],
+        )
+
+    def test_stats(self):
+        stats = cache.CacheStats()
+        self.cache.stats = stats
+        self.assertEqual([shard.stats for shard in self.cache.shards], [stats] * 3)
+        self.assertEqual(sorted(self.clients), [('redis-1', 6379, 0), ('redis-2', 6380, 1), ('redis-3', 6379, 0)])
+
+    def test_keys_are_spread_consistently(self):
+        shards = [self.cache.shard(key).name for key in self.keys]
+        self.assertEqual(len(set(shards)), 3)
+
+        # removing a node only moves the keys it held
+        smaller = cache.ShardedRedisCache(nodes=['redis-1:6379', 'redis-2:6380/1'])
+        for key, name in zip(self.keys, shards):
+            if name != 'redis-3:6379/0':
+                self.assertEqual(smaller.shard(key).name, name)
+
+    def test_multi_key_operations_are_grouped_by_shard(self):
+        for shard in self.cache.shards:
+            shard._client.mget.side_effect = lambda keys: [None] * len(keys)
+        self.cache.get_many(self.keys)
+        self.cache.set_many({key: {'id': key} for key in self.keys})
+        self.cache.delete_many(self.keys)
+
+        for shard in self.cache.shards:
+            expected = sorted(key for key in self.keys if self.cache.shard(key) is shard)
+            shard._client.mget.assert_called_once_with(mock.ANY)
+            self.assertEqual(sorted(shard._client.mget.call_args[0][0]), expected)
+            shard._client.pipeline.return_value.execute.assert_called_once_with()
+            self.assertEqual(sorted(shard._client.delete.call_args[0]), expected)
+
+    def test_get_set_route_to_the_shard(self):
+        key = self.keys[0]
+        client = self.cache.shard(key)._client
+        client.get.return_value = self.cache.shard(key).dump_object({'id': 1})
+        self.assertEqual(self.cache.get(key), {'id': 1})
+        client.get.assert_called_once_with(key)
+        self.cache.set(key, {'id': 1}, timeout=60)
+        client.setex.assert_called_once_with(key, 60, mock.ANY)
+
+    def test_down_shard_is_skipped(self):
+        down = self.cache.shards[0]
+        down._client.get.side_effect = ShardDown()
+        down._client.mget.side_effect = ShardDown()
+        for shard in self.cache.shards[1:]:
+            shard._client.mget.side_effect = lambda keys: [
+                self.cache.shards[1].dump_object({'key': key}) for key in keys]
+
+        down_keys = [key for key in self.keys if self.cache.shard(key) is down]
+        self.assertIsNone(self.cache.get(down_keys[0]))
+        found = self.cache.get_many(self.keys)
+        self.assertEqual(sorted(found), sorted(set(self.keys) - set(down_keys)))
+
+        # the shard is left out until the retry interval elapsed
+        self.cache.set(down_keys[0], {'id': 1})
+        self.cache.delete_many(down_keys)
+        self.assertIsNone(self.cache.lock(down_keys[0]))
+        self.assertEqual(down._client.get.call_count, 1)
+        down._client.setex.assert_not_called()
+        down._client.delete.assert_not_called()
+
+        with mock.patch('gapipy.cache.time', return_value=time.time() + 31):
+            self.cache.delete(down_keys[0])
+        down._client.delete.assert_called_once_with(down_keys[0])
+
+    def test_lock_is_not_acquired_when_the_shard_goes_down(self):
+        key = self.keys[0]
+        self.cache.shard(key)._client.lock.return_value.acquire.side_effect = ShardDown()
+        self.assertFalse(self.cache.lock(key, timeout=10).acquire(blocking_timeout=1))
+
+    def test_purge_reports_the_running_total(self):
+        for shard in self.cache.shards:
+            shard._client.scan_iter.return_value = iter(['tours:1', 'tours:2'])
+        progress = mock.Mock()
+        self.assertEqual(self.cache.purge('tours:', progress=progress), 6)
+        self.assertEqual(progress.call_args_list, [mock.call(2), mock.call(4), mock.call(6)])
@@ -1,6 +1,8 @@
 import json
 import unittest
 
+from requests import HTTPError
+
 from gapipy.client import Client
 from gapipy.query import Query
 from gapipy.resources.base import Resource
@@ -128,3 +130,102 @@ class ClientTestCase(unittest.TestCase):
         https_retries = client_with_retries.requestor.adapters['https://'].max_retries.total
 
         self.assertEqual(https_retries, expected_retries)
+
+
+def record_metric(resource_name, metric, value):
+    record_metric.calls.append((resource_name, metric, value))
+
+
+record_metric.calls = []
+
+
+class CacheStatsTestCase(unittest.TestCase):
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_cache_stats(self, mock_request):
+        mock_request.side_effect = lambda uri, method, **kwargs: {'id': uri.split('/')[-1]}
+        gapi = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            cache_options={'serializer': 'json', 'threshold': 2, 'stripes': 1},
+        )
+
+        gapi.tour_dossiers.get(1)
+        gapi.tour_dossiers.get(1)
+        gapi.countries.get_many(['CA', 'FR'])
+        gapi.countries.get('CA')
+
+        stats = gapi.cache_stats()
+        self.assertEqual(sorted(stats), ['countries', 'tour_dossiers'])
+        self.assertEqual(
+            {metric: stats['tour_dossiers'][metric] for metric in ('hits', 'misses', 'sets', 'evictions')},
+            {'hits': 1, 'misses': 1, 'sets': 1, 'evictions': 1},
+        )
+        self.assertEqual(
+            {metric: stats['countries'][metric] for metric in ('hits', 'misses', 'sets', 'evictions')},
+            {'hits': 1, 'misses': 2, 'sets': 2, 'evictions': 0},
+        )
+        self.assertGreater(stats['countries']['lookup_time'], 0)
+        # the usage reported by SimpleCache.info
+        self.assertEqual((stats['countries']['entries'], stats['countries']['bytes']), (2, 32))
+        self.assertEqual((stats['tour_dossiers']['entries'], stats['tour_dossiers']['bytes']), (0, 0))
+
+        gapi.cache_stats(reset=True)
+        self.assertEqual(gapi.cache_stats()['countries']['hits'], 0)
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_tiered_cache(self, mock_request):
+        mock_request.side_effect = lambda uri, method, **kwargs: {'id': uri.split('/')[-1]}
+        gapi = Client(
+            cache_backend='gapipy.cache.TieredCache',
+            cache_options={'backend': 'gapipy.cache.SimpleCache', 'l1_threshold': 1},
+        )
+
+        gapi.countries.get('CA')
+        gapi.countries.get('FR')
+
+        # the L1 evictions and usage are reported
+        stats = gapi.cache_stats()['countries']
+        self.assertEqual((stats['sets'], stats['evictions'], stats['entries']), (2, 1, 1))
+        self.assertGreater(stats['bytes'], 0)
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_listings(self, mock_request):
+        mock_request.return_value = {'count': 0, 'results': [], 'links': []}
+        gapi = Client(cache_backend='gapipy.cache.SimpleCache', listing_cache_timeout=60)
+
+        gapi.tour_dossiers.filter(name='Peru').count()
+        gapi.tour_dossiers.filter(name='Peru').count()
+
+        # the listing pages and generation tokens count for their resource
+        stats = gapi.cache_stats()
+        self.assertEqual(sorted(stats), ['tour_dossiers'])
+        self.assertEqual(
+            {metric: stats['tour_dossiers'][metric] for metric in ('hits', 'misses', 'sets', 'entries')},
+            {'hits': 2, 'misses': 2, 'sets': 2, 'entries': 2},
+        )
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_negative_hits(self, mock_request):
+        response = mock.Mock(status_code=404)
+        mock_request.side_effect = HTTPError(response=response)
+        gapi = Client(cache_backend='gapipy.cache.SimpleCache', negative_cache_timeout=30)
+
+        self.assertIsNone(gapi.tours.get(404))
+        self.assertIsNone(gapi.tours.get(404))
+        stats = gapi.cache_stats()['tours']
+        self.assertEqual((stats['hits'], stats['negative_hits'], stats['misses']), (0, 1, 1))
+
+    @mock.patch('gapipy.request.APIRequestor._request', return_value={'id': 1})
+    def test_callback(self, mock_request):
+        record_metric.calls = []
+        gapi = Client(cache_backend='gapipy.cache.SimpleCache', cache_stats_callback='tests.test_client.record_metric')
+        gapi.tour_dossiers.get(1)
+        self.assertEqual(
+            sorted(call for call in record_metric.calls if call[1] != 'lookup_time'),
+            [('tour_dossiers', 'misses', 1), ('tour_dossiers', 'sets', 1)],
+        )
+
+        # a failing callback does not fail the request
+        gapi._cache_stats.callback = mock.Mock(side_effect=ValueError)
+        self.assertEqual(gapi.tour_dossiers.get(1).id, 1)
+        self.assertTrue(gapi._cache_stats.callback.called)
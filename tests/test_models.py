@@ -6,7 +6,11 @@ from unittest import TestCase
 
 import datetime
 
+from gapipy.client import Client
 from gapipy.models.valid_during_range import ValidDuringRange
+from gapipy.resources import Country, Departure
+
+from .fixtures import DUMMY_DEPARTURE
 
 
 def build_vrange(start, end):
@@ -236,3 +240,29 @@ class ValidDuringRangeTestCase(TestCase):
 
         # ... or both (where start >= end)
         self.assertTrue(build_vrange(today + a_week, today + a_week).is_valid_sometime())
+
+
+class CopyTestCase(TestCase):
+
+    def test_copy(self):
+        client = Client()
+        departure = Departure(DUMMY_DEPARTURE, client=client)
+        copy = departure._copy()
+
+        self.assertIsInstance(copy, Departure)
+        self.assertEqual(copy.to_dict(), departure.to_dict())
+        self.assertIs(copy._client, client)
+        self.assertIs(copy._raw_data, departure._raw_data)
+        # the nested models and mutable values are copied
+        self.assertIsNot(copy.tour_dossier, departure.tour_dossier)
+        self.assertTrue(copy.tour_dossier.is_stub)
+        self.assertIsNot(copy.lowest_pp2a_prices[0], departure.lowest_pp2a_prices[0])
+        self.assertIsNot(copy.availability, departure.availability)
+        copy.lowest_pp2a_prices[0].amount = 1
+        self.assertNotEqual(departure.lowest_pp2a_prices[0].amount, 1)
+
+        country = Country({'id': 'CA', 'states': [{'id': 'CA-ON'}]}, client=client)
+        states = country._copy().states
+        self.assertIsNot(states, country.states)
+        self.assertIs(states._raw_data, country.states._raw_data)
+        self.assertEqual(states.parent, country.states.parent)
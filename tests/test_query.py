@@ -1,10 +1,13 @@
 import json
 import sys
+import threading
+import time
 import unittest
 
 from requests import HTTPError, Response
 import requests.exceptions
 
+from gapipy.cache import CacheEntry
 from gapipy.client import Client
 from gapipy.exceptions import EmptyPartialUpdateError, TimeoutError
 from gapipy.query import Query
@@ -315,6 +318,16 @@ class QueryTestCase(unittest.TestCase):
         mock_request.assert_called_once_with(
             '/tour_dossiers', 'GET', params={})
 
+    @mock.patch('gapipy.request.APIRequestor._request', return_value=TOUR_DOSSIER_LIST_DATA)
+    def test_fetch_all_with_prefetch_pages(self, mock_request):
+        dossiers = list(Query(self.client, TourDossier).all(prefetch_pages=2))
+        self.assertEqual([d.id for d in dossiers], ['1234', '5678', '9012'])
+        mock_request.assert_called_once_with(
+            '/tour_dossiers', 'GET', params={})
+
+        with self.assertRaises(ValueError):
+            list(Query(self.client, TourDossier).all(prefetch_pages=-1))
+
     def test_fetch_all_with_negative_arg_for_limit(self):
         message = 'limit must be a positive integer'
         if sys.version_info.major < 3:
@@ -360,6 +373,14 @@ class QueryCacheTestCase(unittest.TestCase):
         query.get(21346)
         self.assertEqual(len(mock_request.mock_calls), 1)
 
+    def test_purge_all_cached(self):
+        self.cache.set_many({'tours:1': {'id': 1}, 'tours:2': {'id': 2}, 'tour_dossiers:1': {'id': 1}})
+        progress = mock.Mock()
+
+        self.assertEqual(Query(self.client, Tour).purge_all_cached(progress=progress), 2)
+        self.assertEqual(list(self.cache.get_many(['tours:1', 'tours:2', 'tour_dossiers:1'])), ['tour_dossiers:1'])
+        self.assertEqual(progress.call_args, mock.call(2))
+
     def test_cached_get_does_not_set(self):
         """
         Regression test https://github.com/gadventures/gapipy/issues/65
@@ -383,6 +404,414 @@ class QueryCacheTestCase(unittest.TestCase):
         self.assertEqual(len(mock_cache_get.mock_calls), 1)
         self.assertEqual(len(mock_cache_set.mock_calls), 0)
 
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_single_flight_coalesces_concurrent_misses(self, mock_request):
+        client = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            single_flight_options={'enable': True},
+        )
+        client._cache.clear()
+
+        def request(*args, **kwargs):
+            time.sleep(0.1)
+            return PPP_TOUR_DATA
+        mock_request.side_effect = request
+
+        tours = []
+        threads = [
+            threading.Thread(target=lambda: tours.append(Query(client, Tour).get(21346)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(mock_request.mock_calls), 1)
+        self.assertEqual([t.id for t in tours], ['21346'] * 5)
+
+    @mock.patch('gapipy.request.APIRequestor._request', return_value=PPP_TOUR_DATA)
+    def test_single_flight_distributed_rechecks_cache_under_lock(self, mock_request):
+        client = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            single_flight_options={'enable': True, 'distributed': True},
+        )
+        client._cache.clear()
+        key = Query(client, Tour).query_key(21346)
+
+        lock = mock.MagicMock()
+
+        def acquire(blocking_timeout=None):
+            # another process fills the cache while we wait for the lock
+            client._cache.set(key, dict(PPP_TOUR_DATA, product_line='XYZ'))
+            return True
+        lock.acquire.side_effect = acquire
+
+        with mock.patch.object(client._cache, 'lock', return_value=lock) as mock_lock:
+            tour = Query(client, Tour).get(21346)
+
+        mock_lock.assert_called_once_with(key, timeout=10.0)
+        self.assertEqual(tour.product_line, 'XYZ')
+        self.assertFalse(mock_request.called)
+        self.assertTrue(lock.release.called)
+
+    @mock.patch('gapipy.request.APIRequestor._request', return_value=PPP_TOUR_DATA)
+    def test_stale_while_revalidate(self, mock_request):
+        client = Client(cache_backend='gapipy.cache.SimpleCache', stale_while_revalidate=60)
+        client._cache.clear()
+        query = Query(client, Tour)
+        key = query.query_key(21346)
+
+        # fresh data is stored with a soft expiry, and kept for the grace period
+        query.get(21346)
+        entry = CacheEntry.load(client._cache.get(key))
+        self.assertFalse(entry.is_stale())
+        self.assertEqual(entry.data, PPP_TOUR_DATA)
+
+        # stale data is served right away, and refreshed in the background
+        stale = CacheEntry(dict(PPP_TOUR_DATA, product_line='OLD'), fresh_until=time.time() - 1)
+        client._cache.set(key, stale.dump())
+        mock_request.reset_mock()
+
+        self.assertEqual(query.get(21346).product_line, 'OLD')
+        for _ in range(100):
+            if not CacheEntry.load(client._cache.get(key)).is_stale():
+                break
+            time.sleep(0.01)
+        self.assertEqual(query.get(21346).product_line, 'PPP')
+        self.assertEqual(len(mock_request.mock_calls), 1)
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_negative_caching(self, mock_request):
+        not_found = Response()
+        not_found.status_code = 404
+        mock_request.side_effect = HTTPError(response=not_found)
+        client = Client(cache_backend='gapipy.cache.SimpleCache', negative_cache_timeout=30)
+        client._cache.clear()
+        query = Query(client, Tour)
+
+        with mock.patch.object(client._cache, 'set_many', wraps=client._cache.set_many) as mock_set_many:
+            self.assertIsNone(query.get(404))
+        mock_set_many.assert_called_once_with({'tours:404': mock.ANY}, timeout=30)
+        self.assertTrue(query.is_cached(404))
+
+        # the error is served from the cache
+        self.assertIsNone(query.get(404))
+        self.assertEqual(query.get_many([404]), [None])
+        with self.assertRaises(HTTPError) as cm:
+            query.get(404, httperrors_mapped_to_none=None)
+        self.assertEqual(cm.exception.response.status_code, 404)
+        with self.assertRaises(HTTPError):
+            query.get_many([404], httperrors_mapped_to_none=None)
+        self.assertEqual(len(mock_request.mock_calls), 1)
+
+        # unless the cache is bypassed
+        mock_request.side_effect = None
+        mock_request.return_value = PPP_TOUR_DATA
+        self.assertEqual(query.get(404, cached=False).product_line, 'PPP')
+        self.assertEqual(query.get(404).product_line, 'PPP')
+        self.assertEqual(len(mock_request.mock_calls), 2)
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_negative_caching_get_many(self, mock_request):
+        def request(uri, method, **kwargs):
+            response = Response()
+            response.status_code = int(uri.rsplit('/', 1)[1])
+            if response.status_code >= 400:
+                raise HTTPError(response=response)
+            return dict(PPP_TOUR_DATA, id=response.status_code)
+        mock_request.side_effect = request
+        client = Client(cache_backend='gapipy.cache.SimpleCache', negative_cache_timeout=30)
+        client._cache.clear()
+        query = Query(client, Tour)
+
+        self.assertEqual([t and t.id for t in query.get_many([200, 410, 403])], [200, None, None])
+        mock_request.reset_mock()
+        self.assertEqual([t and t.id for t in query.get_many([200, 410, 403])], [200, None, None])
+        self.assertFalse(mock_request.called)
+
+        # errors that are not negatively cached are raised, and not cached
+        with self.assertRaises(HTTPError):
+            query.get_many([500])
+        self.assertFalse(query.is_cached(500))
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_negative_caching_is_disabled_by_default(self, mock_request):
+        not_found = Response()
+        not_found.status_code = 404
+        mock_request.side_effect = HTTPError(response=not_found)
+        query = Query(self.client, Tour)
+
+        self.assertIsNone(query.get(404))
+        self.assertIsNone(query.get(404))
+        self.assertFalse(query.is_cached(404))
+        self.assertEqual(len(mock_request.mock_calls), 2)
+
+    @mock.patch('gapipy.request.APIRequestor._request', return_value=TOUR_DOSSIER_LIST_DATA)
+    def test_listing_cache(self, mock_request):
+        client = Client(cache_backend='gapipy.cache.SimpleCache', listing_cache_timeout=60)
+        client._cache.clear()
+        query = Query(client, TourDossier)
+
+        self.assertEqual(query.count(), 3)
+        self.assertEqual(query.first().id, '1234')
+        self.assertEqual(len(list(query.all())), 3)
+        self.assertEqual(len(mock_request.mock_calls), 1)
+
+        # filters are part of the key, whatever their order
+        query.filter(name='Peru', product_line='AHEH').count()
+        query.filter(product_line='AHEH').filter(name='Peru').count()
+        self.assertEqual(len(mock_request.mock_calls), 2)
+
+        query.purge_cached_listings()
+        query.count()
+        query.filter(name='Peru', product_line='AHEH').count()
+        self.assertEqual(len(mock_request.mock_calls), 4)
+
+    @mock.patch('gapipy.request.APIRequestor._make_call', return_value=TOUR_DOSSIER_LIST_DATA)
+    def test_listing_cache_with_uuid(self, mock_make_call):
+        client = Client(cache_backend='gapipy.cache.SimpleCache', listing_cache_timeout=60, uuid=True)
+        client._cache.clear()
+        query = Query(client, TourDossier).filter(name='Peru')
+
+        query.count()
+        query.count()
+        query.count()
+        self.assertEqual(len(mock_make_call.mock_calls), 1)
+        self.assertIn('uuid', mock_make_call.call_args[0][-2])
+        self.assertEqual(query._filters, {'name': 'Peru'})
+        self.assertEqual(client._cache.count(), 2)
+
+    @mock.patch('gapipy.request.APIRequestor._request', return_value=TOUR_DOSSIER_LIST_DATA)
+    def test_listing_cache_is_disabled_by_default(self, mock_request):
+        query = Query(self.client, TourDossier)
+        query.count()
+        query.count()
+        self.assertEqual(len(mock_request.mock_calls), 2)
+        self.assertEqual(self.cache.count(), 0)
+
+    def test_conditional_revalidation(self):
+        client = Client(cache_backend='gapipy.cache.SimpleCache', revalidation_window=600)
+        client._cache.clear()
+        client._requestor = mock.Mock()
+        query = Query(client, Tour)
+        key = query.query_key(21346)
+
+        ok = mock.Mock(status_code=200, headers={'ETag': '"v1"', 'Cache-Control': 'max-age=60'})
+        ok.json.return_value = PPP_TOUR_DATA
+        client._requestor.get.return_value = ok
+        with mock.patch.object(client._cache, 'set', wraps=client._cache.set) as mock_set:
+            query.get(21346)
+        mock_set.assert_called_once_with(key, mock.ANY, timeout=660)
+        entry = CacheEntry.load(client._cache.get(key))
+        self.assertEqual(entry.etag, '"v1"')
+        self.assertAlmostEqual(entry.fresh_until, time.time() + 60, delta=5)
+
+        # once expired, the entry is revalidated rather than downloaded again
+        entry.fresh_until = time.time() - 1
+        client._cache.set(key, entry.dump())
+        not_modified = mock.Mock(status_code=304, headers={'Cache-Control': 'max-age=60'})
+        client._requestor.get.return_value = not_modified
+
+        self.assertEqual(query.get(21346).product_line, 'PPP')
+        self.assertEqual(client._requestor.get.call_args[1]['headers']['If-None-Match'], '"v1"')
+        self.assertFalse(not_modified.json.called)
+        entry = CacheEntry.load(client._cache.get(key))
+        self.assertFalse(entry.is_stale())
+        self.assertEqual(entry.etag, '"v1"')
+
+        # fresh entries are served from the cache
+        query.get(21346)
+        self.assertEqual(client._requestor.get.call_count, 2)
+
+        # and so are they by get_many
+        entry.fresh_until = time.time() - 1
+        client._cache.set(key, entry.dump())
+        self.assertEqual(query.get_many([21346])[0].product_line, 'PPP')
+        self.assertEqual(client._requestor.get.call_count, 3)
+        self.assertEqual(client._requestor.get.call_args[1]['headers']['If-None-Match'], '"v1"')
+        self.assertFalse(CacheEntry.load(client._cache.get(key)).is_stale())
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_cache_timeouts(self, mock_request):
+        mock_request.side_effect = lambda uri, method, **kwargs: dict(
+            PPP_TOUR_DATA, id=uri.rsplit('/', 1)[1], product_line=uri.rsplit('/', 1)[1])
+        client = Client(cache_backend='gapipy.cache.SimpleCache', cache_timeouts={
+            'tours': lambda data: 0 if data['product_line'] == 'LIVE' else None,
+            'departures': 60,
+        })
+        client._cache.clear()
+
+        with mock.patch.object(client._cache, 'set', wraps=client._cache.set) as mock_set:
+            Query(client, Departure).get(1)
+            Query(client, Tour).get(2)
+            Query(client, Tour).get('LIVE')
+        self.assertEqual(
+            mock_set.call_args_list,
+            [mock.call('departures:1', mock.ANY, timeout=60), mock.call('tours:2', mock.ANY)],
+        )
+
+        with mock.patch.object(client._cache, 'set_many', wraps=client._cache.set_many) as mock_set_many:
+            Query(client, Tour).get_many([3, 'LIVE'])
+        mock_set_many.assert_called_once_with({'tours:3': mock.ANY}, timeout=None)
+
+    def test_cache_timeouts_with_stale_while_revalidate(self):
+        client = Client(stale_while_revalidate=30, cache_timeouts={'tours': 60})
+        value, timeout = Query(client, Tour)._cache_entry(PPP_TOUR_DATA)
+        self.assertEqual(timeout, 90)
+        self.assertAlmostEqual(CacheEntry.load(value).fresh_until, time.time() + 60, delta=5)
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_get_many(self, mock_request):
+        not_found = Response()
+        not_found.status_code = 404
+
+        def request(uri, method, **kwargs):
+            resource_id = uri.rsplit('/', 1)[1]
+            if resource_id == '404':
+                raise HTTPError(response=not_found)
+            return dict(PPP_TOUR_DATA, id=resource_id)
+        mock_request.side_effect = request
+
+        query = Query(self.client, Tour)
+        query.get(1)
+        mock_request.reset_mock()
+
+        tours = query.get_many([1, 2, 404, 3, 2])
+        self.assertEqual(
+            [t.id if t else None for t in tours], ['1', '2', None, '3', '2'])
+
+        # the cached tour and the repeated id were only requested once
+        requested = sorted(c[1][0] for c in mock_request.mock_calls)
+        self.assertEqual(requested, ['/tours/2', '/tours/3', '/tours/404'])
+        self.assertEqual(self.cache.count(), 3)
+
+        with self.assertRaises(HTTPError):
+            query.get_many([404], httperrors_mapped_to_none=None)
+
+    def test_get_many_variation_ids_length(self):
+        with self.assertRaises(ValueError):
+            Query(self.client, Tour).get_many([1, 2], variation_ids=[1])
+
+@mock.patch('gapipy.request.APIRequestor._request', return_value=DUMMY_DEPARTURE)
+class QueryObjectCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            object_cache_options={'enable': True},
+        )
+        self.client._cache.clear()
+        self.query = Query(self.client, Departure)
+
+    def test_resources_are_not_built_again(self, mock_request):
+        departure = self.query.get(1)
+        with mock.patch.object(Departure, '_fill_fields') as fill_fields:
+            first = self.query.get(1)
+            second = self.query.get(1)
+        self.assertFalse(fill_fields.called)
+        self.assertEqual(len(mock_request.mock_calls), 1)
+        self.assertEqual(first.to_dict(), departure.to_dict())
+        self.assertEqual(self.client.cache_stats()['departures']['object_hits'], 2)
+
+        # every get returns a copy, which can be changed independently
+        self.assertIsNot(first, second)
+        first.lowest_pp2a_prices[0].amount = 1
+        departure.sku = 'changed'
+        self.assertEqual(self.query.get(1).to_dict(), second.to_dict())
+
+    def test_changes_are_not_hidden(self, mock_request):
+        self.query.get(1)
+        self.query.purge_cached(1)
+        self.query.get(1)
+        self.assertEqual(len(mock_request.mock_calls), 2)
+
+        self.query.get(1, cached=False)
+        self.assertEqual(len(mock_request.mock_calls), 3)
+
+        # data set in the cache replaces the instance built from it
+        self.client._cache_set(self.query.query_key(1), dict(DUMMY_DEPARTURE, sku='other'))
+        self.assertEqual(self.query.get(1).sku, 'other')
+
+    def test_cache_timeouts(self, mock_request):
+        client = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            cache_timeouts={'departures': 0},
+            object_cache_options={'enable': True},
+        )
+        client.departures.get(1)
+        client.departures.get(1)
+        self.assertEqual(len(mock_request.mock_calls), 2)
+        self.assertEqual(len(client._object_cache), 0)
+
+        # a shorter policy caps the object cache timeout
+        client = Client(
+            cache_backend='gapipy.cache.SimpleCache',
+            cache_timeouts={'departures': 30},
+            object_cache_options={'enable': True, 'timeout': 60},
+        )
+        client.departures.get(1)
+        with mock.patch('gapipy.cache.time', return_value=time.time() + 31):
+            self.assertIsNone(client._object_cache.get(client.departures.query_key(1)))
+
+    def test_disabled_by_default(self, mock_request):
+        client = Client(cache_backend='gapipy.cache.SimpleCache')
+        self.assertIsNone(client._object_cache)
+        client.departures.get(1)
+        client.departures.get(1)
+        self.assertEqual(client.cache_stats()['departures']['object_hits'], 0)
+
+
+class QueryPrefetchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(cache_backend='gapipy.cache.SimpleCache')
+        self.client._cache.clear()
+
+    def _request(self, uri, method, **kwargs):
+        if uri == '/departures':
+            return {
+                'count': 3,
+                'results': [
+                    {'id': str(i), 'href': '/departures/{}'.format(i)} for i in (1, 2, 3)
+                ],
+                'links': [],
+            }
+        resource, resource_id = uri.strip('/').split('/')
+        if resource == 'departures':
+            # two departures of the same dossier, and one of another
+            dossier_id = '9882' if resource_id != '3' else '1234'
+            return dict(DUMMY_DEPARTURE, id=resource_id, tour_dossier={
+                'id': dossier_id, 'href': '/tour_dossiers/{}'.format(dossier_id)})
+        return {'id': resource_id, 'name': 'Dossier {}'.format(resource_id)}
+
+    @mock.patch('gapipy.request.APIRequestor._request')
+    def test_prefetch_resolves_stubs_in_batches(self, mock_request):
+        mock_request.side_effect = self._request
+
+        departures = list(
+            Query(self.client, Departure).prefetch('self', 'tour_dossier').all())
+
+        self.assertEqual(len(mock_request.mock_calls), 6)
+        self.assertTrue(all(not d.is_stub and not d.tour_dossier.is_stub for d in departures))
+        self.assertEqual(departures[2].tour_dossier.name, 'Dossier 1234')
+
+        # nothing is left to fetch lazily
+        self.assertEqual(len(mock_request.mock_calls), 6)
+        requested = sorted(c[1][0] for c in mock_request.mock_calls)
+        self.assertEqual(requested, [
+            '/departures', '/departures/1', '/departures/2', '/departures/3',
+            '/tour_dossiers/1234', '/tour_dossiers/9882',
+        ])
+
+    def test_prefetch_unknown_field(self):
+        with self.assertRaises(ValueError):
+            Query(self.client, Departure).prefetch('not_a_field')
+
+    def test_prefetch_is_kept_by_filter(self):
+        query = Query(self.client, Departure).prefetch('self').filter(tour_dossier_id=1)
+        self.assertEqual(query._prefetch, ('self',))
+
 
 class MockResource(Resource):
     _as_is_fields = ['id', 'first_name', 'last_name']
@@ -1,11 +1,13 @@
+import itertools
 import sys
+import time
 import unittest
 import requests
 
 from gapipy.client import Client
 from gapipy.exceptions import TimeoutError
 from gapipy.models.base import _Parent
-from gapipy.request import APIRequestor
+from gapipy.request import APIRequestor, PageCursor, _cache_validators, _read_ahead
 
 from .fixtures import FIRST_PAGE_LIST_DATA, SECOND_PAGE_LIST_DATA
 
@@ -103,6 +105,111 @@ class APIRequestorTestCase(unittest.TestCase):
         self.assertEqual(mock_list.mock_calls, expected_calls)
         self.assertEqual(len(resources), 6)
 
+    @mock.patch('gapipy.request.APIRequestor.list_raw')
+    def test_list_generator_does_not_recurse(self, mock_list):
+        # one page per result, well past the default recursion limit
+        pages = 3 * sys.getrecursionlimit()
+
+        def page(uri):
+            number = int(uri.split('=')[1]) if uri else 1
+            links = []
+            if number < pages:
+                links.append({'rel': 'next', 'href': '/resources?page={}'.format(number + 1)})
+            return {'results': [{'id': number}], 'links': links}
+        mock_list.side_effect = page
+
+        cursor = PageCursor()
+        requestor = APIRequestor(self.client, self.resources)
+        resources = list(requestor.list(cursor=cursor))
+
+        self.assertEqual(len(resources), pages)
+        self.assertEqual(cursor.page, pages)
+        self.assertEqual(cursor.items_seen, pages)
+        self.assertEqual(cursor.href, '/resources?page={}'.format(pages))
+
+    @mock.patch('gapipy.request.APIRequestor.list_raw')
+    def test_list_generator_resumes_from_cursor(self, mock_list):
+        mock_list.side_effect = [FIRST_PAGE_LIST_DATA, SECOND_PAGE_LIST_DATA]
+        requestor = APIRequestor(self.client, self.resources)
+
+        cursor = PageCursor()
+        listing = requestor.list(cursor=cursor)
+        first = [next(listing)['id'] for _ in range(4)]
+        self.assertEqual(first, ['1234', '5678', '9012', '3456'])
+        self.assertEqual((cursor.page, cursor.offset, cursor.items_seen), (2, 1, 4))
+
+        # a new listing with the same cursor picks up after the last result
+        mock_list.side_effect = [SECOND_PAGE_LIST_DATA]
+        rest = [r['id'] for r in requestor.list(cursor=cursor)]
+        self.assertEqual(rest, ['7890', '1111'])
+        self.assertEqual(mock_list.call_args, mock.call('http://localhost:5000/resources/?page=2'))
+        self.assertEqual(cursor.items_seen, 6)
+
+    @mock.patch('gapipy.request.APIRequestor.list_raw')
+    def test_list_generator_prefetch_pages(self, mock_list):
+        mock_list.side_effect = [FIRST_PAGE_LIST_DATA, SECOND_PAGE_LIST_DATA]
+
+        cursor = PageCursor()
+        requestor = APIRequestor(self.client, self.resources)
+        resources = list(requestor.list(cursor=cursor, prefetch_pages=1))
+
+        self.assertEqual(
+            [r['id'] for r in resources],
+            ['1234', '5678', '9012', '3456', '7890', '1111'])
+        self.assertEqual((cursor.page, cursor.items_seen), (2, 6))
+
+    @mock.patch('gapipy.request.APIRequestor.list_raw')
+    def test_list_generator_parallel(self, mock_list):
+        # 7 results over 4 pages of 2
+        def page(uri):
+            number = int(uri.rsplit('=', 1)[1]) if uri else 1
+            ids = [i for i in (2 * number - 1, 2 * number) if i <= 7]
+            links = [{'rel': 'next', 'href': '/resources?tour=1&page=2'}] if number == 1 else []
+            return {'count': 7, 'max_per_page': 2, 'results': [{'id': i} for i in ids], 'links': links}
+        mock_list.side_effect = page
+
+        cursor = PageCursor()
+        requestor = APIRequestor(self.client, self.resources)
+        resources = list(requestor.list(cursor=cursor, parallel=3))
+
+        self.assertEqual([r['id'] for r in resources], [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(len(mock_list.mock_calls), 4)
+        self.assertIn(mock.call('/resources?tour=1&page=4'), mock_list.mock_calls)
+        self.assertEqual((cursor.page, cursor.items_seen), (4, 7))
+
+    @mock.patch('gapipy.request.APIRequestor.list_raw')
+    def test_list_generator_parallel_follows_unplannable_links(self, mock_list):
+        first_page = dict(FIRST_PAGE_LIST_DATA, links=[{'rel': 'next', 'href': '/resources/next'}])
+        mock_list.side_effect = [first_page, SECOND_PAGE_LIST_DATA]
+
+        requestor = APIRequestor(self.client, self.resources)
+        resources = list(requestor.list(parallel=2))
+
+        self.assertEqual(len(resources), 6)
+        self.assertEqual(mock_list.call_args, mock.call('/resources/next'))
+
+    def test_read_ahead_buffers_and_reraises(self):
+        consumed = []
+
+        def pages():
+            for number in range(5):
+                consumed.append(number)
+                yield number
+            raise ValueError('boom')
+
+        listing = _read_ahead(pages(), 2)
+        self.assertEqual(next(listing), 0)
+        # the worker fills the buffer while the caller holds the first item
+        for _ in range(50):
+            if len(consumed) >= 3:
+                break
+            time.sleep(0.01)
+        self.assertGreaterEqual(len(consumed), 3)
+
+        self.assertEqual(list(itertools.islice(listing, 4)), [1, 2, 3, 4])
+        with self.assertRaises(ValueError):
+            next(listing)
+
     @mock.patch('gapipy.request.APIRequestor._request')
     def test_uuid_not_set(self, mock_request):
         self.client.uuid = False
@@ -214,3 +321,25 @@ class APIRequestorTestCase(unittest.TestCase):
         requestor = APIRequestor(self.client, self.resources)
         with self.assertRaises(requests.exceptions.Timeout):
             requestor._request('/foo', 'GET')
+
+    def test_get_conditional(self):
+        response = requests.Response()
+        response.status_code = 304
+        response.headers.update({'ETag': '"v2"', 'Cache-Control': 'public, max-age=120'})
+        self.client._requestor = mock.Mock()
+        self.client._requestor.get.return_value = response
+
+        requestor = APIRequestor(self.client, self.resources)
+        data, validators = requestor.get_conditional(1234, etag='"v1"', last_modified='Tue, 01 Jun 2021 00:00:00 GMT')
+        self.assertIsNone(data)
+        self.assertEqual(validators, {'etag': '"v2"', 'last_modified': None, 'max_age': 120})
+
+        url, kwargs = self.client._requestor.get.call_args
+        self.assertEqual(url, ('https://rest.gadventures.com/resources/1234',))
+        self.assertEqual(kwargs['headers']['If-None-Match'], '"v1"')
+        self.assertEqual(kwargs['headers']['If-Modified-Since'], 'Tue, 01 Jun 2021 00:00:00 GMT')
+
+    def test_cache_validators(self):
+        self.assertEqual(_cache_validators({}), {'etag': None, 'last_modified': None, 'max_age': None})
+        self.assertEqual(_cache_validators({'Cache-Control': 'no-cache'})['max_age'], None)
+        self.assertEqual(_cache_validators({'Cache-Control': 'max-age=0, must-revalidate'})['max_age'], 0)
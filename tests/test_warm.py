@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from gapipy.cache import SimpleCache
+from gapipy.client import Client
+from gapipy.warm import main, warm
+
+from .fixtures import TOUR_DOSSIER_LIST_DATA
+
+try:
+    from unittest import mock  # Python 3
+except ImportError:
+    import mock  # Python 2
+
+
+def _api(uri, method, params=None, **kwargs):
+    if uri == '/tour_dossiers':
+        return TOUR_DOSSIER_LIST_DATA
+    resource_name, resource_id = uri.strip('/').split('/')
+    data = {'id': resource_id, 'href': 'http://localhost:5000' + uri}
+    if resource_name == 'tour_dossiers':
+        data['tour'] = {'id': 'T' + resource_id, 'href': 'http://localhost:5000/tours/T' + resource_id}
+    return data
+
+
+class Interrupted(Exception):
+    pass
+
+
+@mock.patch('gapipy.request.APIRequestor._request', side_effect=_api)
+class WarmTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(cache_backend='gapipy.cache.SimpleCache')
+
+    def _requested(self, mock_request):
+        return [call[0][0] for call in mock_request.call_args_list]
+
+    def test_warm(self, mock_request):
+        report = warm(self.client, ['tour_dossiers'], related={'tour_dossiers': ['tour']}, batch_size=2)
+
+        self.assertEqual((report.loaded, report.related), (3, 3))
+        self.assertEqual(report.counts, {'tour_dossiers': 3, 'tours': 3})
+        for key in ('tour_dossiers:1234', 'tour_dossiers:9012', 'tours:T5678'):
+            self.assertTrue(self.client._cache.is_cached(key))
+
+        # cached resources are not requested again, unless forced
+        mock_request.reset_mock()
+        warm(self.client, ['tour_dossiers'])
+        self.assertEqual(self._requested(mock_request), ['/tour_dossiers'])
+
+        mock_request.reset_mock()
+        warm(self.client, ['tour_dossiers'], force=True)
+        self.assertEqual(len(self._requested(mock_request)), 4)
+
+    def test_filters(self, mock_request):
+        warm(self.client, ['tour_dossiers'], filters={'tour_dossiers': {'name': 'Peru'}})
+        self.assertEqual(mock_request.call_args_list[0], mock.call('/tour_dossiers', 'GET', params={'name': 'Peru'}))
+
+    def test_resume(self, mock_request):
+        state = {}
+
+        def progress(report):
+            raise Interrupted()
+
+        with self.assertRaises(Interrupted):
+            warm(self.client, ['tour_dossiers'], batch_size=2, state=state, progress=progress)
+        self.assertEqual(state['tour_dossiers']['items_seen'], 2)
+        self.assertFalse(state['tour_dossiers']['done'])
+
+        self.client._cache.clear()
+        report = warm(self.client, ['tour_dossiers'], batch_size=2, state=state)
+        self.assertEqual(report.loaded, 1)
+        self.assertTrue(self.client._cache.is_cached('tour_dossiers:9012'))
+        self.assertFalse(self.client._cache.is_cached('tour_dossiers:1234'))
+        self.assertTrue(state['tour_dossiers']['done'])
+
+        # completed listings are skipped
+        mock_request.reset_mock()
+        warm(self.client, ['tour_dossiers'], state=state)
+        self.assertFalse(mock_request.called)
+
+    def test_async_client(self, mock_request):
+        with self.assertRaises(ValueError):
+            warm(mock.Mock(is_async=True), ['tour_dossiers'])
+
+
+@mock.patch('gapipy.request.APIRequestor._request', side_effect=_api)
+class WarmCommandTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_main(self, mock_request):
+        path = os.path.join(self.tmp_dir, 'warm.json')
+        main([
+            'tour_dossiers',
+            '--related', 'tour_dossiers:tour',
+            '--filter', 'tour_dossiers:name=Peru',
+            '--cache-backend', 'gapipy.cache.SimpleCache',
+            '--state', path,
+        ])
+        self.assertEqual(mock_request.call_args_list[0], mock.call('/tour_dossiers', 'GET', params={'name': 'Peru'}))
+        self.assertEqual(len(mock_request.call_args_list), 7)
+        with open(path) as f:
+            self.assertTrue(json.load(f)['tour_dossiers']['done'])
+
+    @mock.patch('gapipy.client.Client._set_cache_instance', autospec=True)
+    def test_cache_options(self, set_cache_instance, mock_request):
+        def set_cache(client, options):
+            client._cache = SimpleCache(**options)
+        set_cache_instance.side_effect = set_cache
+
+        main([
+            'tour_dossiers',
+            '--cache-backend', 'gapipy.cache.SimpleCache',
+            '--cache-option', 'default_timeout=60',
+            '--cache-option', 'threshold=100',
+            '--cache-option', 'serializer=json',
+        ])
+        set_cache_instance.assert_called_once_with(
+            mock.ANY, {'default_timeout': 60, 'threshold': 100, 'serializer': 'json'})
+
+    def test_invalid_arguments(self, mock_request):
+        with self.assertRaises(SystemExit):
+            main(['tour_dossiers', '--related', 'tour'])
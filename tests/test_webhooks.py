@@ -0,0 +1,144 @@
+import json
+import unittest
+
+from gapipy.client import Client
+from gapipy.exceptions import InvalidSignatureError
+from gapipy.utils import compute_request_signature
+from gapipy.webhooks import WebhookEvent, WebhookProcessor, parse_events
+
+try:
+    from unittest import mock  # Python 3
+except ImportError:
+    import mock  # Python 2
+
+
+def _event(resource, resource_id, created='2021-06-01T12:00:00Z', event_type=None):
+    return {
+        'event_type': event_type or '{0}.updated'.format(resource),
+        'resource': resource,
+        'data': {
+            'id': resource_id,
+            'href': 'https://rest.gadventures.com/{0}/{1}'.format(resource, resource_id),
+        },
+        'created': created,
+    }
+
+
+class ParseEventsTestCase(unittest.TestCase):
+
+    def test_parse_events(self):
+        body = json.dumps([_event('departures', 123), _event('tours', '21346')]).encode('utf-8')
+        self.assertEqual(parse_events(body), [
+            WebhookEvent('departures.updated', 'departures', '123', None, '2021-06-01T12:00:00Z'),
+            WebhookEvent('tours.updated', 'tours', '21346', None, '2021-06-01T12:00:00Z'),
+        ])
+
+    def test_parse_single_event_without_resource(self):
+        event = _event('departures', 123)
+        del event['resource']
+        self.assertEqual(parse_events(json.dumps(event))[0].resource, 'departures')
+
+    def test_events_without_id_are_skipped(self):
+        event = _event('departures', 123)
+        del event['data']['id']
+        self.assertEqual(parse_events(json.dumps([event])), [])
+
+
+class WebhookProcessorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client(
+            application_key='live_abcd',
+            cache_backend='gapipy.cache.SimpleCache',
+            listing_cache_timeout=60,
+        )
+        self.processor = WebhookProcessor(self.client)
+
+    def _process(self, events):
+        body = json.dumps(events).encode('utf-8')
+        return self.processor.process(body, compute_request_signature('live_abcd', body))
+
+    def test_verify(self):
+        body = b'[]'
+        self.processor.verify(body, compute_request_signature('live_abcd', body))
+        with self.assertRaises(InvalidSignatureError):
+            self.processor.verify(body, compute_request_signature('live_other', body))
+        with self.assertRaises(InvalidSignatureError):
+            self.processor.verify(body, None)
+
+    def test_process_purges_resources_and_listings(self):
+        cache = self.client._cache
+        cache.set('departures:1', {'id': 1})
+        cache.set('departures:2', {'id': 2})
+        cache.set('departures:3', {'id': 3})
+
+        with mock.patch('gapipy.query.Query.purge_cached_listings', autospec=True) as purge:
+            handled = self._process([_event('departures', 1), _event('departures', 2)])
+
+        self.assertEqual([event.id for event in handled], ['1', '2'])
+        self.assertIsNone(cache.get('departures:1'))
+        self.assertIsNone(cache.get('departures:2'))
+        self.assertEqual(cache.get('departures:3'), {'id': 3})
+        self.assertEqual([call[0][0].resource._resource_name for call in purge.call_args_list], ['departures'])
+
+    def test_dependencies(self):
+        processor = WebhookProcessor(self.client, dependencies={'departures': ['tour_dossiers']})
+        with mock.patch('gapipy.query.Query.purge_cached_listings', autospec=True) as purge:
+            processor.handle(parse_events(json.dumps([_event('departures', 1)])))
+        self.assertEqual(
+            sorted(call[0][0].resource._resource_name for call in purge.call_args_list),
+            ['departures', 'tour_dossiers'],
+        )
+
+    def test_batches(self):
+        processor = WebhookProcessor(self.client, batch_size=2)
+        events = parse_events(json.dumps([_event('departures', i) for i in range(5)]))
+        with mock.patch.object(processor, '_handle_batch') as handle_batch:
+            processor.handle(events)
+        self.assertEqual(
+            sorted(len(call[0][1]) for call in handle_batch.call_args_list),
+            [1, 2, 2],
+        )
+
+    def test_unknown_resources_are_ignored(self):
+        handled = self._process([_event('not_a_resource', 1)])
+        self.assertEqual(len(handled), 1)
+
+    @mock.patch('gapipy.webhooks.time', return_value=1622552400)  # 2021-06-01T13:00:00Z
+    def test_deduplicates_bursts(self, _):
+        handled = self._process([_event('departures', 1), _event('departures', 1)])
+        self.assertEqual(len(handled), 1)
+
+        # a redelivery of an event older than the last purge is skipped
+        self.assertEqual(self._process([_event('departures', 1)]), [])
+
+        # but a later change is not
+        handled = self._process([_event('departures', 1, created='2021-06-01T14:00:00Z')])
+        self.assertEqual(len(handled), 1)
+
+    @mock.patch('gapipy.webhooks.time', return_value=1622552400)  # 2021-06-01T13:00:00Z
+    def test_failed_delivery_is_retried(self, _):
+        cache = self.client._cache
+        cache.set('departures:1', {'id': 1})
+
+        with mock.patch.object(self.client, '_cache_delete_many', side_effect=IOError):
+            with self.assertRaises(IOError):
+                self._process([_event('departures', 1)])
+        self.assertEqual(cache.get('departures:1'), {'id': 1})
+
+        # the redelivery is not dropped as a duplicate
+        self.assertEqual(len(self._process([_event('departures', 1)])), 1)
+        self.assertIsNone(cache.get('departures:1'))
+
+    def test_refresh(self):
+        processor = WebhookProcessor(self.client, refresh=True)
+        events = parse_events(json.dumps([_event('departures', 1), _event('departures', 2)]))
+        with mock.patch('gapipy.query.Query.get_many', autospec=True) as get_many:
+            processor.handle(events)
+        get_many.assert_called_once_with(
+            mock.ANY, ['1', '2'], variation_ids=[None, None], cached=False)
+
+    def test_refresh_is_not_supported_with_an_async_client(self):
+        client = mock.Mock(is_async=True)
+        with self.assertRaises(ValueError):
+            WebhookProcessor(client, refresh=True)